@@ -12,7 +12,6 @@ import signal
 import time
 import json
 import requests
-import sys
 import traceback
 from copy import deepcopy
 
@@ -392,6 +391,7 @@ class CassandraStats(object):
         self.port = 8778
         self.keyspaces = []
         self.previousData = {}
+        self.breaker = CircuitBreaker("Cassandra jolokia agent")
 
     def config(self, cfg):
         """Initializes variables from conf files."""
@@ -437,6 +437,9 @@ class CassandraStats(object):
         :return: Metric value
         """
 
+        # Once the agent failed in this poll the remaining metrics are not requested
+        if self.breaker.state == CircuitBreaker.OPEN:
+            return
         auth = requests.auth.HTTPBasicAuth(self.user, self.password) \
             if self.user is not None and self.password is not None else None
 
@@ -444,13 +447,15 @@ class CassandraStats(object):
             resp = requests.get(
                 format_str.format(jmx_domain=jmx_domain, jmx_type=jmx_type, jmx_scope=jmx_scope, jmx_path=jmx_path,
                                   jmx_keyspace=jmx_keyspace, host=self.host, name=name, port=self.port),
-                auth=auth
+                auth=auth, timeout=CASSANDRA_TIMEOUT
             )
-        except requests.exceptions.ConnectionError:
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
             collectd.error(
                 "The application recieved a connection error, failed to connect jolokia JVM agent"
             )
-            sys.exit(1)
+            self.breaker.failure()
+            return
+        self.breaker.success()
         if resp.status_code >= 400 or resp.json().get("error"):
             collectd.error("ERROR the jolokia agent returned an error trying to access the following metric")
             collectd.error(format_str.format(jmx_domain=jmx_domain, jmx_type=jmx_type, jmx_scope=jmx_scope, jmx_path=jmx_path,
@@ -721,9 +726,16 @@ class CassandraStats(object):
         Collect cassandrStats, jvmStats and keyspaceStats using jolokia JVM agent
         :return: Dict contains cassandra stats, jvm stats and keyspace stats
         """
+        # Metrics missed once the agent dropped out are read as 0, so such a poll must not become
+        # the previous data: the next poll diffs against the last complete one instead
+        previous_data = deepcopy(self.previousData)
         cassandra_details = self.get_cassandra_details()
         jvm_details = self.get_jvm_details(cassandra_details)
         final_cassandra_details = self.get_keyspace_details(jvm_details)
+        if self.breaker.state != CircuitBreaker.CLOSED:
+            self.previousData = previous_data
+            self.pollCounter -= 1
+            return {}
 
         #Adding common parameters to the collected stats
         if final_cassandra_details:
@@ -744,14 +756,30 @@ class CassandraStats(object):
             collectd.info("final details are : %s" % details)
             dispatch(details)
 
+    def dispatch_connection_state(self):
+        """Dispatches the breaker state while the jolokia agent can not be reached."""
+        cassandra_dict = self.breaker.get_metrics()
+        self.add_common_params(CASSANDRA_STATS, cassandra_dict)
+        self.dispatch_data({CASSANDRA_STATS: cassandra_dict})
+
     def read(self):
         try:
+            # An unreachable agent is retried with a backoff on later polls
+            if not self.breaker.allow():
+                self.dispatch_connection_state()
+                return
             self.pollCounter += 1
             # collect data
             dict_cassandra = self.collect_data()
+            if self.breaker.state != CircuitBreaker.CLOSED:
+                collectd.error("Plugin CASSANDRA: Jolokia agent unreachable, skipping this poll.")
+                self.dispatch_connection_state()
+                return
             if not dict_cassandra:
                 collectd.error("Plugin CASSANDRA: Unable to fetch data for CASSANDRA.")
                 return
+            if CASSANDRA_STATS in dict_cassandra:
+                dict_cassandra[CASSANDRA_STATS].update(self.breaker.get_metrics())
 
             # dispatch data to collectd, copying by value
             self.dispatch_data(deepcopy(dict_cassandra))
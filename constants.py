@@ -55,10 +55,30 @@ RX_RATE = "rx_Rate"
 TX_RATE = "tx_Rate"
 NIC_NAME = "_nicName"
 NIC_TYPE = "_nicType"
+DUPLEX = "duplex"
+DRIVER = "driver"
+PROC_NET_DEV = "/proc/net/dev"
+SYS_CLASS_NET = "/sys/class/net"
+# The static attributes of an interface are reread when one of these sysfs attributes changes
+NET_SIGNATURE_ATTRS = ("ifindex", "flags", "mtu", "carrier_changes")
+IFF_UP = 0x1
+SIOCGIFADDR = 0x8915
 
 DEFAULT_INTERVAL = 10
 TIME_DIFF_FACTOR = 3
 FLOATING_FACTOR = 2
+# Reconnect backoff of the circuit breaker, in seconds, doubled on every consecutive failure
+BREAKER_BASE_BACKOFF = 5
+BREAKER_MAX_BACKOFF = 300
+
+# Shared /proc snapshot constants, a file is read and parsed once per tick (seconds) for all collectors
+PROC_SNAPSHOT_TICK = 1
+PROC_STAT = "/proc/stat"
+PROC_MEMINFO = "/proc/meminfo"
+PROC_NET_SNMP = "/proc/net/snmp"
+PROC_TCP_WMEM = "/proc/sys/net/ipv4/tcp_wmem"
+PROC_TCP_RMEM = "/proc/sys/net/ipv4/tcp_rmem"
+CPU_TIME_FIELDS = ("user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal", "guest", "guest_nice")
 
 # CPU_Util Plugin Constants
 CPU = "cpu_util"
@@ -72,6 +92,22 @@ LOW_RANGE_BEGIN = 0.0
 LOW_RANGE_END = 10.0
 MEDIUM_RANGE_END = 40.0
 HIGH_RANGE_END = 100.0
+LLC_MISS_RATE = "LLCMissRate"
+IPC = "IPC"
+BRANCH_MISS_RATE = "branchMissRate"
+SYS_CPU_ONLINE = "/sys/devices/system/cpu/online"
+SYS_CPU_FREQ = "/sys/devices/system/cpu/cpu%d/cpufreq/scaling_cur_freq"
+PROC_CPUINFO = "/proc/cpuinfo"
+# perf_event_attr of the first kernel version, enough for counting events
+PERF_ATTR_SIZE = 64
+# PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING, to scale multiplexed counters
+PERF_READ_FORMAT = 0x3
+PERF_TYPE_HARDWARE = 0
+PERF_TYPE_HW_CACHE = 3
+# name -> (type, config), cache events are PERF_COUNT_HW_CACHE_LL | op << 8 | result << 16
+PERF_LLC_EVENTS = {"llcLoads": (PERF_TYPE_HW_CACHE, 0x2), "llcLoadMisses": (PERF_TYPE_HW_CACHE, 0x10002)}
+PERF_EXTRA_EVENTS = {"ipc": {"cycles": (PERF_TYPE_HARDWARE, 0), "instructions": (PERF_TYPE_HARDWARE, 1)},
+                     "branch": {"branches": (PERF_TYPE_HARDWARE, 4), "branchMisses": (PERF_TYPE_HARDWARE, 5)}}
 
 # Ram_Util Plugin Constants
 RAM = "ram_util"
@@ -90,6 +126,39 @@ WRITE_TCPWIN_MEDIUM = "writeTcpWinMedium"
 WRITE_TCPWIN_HIGH = "writeTcpWinHigh"
 TCPRESET = "tcpReset"
 TCPRETRANS = "tcpRetrans"
+PROC_NET_NETSTAT = "/proc/net/netstat"
+# (/proc/net/netstat protocol, field, reported key), fields missing on older kernels are skipped
+TCP_EXT_FIELDS = (("TcpExt", "ListenOverflows", "listenOverflows"), ("TcpExt", "ListenDrops", "listenDrops"),
+                  ("TcpExt", "TCPReqQFullDrop", "tcpReqQFullDrop"), ("TcpExt", "TCPBacklogDrop", "tcpBacklogDrop"),
+                  ("TcpExt", "SyncookiesSent", "syncookiesSent"), ("TcpExt", "TCPTimeouts", "tcpTimeouts"),
+                  ("TcpExt", "TCPFastRetrans", "tcpFastRetrans"),
+                  ("TcpExt", "TCPSlowStartRetrans", "tcpSlowStartRetrans"),
+                  ("TcpExt", "TCPSynRetrans", "tcpSynRetrans"), ("TcpExt", "TCPLostRetransmit", "tcpLostRetransmit"),
+                  ("TcpExt", "TCPRetransFail", "tcpRetransFail"), ("TcpExt", "TCPAbortOnTimeout", "tcpAbortOnTimeout"),
+                  ("TcpExt", "TCPAbortOnData", "tcpAbortOnData"), ("TcpExt", "TCPAbortOnMemory", "tcpAbortOnMemory"),
+                  ("IpExt", "InOctets", "ipInOctets"), ("IpExt", "OutOctets", "ipOutOctets"),
+                  ("IpExt", "InNoRoutes", "ipInNoRoutes"))
+# NETLINK_SOCK_DIAG dump of the TCP sockets, see linux/sock_diag.h and linux/inet_diag.h
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+INET_DIAG_INFO = 2
+TCP_DIAG_TIMEOUT = 5
+TCP_DIAG_RECV_SIZE = 65536
+# struct tcp_info offsets of tcpi_rtt (microseconds) and tcpi_snd_cwnd (segments)
+TCP_INFO_RTT_OFFSET = 68
+TCP_INFO_CWND_OFFSET = 80
+TCP_LISTEN = 10
+TCP_STATES = {1: "tcpEstablished", 2: "tcpSynSent", 3: "tcpSynRecv", 4: "tcpFinWait1", 5: "tcpFinWait2",
+              6: "tcpTimeWait", 7: "tcpClose", 8: "tcpCloseWait", 9: "tcpLastAck", 10: "tcpListen", 11: "tcpClosing",
+              12: "tcpNewSynRecv"}
+# Power of two rtt histogram buckets in microseconds, and how many listening ports are reported
+TCP_RTT_BUCKETS = 32
+TCP_MAX_LISTEN_PORTS = 20
+TCP_LISTEN_PORTS = "listenPorts"
 
 # CPU_Static Plugin Constants
 CPU_STATIC = "cpu_static"
@@ -124,6 +193,26 @@ USAGE = "usage"
 SWAP = "SWAP"
 DISK_TYPE = "_diskType"
 DISK_NAME = "_diskName"
+PART = "part"
+READMERGES = "readMerges"
+WRITEMERGES = "writeMerges"
+AVGREQUESTSIZE = "avgRqSize"
+AWAIT = "await"
+READAWAIT = "readAwait"
+WRITEAWAIT = "writeAwait"
+SVCTM = "svcTime"
+UTIL = "util"
+PROC_UPTIME = "/proc/uptime"
+# /proc/diskstats counts sectors of 512 bytes whatever the device sector size
+DISKSTATS_SECTOR_SIZE = 512
+SYS_CLASS_BLOCK = "/sys/class/block"
+PROC_MOUNTS = "/proc/self/mounts"
+PROC_SWAPS = "/proc/swaps"
+PROC_MOUNTINFO = "/proc/self/mountinfo"
+# Network filesystems are kept in the mount table but their statvfs runs in a side thread
+NETWORK_FS = ("nfs", "nfs4", "cifs", "smbfs", "smb3", "ceph", "glusterfs", "fuse.glusterfs", "fuse.sshfs", "9p",
+              "afs", "lustre")
+STATVFS_TIMEOUT = 2
 
 INDEX_FILE = "index.txt"
 INDEX_NEW_FILE = "-1"
@@ -137,6 +226,15 @@ BITFACTOR = 8
 
 #MONGO CONSTANTS
 MONGO = "mongod"
+MONGO_TIMEOUT_MS = 5000
+MONGO_COLLSTATS_WORKERS = 8
+MONGO_PROFILE_MAX_DOCS = 5000
+MONGO_PROFILE_BATCH_SIZE = 500
+MONGO_SLOW_QUERY_TOP = 20
+MONGO_SLOW_QUERY_MAX_SHAPES = 1000
+MONGO_QUERY_SHAPE_LEN = 512
+MONGO_OTHER_SHAPE = "other"
+MONGO_PROFILE_FIELDS = {"ts": 1, "ns": 1, "op": 1, "millis": 1, "command": 1, "query": 1}
 
 # MYSQL CONSTANTS
 
@@ -148,27 +246,29 @@ TABLE_DETAILS = "tableDetails"
 DB_DETAILS = "db_details"
 MYSQL = "mysql"
 server_query = 'SELECT count(*) FROM information_schema.SCHEMATA where schema_name not in ("information_schema", "mysql", "performance_schema")'
-server_details_query = "select * from performance_schema.global_status where VARIABLE_NAME like 'connections' or VARIABLE_NAME like 'aborted_connects'\
-                        or VARIABLE_NAME like 'threads_connected' or VARIABLE_NAME like 'threads_cached' or VARIABLE_NAME like 'threads_created'\
-                        or VARIABLE_NAME like 'threads_running' or VARIABLE_NAME like 'uptime' or VARIABLE_NAME like 'bytes_received'\
-			or VARIABLE_NAME like 'bytes_sent'"
-table_query = "select table_name as '_tableName' ,table_schema as '_dbName', ENGINE as '_engine', TABLE_Rows as 'tableRows', DATA_LENGTH as 'dataLen',\
-               INDEX_LENGTH as 'indexSize', DATA_FREE as 'dataFree' from information_schema.tables where table_schema='%s'"
-server_details_is_query = "select * from information_schema.global_status where VARIABLE_NAME like 'connections' or VARIABLE_NAME like 'aborted_connects'\
-                        or VARIABLE_NAME like 'threads_connected' or VARIABLE_NAME like 'threads_cached' or VARIABLE_NAME like 'threads_created'\
-                        or VARIABLE_NAME like 'threads_running' or VARIABLE_NAME like 'uptime' or VARIABLE_NAME like 'bytes_received'\
-                        or VARIABLE_NAME like 'bytes_sent'"
-table_query = "select table_name as '_tableName' ,table_schema as '_dbName', ENGINE as '_engine', TABLE_Rows as 'tableRows', DATA_LENGTH as 'dataLen',\
-               INDEX_LENGTH as 'indexSize', DATA_FREE as 'dataFree' from information_schema.tables where table_schema='%s'"
-db_info_query = "select schema_name from information_schema.schemata WHERE schema_name not in ('mysql', 'information_schema', 'performance_schema')"
-db_query_1 = "select Round(Sum(data_length + index_length) / 1024 / 1024, 1) 'dbSize' FROM information_schema.tables where table_schema='%s'"
-db_query_2 = "SELECT COUNT(*) as numTables FROM information_schema.tables WHERE table_schema ='%s'"
-db_query_3 = "select index_length FROM information_schema.tables where table_schema='%s'"
-db_query_4 = "use %s"
-db_query_5 = 'show global status where VARIABLE_NAME like "Created_tmp_files" or VARIABLE_NAME like "Created_tmp_tables"\
-              or VARIABLE_NAME like "Queries" or VARIABLE_NAME like "Com_select" or VARIABLE_NAME like "Com_insert"\
-	      or VARIABLE_NAME like "Com_update" or VARIABLE_NAME like "Com_delete" or VARIABLE_NAME like "Slow_queries"\
-          or VARIABLE_NAME like "Qcache_hits" or VARIABLE_NAME like "Qcache_inserts"'
+# Global status counters which are reported as the difference between two polls: (field, status variable)
+server_status_counters = (("numConnections", "CONNECTIONS"), ("numAbortedConnects", "ABORTED_CONNECTS"),
+                          ("threadsCreated", "THREADS_CREATED"), ("numCreatedTempFiles", "CREATED_TMP_FILES"),
+                          ("numCreatedTempTables", "CREATED_TMP_TABLES"), ("numQueries", "QUERIES"),
+                          ("numSelect", "COM_SELECT"), ("numInsert", "COM_INSERT"), ("numUpdate", "COM_UPDATE"),
+                          ("numDelete", "COM_DELETE"), ("slowQueries", "SLOW_QUERIES"), ("qcacheHits", "QCACHE_HITS"),
+                          ("qcacheInserts", "QCACHE_INSERTS"))
+# Byte counters which are reported as MB per second
+server_status_rates = (("bytesReceivedMB", "BYTES_RECEIVED"), ("bytesSentMB", "BYTES_SENT"))
+server_status_gauges = ("THREADS_CONNECTED", "THREADS_CACHED", "THREADS_RUNNING", "UPTIME")
+# Server wide status batch, sent as one multi-statement round trip
+server_status_query = "show global status where Variable_name in (%s); %s" % (
+    ", ".join("'%s'" % var for _, var in server_status_counters + server_status_rates) + ", " +
+    ", ".join("'%s'" % var for var in server_status_gauges), server_query)
+MYSQL_CONNECT_TIMEOUT = 5
+# All user schemas with their tables in one information_schema scan, schemas without tables
+# come back as a single row with NULL table columns
+schema_tables_query = "select s.schema_name as '_dbName', t.table_name as '_tableName', t.ENGINE as '_engine', t.TABLE_ROWS as 'tableRows',\
+                       t.DATA_LENGTH as 'dataLen', t.INDEX_LENGTH as 'indexSize', t.DATA_FREE as 'dataFree'\
+                       from information_schema.schemata s left join information_schema.tables t on t.table_schema = s.schema_name\
+                       where s.schema_name not in ('mysql', 'information_schema', 'performance_schema')"
+# Table sizes and row estimates change slowly, refresh them far less often than the status counters
+METADATA_TTL = 1800
 
 # JVM CONSTANTS
 PROCESS = "process"
@@ -187,19 +287,33 @@ DEFAULT_LOG_FORMAT = '%a %A %B %T %h %H %p %>s %t \"%r\" \"%U\"'
 ACCESS_LOG = "accesslog"
 APACHE_TRANS = "apacheTrans"
 
+# REDIS CONSTANTS
+# The latency sampler sleeps for a fixed tick and records how late it wakes up, in microseconds
+REDIS_LATENCY_TICK = 0.01
+# Power of two histogram buckets, the last one holds anything above ~36 minutes
+REDIS_LATENCY_BUCKETS = 32
+REDIS_LATENCY_SERVER_INTERVAL = 5
+REDIS_TIMEOUT = 2
+REDIS_WORKERS = 16
+
 #POSTGRES CONSTANTS
 class Postgres(object):
 
     POSTGRES = "postgres"
-    db_info_query = 'SELECT datname FROM pg_database WHERE datistemplate = false;'
 
-    db_trans_query = "select xact_commit+xact_rollback as \"numTransactions\", blks_read as \"blocksRead\", blks_hit as \"blocksHit\", " \
-                 "tup_returned as \"numReturn\", tup_inserted as \"numInsert\", tup_deleted as \"numDelete\", " \
-                 "tup_updated as \"numUpdate\", tup_fetched as \"numFetch\", temp_files as \"numTempFile\", " \
-                 "temp_bytes as \"tempFileSize\", blk_read_time as \"blkReadTime\", " \
-                 "blk_write_time as \"blkWriteTime\" from pg_stat_database where datname='%s';"
+    # One row per database: name and size first, then the counters in db_counters order
+    # pg_database_size fails for databases the user can not connect to, their size is left NULL
+    db_stats_query = "SELECT d.datname, CASE WHEN has_database_privilege(d.oid, 'CONNECT') " \
+                     "THEN pg_database_size(d.oid) END as \"dbSize\", " \
+                     "s.xact_commit + s.xact_rollback as \"numTransactions\", s.blks_read as \"blocksRead\", " \
+                     "s.blks_hit as \"blocksHit\", s.tup_returned as \"numReturn\", s.tup_inserted as \"numInsert\", " \
+                     "s.tup_deleted as \"numDelete\", s.tup_updated as \"numUpdate\", s.tup_fetched as \"numFetch\", " \
+                     "s.temp_files as \"numTempFile\", s.temp_bytes as \"tempFileSize\", " \
+                     "s.blk_read_time as \"blkReadTime\", s.blk_write_time as \"blkWriteTime\" " \
+                     "FROM pg_database d JOIN pg_stat_database s ON s.datid = d.oid WHERE d.datistemplate = false;"
 
-    db_size_query = "select sum(pg_database_size(datname)) as db_size from pg_database where datname = '%s'"
+    db_counters = ("numTransactions", "blocksRead", "blocksHit", "numReturn", "numInsert", "numDelete", "numUpdate",
+                   "numFetch", "numTempFile", "tempFileSize", "blkReadTime", "blkWriteTime")
 
     db_num_tables_query = "select count(*) from pg_stat_user_tables;"
 
@@ -213,11 +327,21 @@ class Postgres(object):
 
     server_connections = "SELECT sum(numbackends) FROM pg_stat_database;"
 
-    table_query = "select schemaname as \"_schemaName\", relname as \"_tableName\", " \
-              "pg_table_size(relid)as \"tableSize\", " \
-              "pg_indexes_size(relid) as \"indexSize\", " \
-              "heap_blks_read as \"heapBlksRead\", heap_blks_hit as \"heapBlksHit\", " \
-              "idx_blks_read as \"idxBlksRead\", idx_blks_hit as \"idxBlksHit\" FROM pg_catalog.pg_statio_user_tables ORDER BY pg_table_size(relid) DESC;"
+    # One row per table keyed by relid: static columns first, then the monotonically
+    # increasing counters listed in table_counters, in the same order.
+    table_query = "SELECT s.relid, s.schemaname as \"_schemaName\", s.relname as \"_tableName\", " \
+                  "pg_table_size(s.relid) as \"tableSize\", pg_indexes_size(s.relid) as \"indexSize\", " \
+                  "s.n_live_tup as \"numLiveTuple\", s.n_dead_tup as \"numDeadTuple\", " \
+                  "io.heap_blks_read as \"heapBlksRead\", io.heap_blks_hit as \"heapBlksHit\", " \
+                  "coalesce(io.idx_blks_read, 0) as \"idxBlksRead\", coalesce(io.idx_blks_hit, 0) as \"idxBlksHit\", " \
+                  "s.n_tup_ins as \"numInsert\", s.n_tup_del as \"numDelete\", s.n_tup_upd as \"numUpdate\", " \
+                  "s.seq_scan as \"seqScan\", s.seq_tup_read as \"seqScanFetch\", " \
+                  "coalesce(s.idx_scan, 0) as \"indexScan\", coalesce(s.idx_tup_fetch, 0) as \"indexScanFetch\" " \
+                  "FROM pg_stat_user_tables s JOIN pg_statio_user_tables io ON io.relid = s.relid " \
+                  "ORDER BY pg_table_size(s.relid) DESC;"
+
+    table_counters = ("heapBlksRead", "heapBlksHit", "idxBlksRead", "idxBlksHit", "numInsert", "numDelete",
+                      "numUpdate", "seqScan", "seqScanFetch", "indexScan", "indexScanFetch")
 
     long_runn_query_ver9 = "SELECT now() - query_start as \"runtime\", usename as \"userName\", datname as \"_dbName\", waiting, " \
                   "state, query as \"_queryName\" FROM pg_stat_activity WHERE now() - query_start > '250 milliseconds'::interval and state='active'" \
@@ -229,6 +353,19 @@ class Postgres(object):
 
     conn_str = "host=%s user=%s password=%s port=%s dbname=%s"
 
+    # Connection pool defaults
+    maintenance_db = "postgres"
+    max_connections = 50
+    statement_timeout = 5000
+    connect_timeout = 5
+    retry_interval = 60
+    health_check_idle = 300
+    ping_query = "SELECT 1;"
+
+    # Concurrent per database collection
+    workers = 4
+    deadline_factor = 0.8
+
     cache_ratio = "SELECT sum(heap_blks_read) as heap_read, sum(heap_blks_hit)  as heap_hit, case sum(heap_blks_read) + sum(heap_blks_hit) when 0 then 0 " \
               "else (sum(heap_blks_hit)::float / (sum(heap_blks_hit) + sum(heap_blks_read)))*100 end as ratio FROM pg_statio_user_tables;"
 
@@ -239,15 +376,30 @@ class Postgres(object):
 
     effective_cache = "SELECT name, setting, min_val, max_val, context FROM pg_settings WHERE name = 'effective_cache_size';"
 
-    stat_table_query = "SELECT relname as \"_tableName\", seq_scan as \"seqScan\", seq_tup_read as \"seqScanFetch\", idx_scan as \"indexScan\"," \
-                    "idx_tup_fetch as \"indexScanFetch\", n_tup_ins as \"numInsert\", n_tup_del as \"numDelete\", n_tup_upd as \"numuUdate\"," \
-                    "n_live_tup as \"numLiveTuple\", n_dead_tup as \"numDeadTuple\" FROM pg_stat_user_tables;"
+    # One row per index keyed by indexrelid, counters in index_counters order.
+    index_query = "SELECT s.indexrelid, s.schemaname as \"_schemaName\", s.relname as \"_tableName\", " \
+                  "s.indexrelname as \"_indexName\", s.idx_scan as \"indexScan\", s.idx_tup_read as \"numReturn\", " \
+                  "s.idx_tup_fetch as \"numFetch\", io.idx_blks_read as \"blksRead\", io.idx_blks_hit as \"blksHit\" " \
+                  "FROM pg_stat_user_indexes s JOIN pg_statio_user_indexes io ON io.indexrelid = s.indexrelid;"
+
+    index_counters = ("indexScan", "numReturn", "numFetch", "blksRead", "blksHit")
+
+    # pg_stat_statements, read without the query text which is fetched only for
+    # queryids missing from the text cache. Counters in statement_counters order.
+    statements_query = "SELECT s.userid, s.dbid, s.queryid, d.datname as \"_dbName\", r.rolname as \"_userName\", " \
+                       "s.calls as \"calls\", s.%s as \"totalTime\", s.rows as \"rows\", " \
+                       "s.shared_blks_hit as \"sharedBlksHit\", s.shared_blks_read as \"sharedBlksRead\", " \
+                       "s.shared_blks_written as \"sharedBlksWritten\", s.temp_blks_read as \"tempBlksRead\", " \
+                       "s.temp_blks_written as \"tempBlksWritten\" FROM pg_stat_statements(false) s " \
+                       "JOIN pg_database d ON d.oid = s.dbid LEFT JOIN pg_roles r ON r.oid = s.userid;"
+
+    statements_text_query = "SELECT queryid, query FROM pg_stat_statements WHERE queryid = ANY(%s);"
 
-    index_query = "SELECT schemaname as \"_schemaName\", relname as \"_tableName\", indexrelname as \"_indexName\", idx_scan as \"indexScan\"," \
-              "idx_tup_read as \"numReturn\", idx_tup_fetch as \"numFetch\" FROM pg_stat_user_indexes;"
+    statement_counters = ("calls", "totalTime", "rows", "sharedBlksHit", "sharedBlksRead", "sharedBlksWritten",
+                          "tempBlksRead", "tempBlksWritten")
 
-    stat_index_query = "SELECT schemaname as \"_schemaName\", relname as \"_tableName\", indexrelname as \"_indexName\", idx_blks_read as \"blksRead\"," \
-                    "idx_blks_hit as \"blksHit\" FROM pg_statio_user_indexes;"
+    top_statements = 20
+    statement_text_length = 1024
 
     check_superuser = "SELECT usename as \"userName\" from pg_user where usesuper = True;"
 
@@ -270,6 +422,32 @@ TOMCAT = "tomcat"
 
 #HAPROXY Plugin constants
 HAPROXY = "haproxy"
+HAPROXY_SOCKET = "/var/lib/haproxy/stats"
+HAPROXY_SOCKET_TIMEOUT = 5
+# Interactive mode ends every reply with this prompt
+HAPROXY_PROMPT = "\n> "
+HAPROXY_RECV_SIZE = 65536
+HAPROXY_WORKERS = 8
+# Merging the stats of several haproxy processes: these show stat counters are summed, these fields
+# keep the largest value and these are averaged, every other field is taken from the first socket
+HAPROXY_SUM_FIELDS = ("qcur", "scur", "slim", "stot", "bin", "bout", "dreq", "dresp", "ereq", "econ", "eresp",
+                      "wretr", "wredis", "chkfail", "chkdown", "lbtot", "rate", "rate_lim", "hrsp_1xx", "hrsp_2xx",
+                      "hrsp_3xx", "hrsp_4xx", "hrsp_5xx", "hrsp_other", "req_rate", "req_tot", "cli_abrt",
+                      "srv_abrt", "comp_in", "comp_out", "comp_byp", "comp_rsp", "conn_rate", "conn_tot",
+                      "intercepted", "dcon", "dses", "cache_lookups", "cache_hits", "srv_icur", "eint", "connect",
+                      "reuse")
+HAPROXY_MAX_FIELDS = ("qmax", "smax", "rate_max", "req_rate_max", "conn_rate_max", "lastchg", "downtime",
+                      "lastsess", "qtime_max", "ctime_max", "rtime_max", "ttime_max")
+HAPROXY_AVG_FIELDS = ("qtime", "ctime", "rtime", "ttime", "weight", "check_duration", "act", "bck")
+# show info fields summed across processes, the others are taken from the first socket
+HAPROXY_INFO_SUM_FIELDS = ("CurrConns", "ConnRate", "SessRate", "PipesUsed", "SslCacheMisses", "SslCacheLookups")
+
+# Topstats plugin constants
+PROC = "/proc"
+# /proc/<pid>/stat is well below this size, one read() returns the whole file
+PROC_READ_SIZE = 4096
+# The sampler scans every process at this cadence, its averages fade out over one poll interval
+TOPSTATS_SAMPLE_INTERVAL = 1
 
 # Kafka_jmx plugin constants
 KAFKA_JMX = "kafkajmx"
@@ -315,6 +493,7 @@ CASSANDRA = "cassandra"
 CASSANDRA_STATS = "cassandraStats"
 JVMSTATS = "jvmStats"
 KEYSPACE_STATS = "keyspaceStats"
+CASSANDRA_TIMEOUT = 5
 
 # oozie plugin constants
 OOZIEHOST = 'ooziehost'
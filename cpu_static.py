@@ -3,13 +3,13 @@
 
 from __future__ import division
 import signal
-import re
 import json
 import time
 import collectd
 
 # user imports
 import utils
+import libprocfs
 from constants import *
 
 
@@ -33,83 +33,12 @@ class CpuStatic(object):
     def add_cpu_data(self):
         """Return dictionary with values of  CPUType, HT, CLOCK, SOCKET, TOTAL_CORE
         and TOTAL_LOGICAL_CPU obtained from /proc/cpuinfo file."""
-        dict_cpu_static = {}
-        total_logical_cpus = 0
-        total_physical_cpus = 0
-        total_cores = 0
-        keyword_processor_found = False
-        keyword_physical_id_found = False
-        keyword_core_id_found = False
-        logical_cpus = {}
-        physical_cpus = {}
-        cores = {}
-        hyperthreading = 0
-        model_list = []
-        total_freq = 0
-        count_freq = 0
-
         try:
-            with open('/proc/cpuinfo') as cpuinfo_file:
-                lines = cpuinfo_file.readlines()
-        except IOError:
+            return libprocfs.get_cpu_static()
+        except (IOError, OSError, ValueError):
             collectd.error("Plugin cpu_static: Unable to open /proc/cpuinfo")
             return None
 
-        index = 0
-        while index < len(lines):
-            line = lines[index]
-            if re.match('processor', line):
-                cpu = int(line.split()[2])
-                keyword_processor_found = True
-
-                if cpu not in logical_cpus:
-                    logical_cpus[cpu] = []
-                    total_logical_cpus += 1
-
-            if re.match('physical id', line):
-                phys_id = int(line.split()[3])
-                keyword_physical_id_found = True
-
-                if phys_id not in physical_cpus:
-                    physical_cpus[phys_id] = []
-                    total_physical_cpus += 1
-
-            if re.match('core id', line):
-                core = int(line.split()[3])
-                keyword_core_id_found = True
-
-                if core not in cores:
-                    cores[core] = []
-                    total_cores += 1
-
-            if re.match('model name', line):
-                modelname = line.split(":")
-                modelname = str(modelname[1]).strip(' ')
-                modelname = modelname.strip('\n')
-                if modelname not in model_list:
-                    model_list.append(modelname)
-
-            if re.match("cpu MHz", line):
-                total_freq += float(line.split()[3])
-                count_freq += 1
-
-            index += 1
-
-        if keyword_processor_found and keyword_physical_id_found and keyword_core_id_found:
-            if (total_cores * total_physical_cpus) * 2 == total_logical_cpus:
-                hyperthreading = 1
-            model_name = ",".join(model_list)
-
-        dict_cpu_static[CPU_TYPE] = model_name
-        if count_freq != 0:
-            dict_cpu_static[CLOCK] = round(
-                total_freq / count_freq, FLOATING_FACTOR)
-        dict_cpu_static[TOTAL_CORE] = total_cores
-        dict_cpu_static[SOCKET] = total_physical_cpus
-        dict_cpu_static[TOTAL_LOGICAL_CPU] = total_logical_cpus
-        dict_cpu_static[HT] = "On" if int(hyperthreading) else "off"
-        return dict_cpu_static
-
     def add_common_params(self, dict_cpu_static):
         """Adds TIMESTAMP, PLUGIN, PLUGIN_INS to dictionary."""
         timestamp = int(round(time.time()))
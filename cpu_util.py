@@ -11,12 +11,12 @@
 import signal
 import json
 import time
-import psutil
 import collectd
-import re
 
 # user imports
 import utils
+import libperfevent
+import libprocfs
 from constants import *
 
 
@@ -27,57 +27,52 @@ class CpuUtil(object):
         """Initializes interval and previous dictionary variable."""
         self.interval = DEFAULT_INTERVAL
         self.prev_data = {}
+        self.prev_cpu_times = None
+        self.perf_events = []
+        self.perf_counters = None
 
     def config(self, cfg):
         """Initializes variables from conf files."""
         for children in cfg.children:
             if children.key == INTERVAL:
                 self.interval = children.values[0]
+            if children.key == "perf_events":
+                self.perf_events = [event for event in children.values if event in PERF_EXTRA_EVENTS]
+
+    def open_perf_counters(self):
+        """Opens the LLC counters and the optional ipc and branch counters once, on every CPU."""
+        events = dict(PERF_LLC_EVENTS)
+        for event in self.perf_events:
+            events.update(PERF_EXTRA_EVENTS[event])
+        perf_counters = libperfevent.PerfCounters(events)
+        if perf_counters.open():
+            self.perf_counters = perf_counters
 
     def get_LLC_stats(self):
-        LLCStats, LLCerr = utils.get_cmd_output("perf stat -a -e LLC-loads,LLC-load-misses sleep 2")
-
-        sdlines = re.split("\n", LLCerr)
-        num_lines = len(sdlines)
-        index = 0
-        LLCLoads = 0
-        LLCLoadMisses = 0
-        LLC = False
-        while index < num_lines:
-            line = sdlines[index]
-            if line:
-                if "perf not found for kernel" in line:
-                    collectd.info(
-                        "Plugin cpu_static: Perf is not installed for the kernel.")
-                    return 0
-                elif "not supported" in line:
-                    collectd.info(
-                        "Plugin cpu_static: LLC Statistics is hidden from Virtual machines.")
-                    return 0
-                elif "LLC-loads" in line:
-                    LLCLoads = float(line.strip(" ").split(" ")[0].replace(",", ""))
-                    LLC = True
-                elif "LLC-load-misses" in line:
-                    LLCLoadMisses = float(line.strip(" ").split(" ")[0].replace(",", ""))
-                    LLC = True
-                index += 1
-            else:
-                index += 1
-        if LLC:
-            return round(((LLCLoadMisses / LLCLoads) * 100), 2)
-
-        return 0
-
+        """Returns LLC miss rate and optional IPC and branch miss rate since the previous poll."""
+        if self.perf_counters is None:
+            return {LLC_MISS_RATE: 0}
+        counts = self.perf_counters.read()
+        dict_llc = {LLC_MISS_RATE: round(float(counts["llcLoadMisses"]) / counts["llcLoads"] * 100, 2)
+                    if counts["llcLoads"] else 0}
+        if "cycles" in counts:
+            dict_llc[IPC] = round(float(counts["instructions"]) / counts["cycles"], 2) if counts["cycles"] else 0
+        if "branches" in counts:
+            dict_llc[BRANCH_MISS_RATE] = round(float(counts["branchMisses"]) / counts["branches"] * 100, 2) \
+                if counts["branches"] else 0
+        return dict_llc
 
     def add_cpu_data(self):
         """Returns dictionary with values of total,per core CPU utilization
            and no. of cores in low, medium and high range."""
-        dict_cpu_util = {CPU_UTIL: psutil.cpu_percent(
-            interval=None, percpu=False)}
-        scpu = psutil.cpu_times_percent(interval=None, percpu=False)
-        dict_cpu_util = {'CpuMisc': scpu.nice+scpu.irq+scpu.guest+scpu.guest_nice+scpu.softirq, 'CpuUser': scpu.user, 'CpuSystem' : scpu.system, 'CpuIdle': scpu.idle, 'CpuIoWait':scpu.iowait ,'CPUUtil':scpu.user+scpu.system, 'CpuSteal': scpu.steal}
-
-        per_cpu_util = psutil.cpu_percent(interval=None, percpu=True)
+        total_times, per_cpu_times = libprocfs.get_cpu_times()
+        prev_total_times, prev_per_cpu_times = self.prev_cpu_times or (total_times, per_cpu_times)
+        self.prev_cpu_times = (total_times, per_cpu_times)
+        scpu = libprocfs.cpu_times_percent(prev_total_times, total_times)
+        dict_cpu_util = {'CpuMisc': scpu["nice"]+scpu["irq"]+scpu["guest"]+scpu["guest_nice"]+scpu["softirq"], 'CpuUser': scpu["user"], 'CpuSystem' : scpu["system"], 'CpuIdle': scpu["idle"], 'CpuIoWait':scpu["iowait"] ,'CPUUtil':scpu["user"]+scpu["system"], 'CpuSteal': scpu["steal"]}
+
+        per_cpu_util = [libprocfs.cpu_percent(prev_times, curr_times)
+                        for prev_times, curr_times in zip(prev_per_cpu_times, per_cpu_times)]
         no_of_cores = len(per_cpu_util)
 
         dict_cpu_util[NUM_HIGH_ACTIVE] = dict_cpu_util[
@@ -92,7 +87,7 @@ class CpuUtil(object):
             elif MEDIUM_RANGE_END < per_cpu_util[i - 1] <= HIGH_RANGE_END:
                 dict_cpu_util[NUM_HIGH_ACTIVE] += 1
 
-        dict_cpu_util["LLCMissRate"] = self.get_LLC_stats()
+        dict_cpu_util.update(self.get_LLC_stats())
         return dict_cpu_util
 
     def add_common_params(self, dict_cpu_util):
@@ -152,8 +147,14 @@ class CpuUtil(object):
         hence temporary function is made to call, the read callback is unregistered
         and read() is called again with interval obtained from conf by register_config callback."""
         collectd.unregister_read(self.read_temp)
+        if self.perf_counters is None:
+            self.open_perf_counters()
         collectd.register_read(self.read, interval=int(self.interval))
 
+    def shutdown(self):
+        if self.perf_counters is not None:
+            self.perf_counters.close()
+
 
 def init():
     """When new process is formed, action to SIGCHLD is reset to default behavior."""
@@ -163,3 +164,4 @@ def init():
 OBJ = CpuUtil()
 collectd.register_config(OBJ.config)
 collectd.register_read(OBJ.read_temp)
+collectd.register_shutdown(OBJ.shutdown)
@@ -8,12 +8,15 @@
 import json
 import time
 import collectd
-import subprocess
+import csv
+import glob
+import socket
 import re
 import signal
 import traceback
 from collections import defaultdict
 from copy import deepcopy
+from multiprocessing.pool import ThreadPool
 
 # user imports
 import utils
@@ -21,6 +24,57 @@ from constants import *
 
 HAPROXY_DOCS = ["frontendStats", "backendStats", "haproxyStats"]
 
+class HaproxySocket(object):
+    """Persistent client of the haproxy stats socket in interactive (prompt) mode"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.sock = None
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(HAPROXY_SOCKET_TIMEOUT)
+        self.sock.connect(self.socket_path)
+        # Keeps the connection open after each command instead of closing it
+        self.sock.sendall("prompt\n")
+        self.read_reply()
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+        self.sock = None
+
+    def read_reply(self):
+        """Reads up to the next prompt and returns the reply without it"""
+        chunks = []
+        tail = ""
+        while True:
+            chunk = self.sock.recv(HAPROXY_RECV_SIZE)
+            if not chunk:
+                raise socket.error("stats socket %s closed by haproxy" % self.socket_path)
+            chunks.append(chunk)
+            tail = (tail + chunk)[-len(HAPROXY_PROMPT):]
+            if tail == HAPROXY_PROMPT:
+                return "".join(chunks)[:-len(HAPROXY_PROMPT)]
+
+    def command(self, cmd):
+        """Runs cmd and returns its output lines, reconnecting once if haproxy dropped the connection"""
+        for attempt in range(2):
+            try:
+                if self.sock is None:
+                    self.connect()
+                self.sock.sendall(cmd + "\n")
+                return [line for line in self.read_reply().splitlines() if line]
+            except socket.error as err:
+                # haproxy closes idle connections after its "stats timeout"
+                self.close()
+                if attempt:
+                    raise err
+
+
 class haproxyStats(object):
     """Plugin object will be created only once and collects utils
            and available CPU/RAM usage info every interval."""
@@ -28,7 +82,10 @@ class haproxyStats(object):
     def __init__(self, interval=1, utilize_type="CPU", maximum_grep=5, process_name='*'):
         """Initializes interval."""
         self.interval = DEFAULT_INTERVAL
-        self.socket_path = None
+        self.socket_paths = [HAPROXY_SOCKET]
+        # socket path -> HaproxySocket, kept across polls
+        self.clients = {}
+        self.workers = None
         self.documentsTypes = []
         self.pollCounter = 0
         self.prev_frontend_data = {}
@@ -43,27 +100,97 @@ class haproxyStats(object):
             if children.key == DOCUMENTSTYPES:
                 self.documentsTypes = children.values[0]
             if children.key == "socket_path":
-                self.socket_path = children.values[0]
-
-    def get_keys(self, key_mapping, lines):
-        """Gets keys of metrics as specified by the haproxy csv stats exposed"""
-        key_buf = lines[0].strip("# \n").split(",")[2:]
-        for key in key_buf:
-            if key:
-                key_mapping.append(key)
-
-    def format_stats(self, dict_stats, lines):
-        """Formats the stats exposed by haproxy stats socket to form a dictionary"""
-        for line in lines:
-            line = line.strip("\n")
-            if line != b'':
-                # print line
-                if line[0] == "#":
+                # One value per socket, each may be a glob such as /var/run/haproxy/stats-*
+                self.socket_paths = list(children.values)
+
+    def get_socket_paths(self):
+        """Expands the configured socket paths, dropping the clients of sockets which went away"""
+        socket_paths = []
+        for pattern in self.socket_paths:
+            matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+            socket_paths.extend(path for path in matches if path not in socket_paths)
+        for socket_path in self.clients.keys():
+            if socket_path not in socket_paths:
+                self.clients.pop(socket_path).close()
+        for socket_path in socket_paths:
+            if socket_path not in self.clients:
+                self.clients[socket_path] = HaproxySocket(socket_path)
+        return socket_paths
+
+    def fetch_socket(self, socket_path):
+        """Runs the requested commands on one stats socket, returns its stat rows and info"""
+        try:
+            client = self.clients[socket_path]
+            stat_rows = []
+            info = {}
+            if "frontendStats" in self.documentsTypes or "backendStats" in self.documentsTypes:
+                rows = list(csv.reader(client.command("show stat")))
+                # The header row starts with "# pxname"
+                header = [key.lstrip("# ") for key in rows[0]]
+                stat_rows = [dict(zip(header, row)) for row in rows[1:] if row]
+            if "haproxyStats" in self.documentsTypes:
+                for line in client.command("show info"):
+                    key, _, value = line.partition(":")
+                    info[key] = value.strip(" ")
+            return header[2:] if stat_rows else [], stat_rows, info
+        except Exception as err:
+            collectd.error("Plugin haproxy: Unable to read the stats socket %s due to %s" % (socket_path, err))
+            return None
+
+    @staticmethod
+    def to_number(value):
+        for number_type in (int, float):
+            try:
+                return number_type(value)
+            except ValueError:
+                pass
+        return None
+
+    def merge_stats(self, results, key_mapping, dict_stats):
+        """Combines the show stat rows of every process into one row per proxy/server"""
+        merged = {}
+        num_rows = defaultdict(int)
+        for keys, stat_rows, _ in results:
+            for key in keys:
+                if key and key not in key_mapping:
+                    key_mapping.append(key)
+            for row in stat_rows:
+                name = row["pxname"] + row["svname"]
+                num_rows[name] += 1
+                if name not in merged:
+                    merged[name] = dict(row)
                     continue
-
-                buf = line.split(",")
-                name = buf[0] + buf[1]
-                dict_stats[name] = buf[:-1]
+                target = merged[name]
+                for key, value in row.items():
+                    current = self.to_number(target.get(key, ''))
+                    number = self.to_number(value)
+                    if number is None:
+                        continue
+                    if current is None:
+                        target[key] = number
+                    elif key in HAPROXY_MAX_FIELDS:
+                        target[key] = max(current, number)
+                    elif key in HAPROXY_SUM_FIELDS or key in HAPROXY_AVG_FIELDS:
+                        target[key] = current + number
+        for name, row in merged.items():
+            if num_rows[name] > 1:
+                for key in HAPROXY_AVG_FIELDS:
+                    number = self.to_number(row.get(key, ''))
+                    if number is not None:
+                        row[key] = number / num_rows[name]
+            dict_stats[name] = [row["pxname"], row["svname"]] + [row.get(key, '') for key in key_mapping]
+
+    @staticmethod
+    def merge_info(results):
+        """Combines the show info of every process"""
+        merged = {}
+        for _, _, info in results:
+            for key, value in info.items():
+                if key not in merged:
+                    merged[key] = value
+                elif key in HAPROXY_INFO_SUM_FIELDS:
+                    merged[key] = int(merged[key]) + int(value)
+        return merged
 
     def get_frontend_data(self, key_mapping, dict_stats, haproxy_data):
         """Get data for frontend metrics"""
@@ -145,16 +272,9 @@ class haproxyStats(object):
             collectd.error("Plugin haproxy: Exception in get_backend_data due to %s" % err)
             collectd.error("Traceback: %s" % traceback.format_exc())
 
-    def get_haproxy_data(self, lines, haproxy_data):
+    def get_haproxy_data(self, dict_stats, haproxy_data, num_sockets):
         """Get general haproxy stats"""
-        dict_stats = {}
         try:
-            for line in lines:
-                line = line.strip("\n")
-                if line != b'':
-                    buf = line.split(":")
-                    dict_stats[buf[0]] = buf[1].strip(" ")
-
             haproxy_data['haproxyStats']['version'] = dict_stats['Version']
             haproxy_data['haproxyStats']['upTime'] = int(dict_stats['Uptime_sec'])
             haproxy_data['haproxyStats']['currConns'] = int(dict_stats['CurrConns'])
@@ -164,6 +284,7 @@ class haproxyStats(object):
             haproxy_data['haproxyStats']['sslCacheMisses'] = int(dict_stats['SslCacheMisses'])
             haproxy_data['haproxyStats']['sslCacheLookups'] = int(dict_stats['SslCacheLookups'])
             haproxy_data['haproxyStats']['sessRate'] = int(dict_stats['SessRate'])
+            haproxy_data['haproxyStats']['numSockets'] = num_sockets
             haproxy_data['haproxyStats']['_documentType'] = "haproxyStats"
 
             self.add_common_params(haproxy_data['haproxyStats'], 'haproxyStats')
@@ -171,30 +292,31 @@ class haproxyStats(object):
         except Exception as err:
             collectd.error("Plugin haproxy: Exception in get_haproxy_data due to %s" % err)
 
-    def collect_haproxy_data(self, doc):
-        """Collect haproxy data for various doc types"""
+    def collect_haproxy_data(self):
+        """Collect haproxy data for all the requested doc types from every stats socket"""
         try:
+            socket_paths = self.get_socket_paths()
+            if self.workers is None:
+                self.workers = ThreadPool(HAPROXY_WORKERS)
+            # The sockets are read concurrently, then merged before any delta is taken
+            results = [result for result in self.workers.map(self.fetch_socket, socket_paths) if result]
             haproxy_data = defaultdict(dict)
-            if doc == "frontendStats" or doc == "backendStats":
+            # The counters of a process that did not answer would be missing from the sums and the
+            # diffs against the previous poll would go negative, so the poll is skipped
+            if not results or len(results) != len(socket_paths):
+                return haproxy_data
+
+            if "frontendStats" in self.documentsTypes or "backendStats" in self.documentsTypes:
                 dict_stats = defaultdict(list)
                 key_mapping = []
 
-                cmnd = "echo 'show stat' | nc -U /var/lib/haproxy/stats"
-                process = subprocess.Popen(cmnd, shell=True, stdout=subprocess.PIPE)
-                lines = process.stdout.readlines()
-
-                self.get_keys(key_mapping, lines)
-                self.format_stats(dict_stats, lines)
+                self.merge_stats(results, key_mapping, dict_stats)
 
                 self.get_frontend_data(key_mapping, dict_stats, haproxy_data)
                 self.get_backend_data(key_mapping, dict_stats, haproxy_data)
 
-            if doc == "haproxyStats":
-                cmnd = "echo 'show info' | nc -U /var/lib/haproxy/stats"
-                process = subprocess.Popen(cmnd, shell=True, stdout=subprocess.PIPE)
-                lines = process.stdout.readlines()
-
-                self.get_haproxy_data(lines, haproxy_data)
+            if "haproxyStats" in self.documentsTypes:
+                self.get_haproxy_data(self.merge_info(results), haproxy_data, len(results))
 
             return haproxy_data
 
@@ -316,8 +438,10 @@ class haproxyStats(object):
                 self.prev_haproxy_data = deepcopy(doc_stats)
                 self.add_default_diff_value(doc_stats, doc)
             else:
+                # The cumulative counters are kept, add_diff replaces them with deltas
+                curr_data = deepcopy(doc_stats)
                 self.add_diff(doc_stats, doc, 'haproxy')
-                self.prev_haproxy_data = deepcopy(doc_stats)
+                self.prev_haproxy_data = curr_data
 
             self.dispatch_data(deepcopy(doc_stats), doc)
 
@@ -327,20 +451,22 @@ class haproxyStats(object):
             if doc == 'frontendStats':
                 for pxname in doc_stats.keys():
                     if self.pollCounter==1 or pxname not in self.prev_frontend_data.keys():
-                        self.prev_frontend_data[pxname] = deepcopy(doc_stats)
+                        self.prev_frontend_data[pxname] = deepcopy(doc_stats[pxname])
                         self.add_default_diff_value(doc_stats[pxname], doc)
                     else:
+                        curr_data = deepcopy(doc_stats[pxname])
                         self.add_diff(doc_stats[pxname], doc, pxname)
-                        self.prev_frontend_data[pxname] = deepcopy(doc_stats[pxname])
+                        self.prev_frontend_data[pxname] = curr_data
 
             elif doc == 'backendStats':
                 for pxname in doc_stats.keys():
                     if self.pollCounter == 1 or pxname not in self.prev_backend_data.keys():
-                        self.prev_backend_data[pxname] = deepcopy(doc_stats)
+                        self.prev_backend_data[pxname] = deepcopy(doc_stats[pxname])
                         self.add_default_diff_value(doc_stats[pxname], doc)
                     else:
+                        curr_data = deepcopy(doc_stats[pxname])
                         self.add_diff(doc_stats[pxname], doc, pxname)
-                        self.prev_backend_data[pxname] = deepcopy(doc_stats[pxname])
+                        self.prev_backend_data[pxname] = curr_data
 
             self.dispatch_data(deepcopy(doc_stats), doc)
 
@@ -361,16 +487,18 @@ class haproxyStats(object):
         """Collects all data."""
         try:
             self.pollCounter += 1
+            haproxy_stats = self.collect_haproxy_data()
+            if not haproxy_stats:
+                collectd.error("Plugin haproxy: Unable to fetch data from the stats sockets.")
+                return
             for doc in HAPROXY_DOCS:
-                haproxy_stats = self.collect_haproxy_data(doc)
-
-                if not haproxy_stats:
+                if doc in self.documentsTypes and doc not in haproxy_stats:
                     collectd.error("Plugin haproxy: Unable to fetch data for document type: %s." % doc)
-                    return
+                    continue
                 else:
                     #self.documentsTypes = ['frontendStats', 'backendStats', 'haproxyStats']
                     if doc not in self.documentsTypes:
-                            del haproxy_stats[doc]
+                        continue
 
                     if doc == 'haproxyStats' and doc in self.documentsTypes:
                         self.add_dispatch_haproxy(haproxy_stats[doc], doc)
@@ -402,6 +530,12 @@ class haproxyStats(object):
         collectd.unregister_read(self.read_temp)
         collectd.register_read(self.read, interval=int(self.interval))
 
+    def shutdown(self):
+        if self.workers is not None:
+            self.workers.terminate()
+        for client in self.clients.values():
+            client.close()
+
 
 def init():
     """When new process is formed, action to SIGCHLD is reset to default behavior."""
@@ -411,4 +545,5 @@ def init():
 OBJ = haproxyStats()
 collectd.register_init(init)
 collectd.register_config(OBJ.config)
-collectd.register_read(OBJ.read_temp)
\ No newline at end of file
+collectd.register_read(OBJ.read_temp)
+collectd.register_shutdown(OBJ.shutdown)
\ No newline at end of file
@@ -8,38 +8,26 @@
 python script to return disk I/O statistics as a dict of raw tuples
 """
 
-import re
 from collections import namedtuple
 import collectd
-import utils
+import libdisktopology
 from constants import *
 
 IoTuple = namedtuple(
-    'io', 'read_count write_count read_bytes write_bytes read_mb write_mb read_time write_time')
+    'io', 'read_count write_count read_bytes write_bytes read_mb write_mb read_time write_time '
+          'read_merged write_merged read_sectors write_sectors busy_time weighted_time')
+
+# Columns of iostat -x, named after them (avg_await is its await)
+IostatTuple = namedtuple(
+    'iostat', 'rrqm_s wrqm_s r_s w_s rkb_s wkb_s avgrq_sz avgqu_sz avg_await r_await w_await svctm util')
 
 
 def get_part_to_disk():
-    """Function to get disk and partitions from lsblk command."""
+    """Function to get disk and partitions from the cached sysfs topology."""
     dict_disk_part = {}
-    (lsblk, err) = utils.get_cmd_output('lsblk -bno  KNAME,TYPE | grep \'disk\|part\'')
-    if err:
-        collectd.error(
-            'Plugin disk_stat in libdiskstat: error in lsblk command')
-        return FAILURE
-    disk_info = re.split('\n', lsblk)
-    index = 0
-    num_lines = len(disk_info)
-    dname = None
-    while index < num_lines:
-        line = disk_info[index]
-        if line:
-            parts = re.split(r'\s+', line.strip())
-            if parts[1] == 'disk':
-                dname = parts[0]
-            dict_disk_part[parts[0]] = dname
-            index += 1
-        else:
-            break
+    for name, device in libdisktopology.get_devices().items():
+        if device.type in (DISK, PART):
+            dict_disk_part[name] = device.disk
 
     if not dict_disk_part:
         return FAILURE
@@ -47,16 +35,6 @@ def get_part_to_disk():
     return dict_disk_part
 
 
-def get_sector_size(disk):
-    """Function to get sector size of disk."""
-    try:
-        with open(b"/sys/block/%s/queue/hw_sector_size" % disk) as size_file:
-            return int(size_file.read())
-    except (IOError, ValueError):
-        # default
-        return 512
-
-
 def disk_io_counters():
     """Return disk I/O statistics for every disk installed on the
     system as a dict of raw tuples.
@@ -82,26 +60,82 @@ def disk_io_counters():
             name = fields[3]
             reads = int(fields[2])
             (reads_merged, rsector, rtime, writes, writes_merged,
-             wsector, wtime, _, busy_time, _) = map(int, fields[4:14])
-        elif fields_len == 14:
-            # Linux 2.6+, line referring to a disk
+             wsector, wtime, _, busy_time, weighted_time) = map(int, fields[4:14])
+        elif fields_len >= 14:
+            # Linux 2.6+, line referring to a disk; 4.18+ appends discard and 5.5+ flush fields
             name = fields[2]
             (reads, reads_merged, rsector, rtime, writes, writes_merged,
-             wsector, wtime, _, busy_time, _) = map(int, fields[3:14])
+             wsector, wtime, _, busy_time, weighted_time) = map(int, fields[3:14])
         elif fields_len == 7:
             # Linux 2.6+, line referring to a partition
             name = fields[2]
             reads, rsector, writes, wsector = map(int, fields[3:])
-            rtime = wtime = reads_merged = writes_merged = busy_time = 0
+            rtime = wtime = reads_merged = writes_merged = busy_time = weighted_time = 0
         else:
             raise ValueError(
                 "libdiskstat library: not sure how to interpret line %r in /proc/diskstats" % line)
 
         if name in disk_part:
-            sector_size = get_sector_size(disk_part[name])
-            rbytes = rsector * sector_size
-            wbytes = wsector * sector_size
+            rbytes = rsector * DISKSTATS_SECTOR_SIZE
+            wbytes = wsector * DISKSTATS_SECTOR_SIZE
             rmb = rbytes * float(0.000001)
             wmb = wbytes * float(0.000001)
-            retdict[name] = IoTuple(reads, writes, rbytes, wbytes, rmb, wmb, rtime, wtime)
+            retdict[name] = IoTuple(reads, writes, rbytes, wbytes, rmb, wmb, rtime, wtime, reads_merged,
+                                    writes_merged, rsector, wsector, busy_time, weighted_time)
+    return retdict
+
+
+def get_uptime():
+    """Seconds since boot, the monotonic clock iostat itself takes its intervals from."""
+    with open(PROC_UPTIME) as uptime_file:
+        return float(uptime_file.read().split()[0])
+
+
+def disk_io_snapshot():
+    """Return (uptime, disk_io_counters()) to be compared by get_extended_stats."""
+    try:
+        uptime = get_uptime()
+    except (IOError, ValueError):
+        collectd.error("libdiskstat library: Could not read file '%s'" % PROC_UPTIME)
+        return FAILURE
+    disk_io = disk_io_counters()
+    if disk_io == FAILURE:
+        return FAILURE
+    return uptime, disk_io
+
+
+def get_extended_stats(prev_snapshot, curr_snapshot):
+    """Return the iostat -x columns of every device as IostatTuple, computed between two
+    disk_io_snapshot() results as sysstat does. A device missing from prev_snapshot
+    (or no prev_snapshot at all) gets its averages since boot, like iostat's first report.
+    """
+    prev_time, prev_io = prev_snapshot if prev_snapshot else (0.0, {})
+    curr_time, curr_io = curr_snapshot
+    retdict = {}
+    for name, curr in curr_io.items():
+        prev = prev_io.get(name)
+        if prev is None:
+            prev = IoTuple(*([0] * len(IoTuple._fields)))
+            itv = curr_time
+        else:
+            itv = curr_time - prev_time
+        if itv <= 0:
+            continue
+        # Counters going backwards (device re-added) count as no activity
+        delta = IoTuple(*[max(curr_value - prev_value, 0) for curr_value, prev_value in zip(curr, prev)])
+        num_ios = delta.read_count + delta.write_count
+        retdict[name] = IostatTuple(
+            rrqm_s=delta.read_merged / itv,
+            wrqm_s=delta.write_merged / itv,
+            r_s=delta.read_count / itv,
+            w_s=delta.write_count / itv,
+            rkb_s=delta.read_sectors * DISKSTATS_SECTOR_SIZE / 1024.0 / itv,
+            wkb_s=delta.write_sectors * DISKSTATS_SECTOR_SIZE / 1024.0 / itv,
+            avgrq_sz=float(delta.read_sectors + delta.write_sectors) / num_ios if num_ios else 0.0,
+            avgqu_sz=delta.weighted_time / (itv * 1000.0),
+            avg_await=float(delta.read_time + delta.write_time) / num_ios if num_ios else 0.0,
+            r_await=float(delta.read_time) / delta.read_count if delta.read_count else 0.0,
+            w_await=float(delta.write_time) / delta.write_count if delta.write_count else 0.0,
+            svctm=float(delta.busy_time) / num_ios if num_ios else 0.0,
+            util=min(delta.busy_time / (itv * 10.0), 100.0))
     return retdict
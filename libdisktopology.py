@@ -0,0 +1,251 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to return the block device topology from sysfs and the mounted filesystems,
+shared by the disk collectors
+"""
+
+import os
+import select
+import threading
+from collections import namedtuple
+import collectd
+import utils
+from constants import *
+
+BlockDevice = namedtuple(
+    'block_device', 'name type disk path sector_size rotational slaves dm_name')
+MountPoint = namedtuple('mount_point', 'name device mount_point fs_type source')
+FsUsage = namedtuple('fs_usage', 'total used free')
+
+
+def get_device_type(name, path):
+    """Same device types as lsblk reports them."""
+    if os.path.exists(os.path.join(path, "partition")):
+        return "part"
+    if name.startswith("dm-"):
+        uuid = utils.read_sysfs(os.path.join(path, "dm", "uuid"), "")
+        if uuid.startswith("LVM-"):
+            return "lvm"
+        if uuid.startswith("CRYPT-"):
+            return "crypt"
+        return "dm"
+    if name.startswith("md"):
+        return utils.read_sysfs(os.path.join(path, "md", "level"), "md")
+    if name.startswith("loop"):
+        return "loop"
+    if name.startswith("sr"):
+        return "rom"
+    if name.startswith("ram"):
+        return "ram"
+    return "disk"
+
+
+class BlockTopology(object):
+    """Partition to disk, sector size, rotational and device-mapper slave mapping.
+
+    The topology only changes on hotplug, so it is rebuilt only when the set of
+    entries of /sys/class/block (names and inodes) differs from the last build.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.signature = None
+        self.devices = {}
+
+    @staticmethod
+    def get_signature():
+        signature = []
+        for name in os.listdir(SYS_CLASS_BLOCK):
+            try:
+                signature.append((name, os.lstat(os.path.join(SYS_CLASS_BLOCK, name)).st_ino))
+            except OSError:
+                pass
+        return frozenset(signature)
+
+    def build(self):
+        devices = {}
+        for name in os.listdir(SYS_CLASS_BLOCK):
+            path = os.path.realpath(os.path.join(SYS_CLASS_BLOCK, name))
+            dev_type = get_device_type(name, path)
+            disk = os.path.basename(os.path.dirname(path)) if dev_type == "part" else name
+            disk_path = os.path.dirname(path) if dev_type == "part" else path
+            try:
+                sector_size = int(utils.read_sysfs(os.path.join(disk_path, "queue", "hw_sector_size"), 512))
+            except ValueError:
+                sector_size = 512
+            rotational = utils.read_sysfs(os.path.join(disk_path, "queue", "rotational")) == "1"
+            slaves_path = os.path.join(path, "slaves")
+            slaves = tuple(sorted(os.listdir(slaves_path))) if os.path.isdir(slaves_path) else ()
+            dm_name = utils.read_sysfs(os.path.join(path, "dm", "name"))
+            devices[name] = BlockDevice(name, dev_type, disk, path, sector_size, rotational, slaves, dm_name)
+        return devices
+
+    def get_devices(self):
+        """Returns the cached devices, rebuilt first if block devices were added or removed."""
+        with self.lock:
+            try:
+                signature = self.get_signature()
+                if signature != self.signature:
+                    self.devices = self.build()
+                    self.signature = signature
+                    collectd.info("libdisktopology: block device topology rebuilt with %s devices"
+                                  % len(self.devices))
+            except OSError as err:
+                collectd.error("libdisktopology: unable to read %s due to %s" % (SYS_CLASS_BLOCK, err))
+            return self.devices
+
+
+TOPOLOGY = BlockTopology()
+
+
+def get_devices():
+    return TOPOLOGY.get_devices()
+
+
+def get_device_size(device):
+    """Size of the device in bytes, sysfs always counts it in 512 byte sectors."""
+    try:
+        return int(utils.read_sysfs(os.path.join(device.path, "size"), 0)) * 512
+    except ValueError:
+        return 0
+
+
+class MountTable(object):
+    """Filesystems from /proc/self/mountinfo, reparsed only when the kernel flags a change.
+
+    An open /proc/self/mounts reports POLLPRI on poll() after every mount or unmount,
+    so revalidating costs one poll(0) per call. Pseudo filesystems are dropped while
+    parsing, only block device and network filesystems are kept.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mounts = []
+        self.mounts_file = None
+        self.poller = None
+
+    def changed(self):
+        if self.poller is None:
+            self.mounts_file = open(PROC_MOUNTS)
+            self.poller = select.poll()
+            self.poller.register(self.mounts_file, select.POLLPRI | select.POLLERR)
+            return True
+        return bool(self.poller.poll(0))
+
+    def close(self):
+        if self.mounts_file is not None:
+            if self.poller is not None:
+                try:
+                    self.poller.unregister(self.mounts_file)
+                except KeyError:
+                    pass
+            self.mounts_file.close()
+        self.mounts_file = None
+        self.poller = None
+
+    @staticmethod
+    def parse():
+        mounts = []
+        with open(PROC_MOUNTINFO) as mountinfo_file:
+            for line in mountinfo_file:
+                fields = line.split()
+                # optional fields end with a lone "-", followed by fstype and source
+                separator = fields.index("-")
+                fs_type, source = fields[separator + 1], fields[separator + 2]
+                if source.startswith("/dev/"):
+                    name = os.path.basename(os.path.realpath(source))
+                elif fs_type in NETWORK_FS:
+                    name = None
+                else:
+                    continue
+                # mount paths escape blanks as octal sequences
+                mounts.append(MountPoint(name, fields[2], fields[4].decode("string_escape"), fs_type, source))
+        return mounts
+
+    def get_mounts(self):
+        with self.lock:
+            try:
+                if self.changed():
+                    self.mounts = self.parse()
+            except (IOError, OSError, ValueError, IndexError) as err:
+                collectd.error("libdisktopology: unable to read the mount table due to %s" % err)
+                # the table is reopened and reparsed on the next call
+                self.close()
+            return self.mounts
+
+
+MOUNT_TABLE = MountTable()
+# mount point -> statvfs thread still stuck on it
+PENDING_STATVFS = {}
+
+
+def get_mounts():
+    return MOUNT_TABLE.get_mounts()
+
+
+def get_mountpoints():
+    """Returns device name -> first mountpoint, and [SWAP] for active swap devices, like lsblk."""
+    mountpoints = {}
+    try:
+        with open(PROC_SWAPS) as swaps_file:
+            for line in swaps_file.readlines()[1:]:
+                fields = line.split()
+                if fields and fields[0].startswith("/dev/"):
+                    mountpoints[os.path.basename(os.path.realpath(fields[0]))] = "[" + SWAP + "]"
+    except IOError as err:
+        collectd.error("libdisktopology: unable to read %s due to %s" % (PROC_SWAPS, err))
+    for mount in get_mounts():
+        if mount.name is not None and mount.name not in mountpoints:
+            mountpoints[mount.name] = mount.mount_point
+    return mountpoints
+
+
+def statvfs_with_timeout(mount_point):
+    """statvfs in a side thread, so that a dead network mount can not hang the read callback."""
+    if mount_point in PENDING_STATVFS:
+        if PENDING_STATVFS[mount_point].is_alive():
+            return None
+        del PENDING_STATVFS[mount_point]
+    result = []
+
+    def target():
+        try:
+            result.append(os.statvfs(mount_point))
+        except OSError:
+            pass
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(STATVFS_TIMEOUT)
+    if thread.is_alive():
+        collectd.error("libdisktopology: statvfs of %s timed out, skipping it until it returns" % mount_point)
+        PENDING_STATVFS[mount_point] = thread
+        return None
+    return result[0] if result else None
+
+
+def get_fs_usage(local_only=True):
+    """Returns mount point -> FsUsage in bytes, as df computes it, counting each device once."""
+    usage = {}
+    seen = set()
+    for mount in get_mounts():
+        if mount.device in seen or (local_only and mount.name is None):
+            continue
+        seen.add(mount.device)
+        try:
+            stat = os.statvfs(mount.mount_point) if mount.name is not None else \
+                statvfs_with_timeout(mount.mount_point)
+        except OSError:
+            stat = None
+        if stat is None:
+            continue
+        usage[mount.mount_point] = FsUsage(stat.f_blocks * stat.f_frsize,
+                                           (stat.f_blocks - stat.f_bfree) * stat.f_frsize,
+                                           stat.f_bavail * stat.f_frsize)
+    return usage
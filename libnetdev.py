@@ -0,0 +1,113 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to return the network interface counters from /proc/net/dev and their static
+attributes from sysfs, shared by the nic collectors
+"""
+
+import os
+import socket
+import struct
+import fcntl
+import threading
+import collectd
+import utils
+import libprocfs
+from constants import *
+
+
+def get_counters():
+    """Returns interface name -> packet, byte and drop counters, all from one read of /proc/net/dev."""
+    counters = {}
+    # two header lines, then "name: 8 receive counters 8 transmit counters"
+    for line in libprocfs.read(PROC_NET_DEV).splitlines()[2:]:
+        name, _, fields = line.partition(":")
+        fields = fields.split()
+        counters[name.strip()] = {RX_BYTES: int(fields[0]), RX_PKTS: int(fields[1]), RX_DROPS: int(fields[3]),
+                                  TX_BYTES: int(fields[8]), TX_PKTS: int(fields[9]), TX_DROPS: int(fields[11])}
+    return counters
+
+
+class InterfaceCache(object):
+    """Type, MAC, speed, duplex, MTU, driver and up state of the interfaces.
+
+    These only change with the link, so an interface is reread from sysfs only when it was
+    recreated (ifindex), its flags or MTU changed or its carrier went up or down.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (signature, static attributes)
+        self.interfaces = {}
+        self.ioctl_socket = None
+
+    @staticmethod
+    def get_signature(path):
+        return tuple(utils.read_sysfs(os.path.join(path, attr)) for attr in NET_SIGNATURE_ATTRS)
+
+    @staticmethod
+    def build(path, signature):
+        # virtual interfaces (lo, bridges, veth, tun, bonds) live under /sys/devices/virtual
+        interface = {NIC_TYPE: VIRT if "/devices/virtual/" in os.path.realpath(path) else PHY}
+        mac = utils.read_sysfs(os.path.join(path, "address"))
+        if mac:
+            interface[MAC] = mac
+        # reading speed fails with EINVAL while the link is down
+        try:
+            speed = max(int(utils.read_sysfs(os.path.join(path, "speed"), 0)), 0)
+        except ValueError:
+            speed = 0
+        interface[SPEED] = round((float(speed) / (FACTOR * 8)), FLOATING_FACTOR)
+        interface[DUPLEX] = utils.read_sysfs(os.path.join(path, "duplex"), "unknown")
+        driver_path = os.path.join(path, "device", "driver")
+        if os.path.islink(driver_path):
+            interface[DRIVER] = os.path.basename(os.readlink(driver_path))
+        ifindex, flags, mtu, carrier_changes = signature
+        try:
+            interface[MTU] = int(mtu)
+            interface[UP] = bool(int(flags, 16) & IFF_UP)
+        except (TypeError, ValueError):
+            interface[UP] = False
+        return interface
+
+    def get_ip_address(self, name):
+        """Primary IPv4 address of the interface, None if it has none."""
+        if self.ioctl_socket is None:
+            self.ioctl_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            ifreq = fcntl.ioctl(self.ioctl_socket.fileno(), SIOCGIFADDR, struct.pack("256s", name[:15]))
+        except IOError:
+            return None
+        return socket.inet_ntoa(ifreq[20:24])
+
+    def get_static_data(self, names):
+        """Returns interface name -> static attributes and current IPv4 address, for the given interfaces."""
+        dict_nics = {}
+        with self.lock:
+            interfaces = {}
+            for name in names:
+                path = os.path.join(SYS_CLASS_NET, name)
+                signature = self.get_signature(path)
+                cached = self.interfaces.get(name)
+                if cached is None or cached[0] != signature:
+                    cached = (signature, self.build(path, signature))
+                    collectd.debug("libnetdev: static data of %s refreshed" % name)
+                interfaces[name] = cached
+                dict_nics[name] = dict(cached[1])
+                ip_address = self.get_ip_address(name)
+                if ip_address:
+                    dict_nics[name][IPADDR] = ip_address
+            # interfaces which are gone are dropped from the cache
+            self.interfaces = interfaces
+        return dict_nics
+
+
+INTERFACES = InterfaceCache()
+
+
+def get_static_data(names):
+    return INTERFACES.get_static_data(names)
@@ -0,0 +1,90 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to count hardware events system wide with perf_event_open, one counter per CPU
+"""
+
+import os
+import struct
+import ctypes
+import platform
+import collectd
+import utils
+import libprocfs
+from constants import *
+
+LIBC = ctypes.CDLL(None, use_errno=True)
+# perf_event_open has no libc wrapper
+PERF_EVENT_OPEN_NR = {"x86_64": 298, "i386": 336, "i686": 336, "aarch64": 241, "armv7l": 364, "ppc64le": 319,
+                      "ppc64": 319, "s390x": 331}
+
+
+def perf_event_open(event_type, config, cpu):
+    """Opens a counter of the event on one CPU for every process, returns its fd."""
+    if platform.machine() not in PERF_EVENT_OPEN_NR:
+        raise OSError("perf_event_open is not known on %s" % platform.machine())
+    # struct perf_event_attr, first version layout: type, size, config, sample_period, sample_type,
+    # read_format, flags, wakeup_events, bp_type, config1
+    attr = struct.pack("=IIQQQQQIIQ", event_type, PERF_ATTR_SIZE, config, 0, 0, PERF_READ_FORMAT, 0, 0, 0, 0)
+    fd = LIBC.syscall(PERF_EVENT_OPEN_NR[platform.machine()], attr, -1, cpu, -1, 0)
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return fd
+
+
+class PerfCounters(object):
+    """Hardware events counted by the kernel on every online CPU.
+
+    The counters are opened once and only read() on each poll, so reading them never blocks
+    and no perf process is forked.
+    """
+
+    def __init__(self, events):
+        # name -> (perf type, perf config)
+        self.events = events
+        # name -> fd of the counter on every CPU
+        self.fds = {}
+        # fd -> scaled value of the previous read
+        self.prev = {}
+
+    def open(self):
+        """Opens the counters, returns False with every counter closed when the kernel denies one of them."""
+        try:
+            cpus = libprocfs.get_online_cpus(utils.read_sysfs(SYS_CPU_ONLINE, "0"))
+            for name, (event_type, config) in self.events.items():
+                self.fds[name] = []
+                for cpu in cpus:
+                    self.fds[name].append(perf_event_open(event_type, config, cpu))
+        except (OSError, ValueError) as err:
+            collectd.info("libperfevent: hardware counters are not available: %s" % err)
+            self.close()
+            return False
+        return True
+
+    def read(self):
+        """Returns event name -> count since the previous read, summed over the CPUs."""
+        counts = {}
+        for name, fds in self.fds.items():
+            counts[name] = 0
+            for fd in fds:
+                try:
+                    value, time_enabled, time_running = struct.unpack("=QQQ", os.read(fd, 24))
+                except (OSError, struct.error):
+                    continue
+                # scale up when the PMU had to multiplex this counter with other events
+                scaled = value * time_enabled / time_running if time_running else 0
+                counts[name] += max(scaled - self.prev.get(fd, 0), 0)
+                self.prev[fd] = scaled
+        return counts
+
+    def close(self):
+        for fds in self.fds.values():
+            for fd in fds:
+                os.close(fd)
+        self.fds = {}
+        self.prev = {}
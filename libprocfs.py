@@ -0,0 +1,262 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to read /proc files once per tick and share the parsed content between the linux collectors
+"""
+
+import os
+import time
+import threading
+import utils
+from constants import *
+
+
+class ProcSnapshot(object):
+    """Content of /proc files and their parsed views, kept for one tick.
+
+    The linux collectors poll at the same interval, so the first one reading a file in a tick
+    reads and parses it and the others get the same objects. Parsed views are shared and must
+    not be modified by the callers.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # path -> (tick, content)
+        self.files = {}
+        # (path, parser) -> (tick, parsed content)
+        self.views = {}
+        # path -> read size, grown to the largest size seen so that one read() gets the whole file
+        self.read_sizes = {}
+
+    def read_file(self, path):
+        size = self.read_sizes.get(path, PROC_READ_SIZE)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            chunks = [os.read(fd, size)]
+            while chunks[-1]:
+                chunks.append(os.read(fd, size))
+        finally:
+            os.close(fd)
+        if len(chunks) > 2:
+            self.read_sizes[path] = size * len(chunks)
+        return "".join(chunks)
+
+    def read(self, path):
+        """Returns the content of the file, read at most once per tick."""
+        tick = int(time.time() / PROC_SNAPSHOT_TICK)
+        with self.lock:
+            cached = self.files.get(path)
+            if cached is None or cached[0] != tick:
+                cached = (tick, self.read_file(path))
+                self.files[path] = cached
+            return cached[1]
+
+    def parsed(self, path, parser):
+        """Returns parser(content of the file), parsed at most once per tick."""
+        tick = int(time.time() / PROC_SNAPSHOT_TICK)
+        content = self.read(path)
+        with self.lock:
+            cached = self.views.get((path, parser))
+            if cached is None or cached[0] != tick:
+                cached = (tick, parser(content))
+                self.views[(path, parser)] = cached
+            return cached[1]
+
+
+def parse_meminfo(content):
+    """meminfo field -> bytes."""
+    meminfo = {}
+    for line in content.splitlines():
+        fields = line.split()
+        meminfo[fields[0].rstrip(":")] = int(fields[1]) * 1024 if len(fields) > 2 else int(fields[1])
+    return meminfo
+
+
+def parse_cpu_times(content):
+    """Returns the cpu times of all CPUs and the list of the cpu times of every CPU, in ticks.
+
+    Like psutil, guest time is taken out of user and nice time, which already include it.
+    """
+    total = None
+    per_cpu = []
+    for line in content.splitlines():
+        if not line.startswith("cpu"):
+            break
+        fields = [int(value) for value in line.split()[1:]]
+        fields.extend([0] * (len(CPU_TIME_FIELDS) - len(fields)))
+        times = dict(zip(CPU_TIME_FIELDS, fields))
+        times["user"] -= times["guest"]
+        times["nice"] -= times["guest_nice"]
+        if line.startswith("cpu "):
+            total = times
+        else:
+            per_cpu.append(times)
+    return total, per_cpu
+
+
+def parse_snmp(content):
+    """/proc/net/snmp and /proc/net/netstat hold a header line and a value line per protocol,
+    returns protocol -> field -> value."""
+    snmp = {}
+    lines = content.splitlines()
+    for header, values in zip(lines[::2], lines[1::2]):
+        header = header.split()
+        snmp[header[0].rstrip(":")] = dict(zip(header[1:], [int(value) for value in values.split()[1:]]))
+    return snmp
+
+
+def cpu_times_percent(prev_times, curr_times):
+    """Percent of the elapsed cpu time spent in every state between two reads."""
+    deltas = dict((field, max(curr_times[field] - prev_times[field], 0)) for field in CPU_TIME_FIELDS)
+    total = sum(deltas.values())
+    if not total:
+        return dict((field, 0.0) for field in CPU_TIME_FIELDS)
+    return dict((field, round(deltas[field] * 100.0 / total, 1)) for field in CPU_TIME_FIELDS)
+
+
+def cpu_percent(prev_times, curr_times):
+    """Busy percent between two reads, idle and iowait count as not busy."""
+    percent = cpu_times_percent(prev_times, curr_times)
+    return round(max(100.0 - percent["idle"] - percent["iowait"], 0.0), 1)
+
+
+def get_online_cpus(online):
+    """CPU numbers of a sysfs cpu list such as "0-3,8"."""
+    cpus = []
+    for cpu_range in online.split(","):
+        first, _, last = cpu_range.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def parse_cpuinfo(content):
+    """Model, sockets, cores, logical CPUs and hyperthreading from /proc/cpuinfo, in one pass."""
+    logical_cpus, physical_cpus, cores = set(), set(), set()
+    model_list = []
+    total_freq = 0
+    count_freq = 0
+    for line in content.splitlines():
+        key, separator, value = line.partition(":")
+        if not separator:
+            continue
+        # keys are padded with tabs up to the colon
+        key = key.rstrip()
+        if key == "processor":
+            logical_cpus.add(int(value))
+        elif key == "physical id":
+            physical_cpus.add(int(value))
+        elif key == "core id":
+            cores.add(int(value))
+        elif key == "model name":
+            value = value.strip()
+            if value not in model_list:
+                model_list.append(value)
+        elif key == "cpu MHz":
+            total_freq += float(value)
+            count_freq += 1
+
+    hyperthreading = logical_cpus and physical_cpus and cores and \
+        len(cores) * len(physical_cpus) * 2 == len(logical_cpus)
+    dict_cpu_static = {CPU_TYPE: ",".join(model_list), TOTAL_CORE: len(cores), SOCKET: len(physical_cpus),
+                       TOTAL_LOGICAL_CPU: len(logical_cpus), HT: "On" if hyperthreading else "off"}
+    if count_freq != 0:
+        dict_cpu_static[CLOCK] = round(total_freq / count_freq, FLOATING_FACTOR)
+    return dict_cpu_static
+
+
+class CpuInfoCache(object):
+    """Static cpu record from /proc/cpuinfo, which can be several hundred KB on large machines.
+
+    Model, sockets and cores only change on CPU hotplug, so the file is reparsed only when
+    /sys/devices/system/cpu/online changes. The clock does change, it is read from cpufreq
+    on every call when the kernel exposes it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.online = None
+        self.cpus = []
+        self.record = None
+
+    def get_clock(self):
+        """Average current frequency of the online CPUs in MHz, None without cpufreq."""
+        freqs = []
+        for cpu in self.cpus:
+            freq = utils.read_sysfs(SYS_CPU_FREQ % cpu)
+            if freq:
+                freqs.append(int(freq))
+        return round(float(sum(freqs)) / len(freqs) / 1000, FLOATING_FACTOR) if freqs else None
+
+    def get(self):
+        online = utils.read_sysfs(SYS_CPU_ONLINE)
+        with self.lock:
+            if self.record is None or online != self.online:
+                with open(PROC_CPUINFO) as cpuinfo_file:
+                    self.record = parse_cpuinfo(cpuinfo_file.read())
+                self.online = online
+                self.cpus = get_online_cpus(online) if online else []
+            dict_cpu_static = dict(self.record)
+            clock = self.get_clock()
+        if clock is not None:
+            dict_cpu_static[CLOCK] = clock
+        return dict_cpu_static
+
+
+SNAPSHOT = ProcSnapshot()
+CPUINFO = CpuInfoCache()
+
+
+def read(path):
+    return SNAPSHOT.read(path)
+
+
+def get_meminfo():
+    return SNAPSHOT.parsed(PROC_MEMINFO, parse_meminfo)
+
+
+def get_cpu_times():
+    return SNAPSHOT.parsed(PROC_STAT, parse_cpu_times)
+
+
+def get_snmp():
+    return SNAPSHOT.parsed(PROC_NET_SNMP, parse_snmp)
+
+
+def get_netstat():
+    return SNAPSHOT.parsed(PROC_NET_NETSTAT, parse_snmp)
+
+
+def get_tcp_ext():
+    """TcpExt and IpExt counters of TCP_EXT_FIELDS, by reported key."""
+    netstat = get_netstat()
+    return dict((key, netstat[protocol][field]) for protocol, field, key in TCP_EXT_FIELDS
+                if field in netstat.get(protocol, {}))
+
+
+def get_cpu_static():
+    return CPUINFO.get()
+
+
+def get_virtual_memory():
+    """Memory figures in bytes, computed as psutil.virtual_memory does."""
+    meminfo = get_meminfo()
+    total, free, buffers = meminfo["MemTotal"], meminfo["MemFree"], meminfo.get("Buffers", 0)
+    cached = meminfo.get("Cached", 0) + meminfo.get("SReclaimable", 0)
+    available = meminfo.get("MemAvailable", free + buffers + cached)
+    used = total - free - buffers - cached
+    if used < 0:
+        used = total - free
+    return {"total": total, "available": available, "free": free, "buffers": buffers, "cached": cached,
+            "used": used, "percent": round((total - available) * 100.0 / total, 1) if total else 0.0}
+
+
+def get_swap_memory():
+    """Swap figures in bytes, computed as psutil.swap_memory does."""
+    meminfo = get_meminfo()
+    total, free = meminfo.get("SwapTotal", 0), meminfo.get("SwapFree", 0)
+    return {"total": total, "free": free, "used": total - free,
+            "percent": round((total - free) * 100.0 / total, 1) if total else 0.0}
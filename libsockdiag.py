@@ -0,0 +1,114 @@
+"""
+*******************
+*Copyright 2017, MapleLabs, All Rights Reserved.
+*
+********************
+"""
+"""
+python script to aggregate the TCP sockets dumped over NETLINK_SOCK_DIAG, without reading the
+/proc/net/tcp text tables
+"""
+
+import socket
+import struct
+from constants import *
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+# struct inet_diag_req_v2: family, protocol, ext, pad, states, zeroed inet_diag_sockid
+INET_DIAG_REQUEST = struct.Struct("=BBBBI48x")
+# struct inet_diag_msg: family, state, timer, retrans, then the source port in network order
+INET_DIAG_MSG = struct.Struct("=BBBB")
+INET_DIAG_PORT = struct.Struct("!H")
+INET_DIAG_MSG_SIZE = 72
+RTATTR_HEADER = struct.Struct("=HH")
+UINT32 = struct.Struct("=I")
+
+
+def parse_diag_msg(data, offset, end):
+    """Returns state, local port, rtt and cwnd of one inet_diag_msg, rtt and cwnd are None without tcp_info."""
+    state = INET_DIAG_MSG.unpack_from(data, offset)[1]
+    port = INET_DIAG_PORT.unpack_from(data, offset + 4)[0]
+    rtt = cwnd = None
+    attr_offset = offset + INET_DIAG_MSG_SIZE
+    while attr_offset + RTATTR_HEADER.size <= end:
+        attr_len, attr_type = RTATTR_HEADER.unpack_from(data, attr_offset)
+        if attr_len < RTATTR_HEADER.size:
+            break
+        if attr_type == INET_DIAG_INFO and attr_len >= RTATTR_HEADER.size + TCP_INFO_CWND_OFFSET + 4:
+            rtt = UINT32.unpack_from(data, attr_offset + RTATTR_HEADER.size + TCP_INFO_RTT_OFFSET)[0]
+            cwnd = UINT32.unpack_from(data, attr_offset + RTATTR_HEADER.size + TCP_INFO_CWND_OFFSET)[0]
+        attr_offset += (attr_len + 3) & ~3
+    return state, port, rtt, cwnd
+
+
+def dump_tcp_sockets():
+    """Yields state, local port, rtt in microseconds and cwnd of every IPv4 and IPv6 TCP socket."""
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+    try:
+        sock.settimeout(TCP_DIAG_TIMEOUT)
+        sock.bind((0, 0))
+        for seq, family in enumerate((socket.AF_INET, socket.AF_INET6), 1):
+            request = INET_DIAG_REQUEST.pack(family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), 0, 0xffffffff)
+            sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY,
+                                        NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + request)
+            done = False
+            while not done:
+                data = sock.recv(TCP_DIAG_RECV_SIZE)
+                offset = 0
+                while offset + NLMSG_HEADER.size <= len(data):
+                    msg_len, msg_type = NLMSG_HEADER.unpack_from(data, offset)[:2]
+                    if msg_type == NLMSG_DONE:
+                        done = True
+                        break
+                    if msg_type == NLMSG_ERROR:
+                        error = -struct.unpack_from("=i", data, offset + NLMSG_HEADER.size)[0]
+                        raise socket.error(error, "sock_diag dump failed")
+                    yield parse_diag_msg(data, offset + NLMSG_HEADER.size, offset + msg_len)
+                    offset += (msg_len + 3) & ~3
+    finally:
+        sock.close()
+
+
+def get_percentile(buckets, count, percent, max_value):
+    """Upper bound of the histogram bucket holding the given percentile, capped at the largest sample."""
+    seen = 0
+    for index, bucket in enumerate(buckets):
+        seen += bucket
+        if seen * 100 >= count * percent:
+            return min((1 << index) - 1, max_value)
+    return max_value
+
+
+def get_tcp_socket_stats():
+    """Returns the socket count of every TCP state, and per listening port the number of accepted
+    connections with their rtt (ms) average, p50, p99 and average cwnd, busiest ports first."""
+    state_counts = dict((state_name, 0) for state_name in TCP_STATES.values())
+    listen_ports = set()
+    # local port -> [connections, rtt total, rtt max, cwnd total, rtt histogram]
+    connections = {}
+    for state, port, rtt, cwnd in dump_tcp_sockets():
+        if state in TCP_STATES:
+            state_counts[TCP_STATES[state]] += 1
+        if state == TCP_LISTEN:
+            listen_ports.add(port)
+        elif rtt is not None:
+            if port not in connections:
+                connections[port] = [0, 0, 0, 0, [0] * TCP_RTT_BUCKETS]
+            port_stats = connections[port]
+            port_stats[0] += 1
+            port_stats[1] += rtt
+            port_stats[2] = max(port_stats[2], rtt)
+            port_stats[3] += cwnd
+            port_stats[4][min(rtt.bit_length(), TCP_RTT_BUCKETS - 1)] += 1
+
+    # connections whose local port is a listening port were accepted on it
+    ports = [(port, connections[port]) for port in listen_ports if port in connections]
+    ports.sort(key=lambda item: item[1][0], reverse=True)
+    port_list = []
+    for port, (count, rtt_total, rtt_max, cwnd_total, buckets) in ports[:TCP_MAX_LISTEN_PORTS]:
+        port_list.append({"port": port, "connections": count,
+                          "rttAvg": round(float(rtt_total) / count / 1000, FLOATING_FACTOR),
+                          "rttP50": round(get_percentile(buckets, count, 50, rtt_max) / 1000.0, FLOATING_FACTOR),
+                          "rttP99": round(get_percentile(buckets, count, 99, rtt_max) / 1000.0, FLOATING_FACTOR),
+                          "cwndAvg": round(float(cwnd_total) / count, FLOATING_FACTOR)})
+    return state_counts, port_list
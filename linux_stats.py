@@ -11,11 +11,8 @@
 import signal
 import json
 import time
-import psutil
 import collectd
 import datetime
-import socket
-import re
 import copy
 from copy import deepcopy
 
@@ -23,6 +20,9 @@ from copy import deepcopy
 # user imports
 import utils
 import libdiskstat
+import libdisktopology
+import libnetdev
+import libprocfs
 from constants import *
 
 
@@ -36,6 +36,7 @@ class LinuxStats(object):
         self.prev_disk_data = dict()
         self.prev_nic_data = dict()
         self.first_poll = True
+        self.prev_cpu_times = None
 
     def config(self, cfg):
         """Initializes variables from conf files."""
@@ -47,18 +48,21 @@ class LinuxStats(object):
         """
         Returns dictionary with values of available and ram utilization information.
         """
-        mem = psutil.virtual_memory()
+        mem = libprocfs.get_virtual_memory()
         dict_ram_util = {'available': round(
-            float(mem.available) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR), 'RAMUtil': mem.percent,
-            'total': mem.total}
+            float(mem["available"]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR), 'RAMUtil': mem["percent"],
+            'total': mem["total"]}
         return dict_ram_util
     
     def add_cpu_data(self):
         """Returns dictionary with values of total,per core CPU utilization
            and no. of cores in low, medium and high range."""
-        dict_cpu_util = {CPU_UTIL: psutil.cpu_percent(
-            interval=None, percpu=False)}
-        per_cpu_util = psutil.cpu_percent(interval=None, percpu=True)
+        total_times, per_cpu_times = libprocfs.get_cpu_times()
+        prev_total_times, prev_per_cpu_times = self.prev_cpu_times or (total_times, per_cpu_times)
+        self.prev_cpu_times = (total_times, per_cpu_times)
+        dict_cpu_util = {CPU_UTIL: libprocfs.cpu_percent(prev_total_times, total_times)}
+        per_cpu_util = [libprocfs.cpu_percent(prev_times, curr_times)
+                        for prev_times, curr_times in zip(prev_per_cpu_times, per_cpu_times)]
         no_of_cores = len(per_cpu_util)
 
         dict_cpu_util[NUM_HIGH_ACTIVE] = dict_cpu_util[
@@ -81,26 +85,14 @@ class LinuxStats(object):
         """
         Function to get tcp_reset and tcp_retrans values.
         """
-        retrans = resets_recv = resets_sent = 0
         try:
-            with open("/proc/net/snmp") as snmp_file:
-                snmp_output = snmp_file.readlines()
-        except IOError:
+            tcp_stat = libprocfs.get_snmp()["Tcp"]
+        except (IOError, OSError, KeyError):
             collectd.error(
                 "Plugin tcp_stats: Could not open file : /proc/net/snmp")
             return FAILURE, None
 
-        flag = 0
-        for i in range(0, len(snmp_output)):
-            if 'Tcp:' not in snmp_output[i]:
-                continue
-            if flag:
-                tcp_stat = snmp_output[i].split(" ")
-                resets_recv = tcp_stat[8]
-                retrans = tcp_stat[12]
-                resets_sent = tcp_stat[14]
-                return SUCCESS, [retrans, resets_sent, resets_recv]
-            flag += 1
+        return SUCCESS, [tcp_stat["RetransSegs"], tcp_stat["OutRsts"], tcp_stat["EstabResets"]]
 
     def get_tcp_buffersize(self):
         """Returns dictionary with values of tcpWin(low, medium and high),
@@ -108,17 +100,15 @@ class LinuxStats(object):
         dict_tcp = {}
 
         try:
-            with open("/proc/sys/net/ipv4/tcp_wmem") as tcp_wmem_file:
-                wmem_lines = tcp_wmem_file.readline()
-        except IOError:
+            wmem_lines = libprocfs.read(PROC_TCP_WMEM)
+        except (IOError, OSError):
             collectd.error(
                 "Plugin tcp_stats: Could not open file : /proc/sys/net/ipv4/tcp_wmem")
             return None
 
         try:
-            with open("/proc/sys/net/ipv4/tcp_rmem") as tcp_rmem_file:
-                rmem_lines = tcp_rmem_file.readline()
-        except IOError:
+            rmem_lines = libprocfs.read(PROC_TCP_RMEM)
+        except (IOError, OSError):
             collectd.error(
                 "Plugin tcp_stats: Could not open file : /proc/sys/net/ipv4/tcp_rmem")
             return None
@@ -154,19 +144,24 @@ class LinuxStats(object):
             dict_tcp[TCPRETRANS] = int(val_list[0])
             dict_tcp[TCPRESET] = tcp_resets
 
+        try:
+            dict_tcp.update(libprocfs.get_tcp_ext())
+        except (IOError, OSError):
+            collectd.error(
+                "Plugin tcp_stats: Could not open file : %s" % PROC_NET_NETSTAT)
+
         return dict_tcp
 
 
 
     def get_disk_info(self):
         """Function to get name, type, size and mountpoint info of disk and partition."""
-        (lsblk, err) = utils.get_cmd_output(
-            'lsblk -bno  KNAME,TYPE,SIZE,MOUNTPOINT | grep \'disk\|part\'')
-        if err:
-            collectd.error('Plugin disk_stat: error in lsblk command')
-            return None
-
-        disk_info = re.split('\n', lsblk)
+        mountpoints = libdisktopology.get_mountpoints()
+        disk_info = []
+        for name, device in libdisktopology.get_devices().items():
+            if device.type in (DISK, PART):
+                disk_info.append((name, device.type, libdisktopology.get_device_size(device),
+                                  mountpoints.get(name, [])))
         return disk_info
 
     def get_disk_static_data(self):
@@ -176,24 +171,12 @@ class LinuxStats(object):
         if not list_disk:
             return None
 
-        index = 0
-        num_lines = len(list_disk)
-
-        while index < num_lines:
-            line = list_disk[index]
-            if line:
-                parts = re.split(r'\s+', line.strip())
-                disk = {DISK_TYPE: parts[1], CAPACITY: round(
-                    float(parts[2]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)}
-                if len(parts) == 4:
-                    disk[MOUNTPOINT] = parts[3]
-                else:
-                    disk[MOUNTPOINT] = []
-                if SWAP not in disk[MOUNTPOINT]:
-                    dict_disk[parts[0]] = disk
-                index += 1
-            else:
-                break
+        for name, dev_type, size, mountpoint in list_disk:
+            disk = {DISK_TYPE: dev_type, CAPACITY: round(
+                float(size) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)}
+            disk[MOUNTPOINT] = mountpoint
+            if SWAP not in disk[MOUNTPOINT]:
+                dict_disk[name] = disk
 
         return dict_disk
 
@@ -229,45 +212,18 @@ class LinuxStats(object):
 
     def add_agg_capacity(self):
         """Function to get total capacity."""
-        lsblk, err = utils.get_cmd_output(
-            "lsblk -nbo KNAME,TYPE,SIZE | grep disk | grep -v fd | awk '{print $3}'")
-        if err:
-            collectd.error("Plugin disk_stat : error in lsblk command")
-            return None
-
-        sdlines = re.split("\n", lsblk)
-        num_lines = len(sdlines)
-        index = 0
         total_sum = 0
-        while index < num_lines:
-            line = sdlines[index]
-            if line:
-                total_sum += int(line)
-                index += 1
-            else:
-                index += 1
+        for name, device in libdisktopology.get_devices().items():
+            if device.type == DISK and "fd" not in name:
+                total_sum += libdisktopology.get_device_size(device)
         return round(float(total_sum) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)
 
     def add_agg_usage(self):
         """Function to get total usage."""
-        (df_out, err) = utils.get_cmd_output(
-            "df -kl |awk '/^\/dev\//' | awk '{print $3}'")
-        if err:
-            collectd.error('Plugin disk_stat: error in df command')
-            return None
-
-        splines = re.split('\n', df_out)
-        unum_lines = len(splines)
-        uindex = 0
         usage_sum = 0
-        while uindex < unum_lines:
-            line = splines[uindex]
-            if line:
-                usage_sum += int(line)  # usage_sum is in Kb
-                uindex += 1
-            else:
-                uindex += 1
-        return round(float((usage_sum * FACTOR)) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)
+        for usage in libdisktopology.get_fs_usage().values():
+            usage_sum += usage.used
+        return round(float(usage_sum) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR)
 
     def add_disk_aggregate(self, dict_disks):
         """Function to get aggregate of all disk. MOUNTPOINT key is not added"""
@@ -345,83 +301,12 @@ class LinuxStats(object):
     def add_cpu_static_data(self):
         """Return dictionary with values of  CPUType, HT, CLOCK, SOCKET, TOTAL_CORE
         and TOTAL_LOGICAL_CPU obtained from /proc/cpuinfo file."""
-        dict_cpu_static = {}
-        total_logical_cpus = 0
-        total_physical_cpus = 0
-        total_cores = 0
-        keyword_processor_found = False
-        keyword_physical_id_found = False
-        keyword_core_id_found = False
-        logical_cpus = {}
-        physical_cpus = {}
-        cores = {}
-        hyperthreading = 0
-        model_list = []
-        total_freq = 0
-        count_freq = 0
-
         try:
-            with open('/proc/cpuinfo') as cpuinfo_file:
-                lines = cpuinfo_file.readlines()
-        except IOError:
+            return libprocfs.get_cpu_static()
+        except (IOError, OSError, ValueError):
             collectd.error("Plugin cpu_static: Unable to open /proc/cpuinfo")
             return None
 
-        index = 0
-        while index < len(lines):
-            line = lines[index]
-            if re.match('processor', line):
-                cpu = int(line.split()[2])
-                keyword_processor_found = True
-
-                if cpu not in logical_cpus:
-                    logical_cpus[cpu] = []
-                    total_logical_cpus += 1
-
-            if re.match('physical id', line):
-                phys_id = int(line.split()[3])
-                keyword_physical_id_found = True
-
-                if phys_id not in physical_cpus:
-                    physical_cpus[phys_id] = []
-                    total_physical_cpus += 1
-
-            if re.match('core id', line):
-                core = int(line.split()[3])
-                keyword_core_id_found = True
-
-                if core not in cores:
-                    cores[core] = []
-                    total_cores += 1
-
-            if re.match('model name', line):
-                modelname = line.split(":")
-                modelname = str(modelname[1]).strip(' ')
-                modelname = modelname.strip('\n')
-                if modelname not in model_list:
-                    model_list.append(modelname)
-
-            if re.match("cpu MHz", line):
-                total_freq += float(line.split()[3])
-                count_freq += 1
-
-            index += 1
-
-        if keyword_processor_found and keyword_physical_id_found and keyword_core_id_found:
-            if (total_cores * total_physical_cpus) * 2 == total_logical_cpus:
-                hyperthreading = 1
-            model_name = ",".join(model_list)
-
-        dict_cpu_static[CPU_TYPE] = model_name
-        if count_freq != 0:
-            dict_cpu_static[CLOCK] = round(
-                total_freq / count_freq, FLOATING_FACTOR)
-        dict_cpu_static[TOTAL_CORE] = total_cores
-        dict_cpu_static[SOCKET] = total_physical_cpus
-        dict_cpu_static[TOTAL_LOGICAL_CPU] = total_logical_cpus
-        dict_cpu_static[HT] = "On" if int(hyperthreading) else "off"
-        return dict_cpu_static
-
 
 
 
@@ -439,62 +324,20 @@ class LinuxStats(object):
 
     
 
-    def get_virtual_interfaces(self):
-        """Function to get all virtual nics."""
-        virt_if_list = []
-        (virt_dev, err) = utils.get_cmd_output(
-            'ls -l /sys/class/net/ | grep devices/virtual')
-        if err:
-            return virt_if_list
-
-        virt_dev = virt_dev.splitlines()
-        for device in virt_dev:
-            # At the end of each line we have "/" followed by interface name
-            index = device.rfind("/")
-            if index != -1:
-                ifname = device[index + 1:]
-                virt_if_list.append(ifname)
-
-        return virt_if_list
-
-    def get_nic_static_data(self):
-        """Returns dictionary with values of NIC_TYPE, IPADDR, MAC, SPEED, MTU and UP info."""
-        dict_nics = {}  # will contain data for all interfaces
-        for if_name, if_info in psutil.net_if_addrs().items():
-            interface = {NIC_TYPE: VIRT}
-        #    interface[NICNAME] = if_name
-            for add_family in if_info:
-                if add_family.family == socket.AF_INET:
-                    interface[IPADDR] = add_family.address
-                elif add_family.family != socket.AF_INET6:
-                    interface[MAC] = add_family.address
-            dict_nics[if_name] = interface
-
+    def get_nic_static_data(self, if_names):
+        """Returns dictionary with values of NIC_TYPE, IPADDR, MAC, SPEED, DUPLEX, DRIVER, MTU and UP info."""
+        dict_nics = libnetdev.get_static_data(if_names)
         if not dict_nics:
             return None
-
-        virt_list = self.get_virtual_interfaces()
-        for if_name, if_info in psutil.net_if_stats().items():
-            if if_name in dict_nics:
-                if if_name not in virt_list:
-                    dict_nics[if_name][NIC_TYPE] = PHY
-                dict_nics[if_name][SPEED] = round(
-                    (float(if_info.speed) / (FACTOR * 8)), FLOATING_FACTOR)
-                dict_nics[if_name][MTU] = if_info.mtu
-                dict_nics[if_name][UP] = if_info.isup
-
         return dict_nics
 
     def get_nic_dynamic_data(self):
         """Returns dictionary with values of RX/TX_PKTS,RX/TX_PKTS,RX/TX_DROPS and RX/TX_BYTES."""
-        dict_nics = {}
-        for if_name, if_info in psutil.net_io_counters(pernic=True).items():
-            interface = {RX_PKTS: if_info.packets_recv, TX_PKTS: if_info.packets_sent, RX_DROPS: if_info.dropin,
-                         TX_DROPS: if_info.dropout, RX_BYTES: if_info.bytes_recv, TX_BYTES: if_info.bytes_sent}
-        #    interface[NICNAME]  = if_name
-            dict_nics[if_name] = interface
-
-        return dict_nics
+        try:
+            return libnetdev.get_counters()
+        except (IOError, OSError, ValueError, IndexError) as err:
+            collectd.error("Plugin nic_stats: Unable to read %s due to %s" % (PROC_NET_DEV, err))
+            return {}
 
     def join_nic_dicts(self, if_static_data, if_dynamic_data):
         """Merges param1 with param2.
@@ -560,18 +403,18 @@ class LinuxStats(object):
 
 
     def add_nic_data(self):
-        # get static data of interfaces
-        if_static_data = self.get_nic_static_data()
-        if not if_static_data:
-            collectd.error(
-                "Plugin nic_stats: Unable to fetch static data for interfaces.")
-            return None
         # get dynamic data
         if_dynamic_data = self.get_nic_dynamic_data()
         if not if_dynamic_data:
             collectd.error(
                 "Plugin nic_stats: Unable to fetch dynamic data for interfaces.")
             return None
+        # get static data of interfaces
+        if_static_data = self.get_nic_static_data(if_dynamic_data.keys())
+        if not if_static_data:
+            collectd.error(
+                "Plugin nic_stats: Unable to fetch static data for interfaces.")
+            return None
 
         # join data
         dict_nics = self.join_nic_dicts(if_static_data, if_dynamic_data)
@@ -1,9 +1,12 @@
 import collectd
 import pymongo
 from pymongo import MongoClient
+from multiprocessing.pool import ThreadPool
 import signal
 import json
+import heapq
 import time
+import datetime
 from copy import deepcopy
 from constants import *
 from utils import *
@@ -22,8 +25,14 @@ class MongoStats():
         self.user = None
         self.password = None 
         self.hosts = []
+        self.workers = None
+        self.num_workers = MONGO_COLLSTATS_WORKERS
         self.interval = 0
-        self.prev_slowqueries = {}
+        self.profile_ts = {}
+        self.slow_queries = None
+        self.profile_max_docs = MONGO_PROFILE_MAX_DOCS
+        self.top_slow_queries = MONGO_SLOW_QUERY_TOP
+        self.max_query_shapes = MONGO_SLOW_QUERY_MAX_SHAPES
         self.aggr_server_data = {'dbSize':0, 'indexSize': 0}
         self.previous_data = {"bytesReceived":0,"virtualmem":0,"residentmem":0,"bytesSent":0,"numdelete":0,"numinsert":0,"numselect":0,"numupdate":0,"readQueue":0,"writeQueue":0,"readThreadsrun":0,"writeThreadsrun":0,"readThreadsavl":0,"writeThreadsavl":0,"numAbortedclients":0,"cachesize":0,"cacheusedsize":0,"cachedirtysize":0,"readrequest_queue":0,"numqueries":0
 ,"writerequest_queue":0,"msgasserts":0,"warningasserts":0,"regularasserts":0,"userasserts":0,"totalcursors":0,"pinnedcursors":0,"notimedoutcursors":0}
@@ -40,23 +49,28 @@ class MongoStats():
                 self.user = children.values[0]
             if children.key == PASSWORD:
                 self.password = children.values[0]
-
+            if children.key == "collstats_workers":
+                self.num_workers = int(children.values[0])
+            if children.key == "profile_max_docs":
+                self.profile_max_docs = int(children.values[0])
+            if children.key == "top_slow_queries":
+                self.top_slow_queries = int(children.values[0])
+            if children.key == "max_query_shapes":
+                self.max_query_shapes = int(children.values[0])
+
+    # Creating the long-lived client once, pymongo keeps its own connection pool and reconnects
     def connect_mongo(self):
+        if self.conn is not None:
+            return
         try:
-            retry_flag = True
-            retry_count = 0
-            while retry_flag:
-                try:
-                    self.conn = MongoClient(self.host+':'+self.port,username=self.user,password=self.password,authMechanism='SCRAM-SHA-1') 
-                    self.db = self.conn.admin
-                    retry_flag = False
-                    collectd.info("Connection to Mongo successfull in attempt %s" % (retry_count))
-                except Exception as e:
-                    collectd.error("Retry after 5 sec as connection to Mongo failed in attempt %s" % (retry_count))
-                    retry_count += 1
-                    time.sleep(5)
+            self.conn = MongoClient(self.host+':'+self.port,username=self.user,password=self.password,authMechanism='SCRAM-SHA-1',
+                                    connectTimeoutMS=MONGO_TIMEOUT_MS, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+                                    socketTimeoutMS=MONGO_TIMEOUT_MS)
+            self.db = self.conn.admin
+            collectd.info("Connection to Mongo successfull")
         except Exception as e:
             collectd.error("Exception in the connect_mongo due to %s" % e)
+            self.conn = None
             return
 
     def get_all_db(self):
@@ -66,8 +80,6 @@ class MongoStats():
             if db_details:
                 for each_db in db_details['databases']:
                     db_name.append(each_db['name'])
-                    if not each_db['name'] in self.prev_slowqueries:
-                        self.prev_slowqueries[each_db['name']] = 0 
             else:
                 collectd.info("No databases present in the server: %s"% self.host)
         except Exception as e:
@@ -75,15 +87,10 @@ class MongoStats():
         return db_name
 
     def connect_db(self, dbname):
-        try:
-            conn = MongoClient(self.host+':'+self.port,username=self.user,password=self.password,authMechanism='SCRAM-SHA-1') 
-            db = conn[dbname]
-            conn_flag = True
-        except Exception as e:
-            collectd.error("Exception in the connect_db due to %s" % e)
-            conn_flag = False
-            db = None
-        return db, conn_flag
+        if self.conn is None:
+            collectd.error("No connection to Mongo for the database %s" % dbname)
+            return None, False
+        return self.conn[dbname], True
 
 
     def get_db_data(self, final_dict, db_name):
@@ -106,14 +113,13 @@ class MongoStats():
                 if final_dict[db_name]:
                     final_dict[db_name]['_documentType'] = 'databaseDetails'
                     final_dict[db_name]['_dbName'] = db_name
-                    col = db_cur['system.profile']
-                    final_dict[db_name]['slowqueries'] ,self.prev_slowqueries[db_name]= int(col.count_documents({})) - self.prev_slowqueries[db_name],int(col.count_documents({}))
+                    final_dict[db_name]['slowqueries'] = self.read_profile(db_cur, db_name)
                 else:
                     collectd.info("Couldn't get any details for the given db ")
 
                     # To get table details for the given database
                 if final_dict[db_name]['numCollections'] != 0:
-                    final_dict = self.get_table_details(final_dict, db_name)
+                    final_dict = self.get_table_details(final_dict, db_name, db_cur)
                 else:
                     collectd.info("No tables found ")
             else:
@@ -124,14 +130,112 @@ class MongoStats():
         return final_dict
 
 
-    def get_table_details(self, final_dict, db_name):
+    # system.profile is a capped collection kept in insertion order, so it is read newest first
+    # and the scan stops at the entries seen in the previous poll
+    def read_profile(self, db_cur, db_name):
+        # resume point: (ts of the newest entry seen, _ids of the entries seen with that ts)
+        last_ts, last_ids = self.profile_ts.get(db_name, (None, ()))
+        first_poll = last_ts is None
+        newest_ts = None
+        newest_ids = set()
+        num_profiled = 0
+        cursor = db_cur['system.profile'].find({}, MONGO_PROFILE_FIELDS, sort=[('$natural', pymongo.DESCENDING)],
+                                               limit=self.profile_max_docs, batch_size=MONGO_PROFILE_BATCH_SIZE)
         try:
-            db, con_flag = self.connect_db(db_name)
-            coll_list = db.collection_names(include_system_collections=False)
+            for profile_doc in cursor:
+                if newest_ts is None:
+                    newest_ts = profile_doc['ts']
+                if profile_doc['ts'] == newest_ts:
+                    newest_ids.add(profile_doc['_id'])
+                elif first_poll:
+                    # First poll only records where to resume from
+                    break
+                if first_poll:
+                    continue
+                # entries sharing the boundary ts may have been profiled after the previous poll
+                if profile_doc['ts'] < last_ts:
+                    break
+                if profile_doc['ts'] == last_ts and profile_doc['_id'] in last_ids:
+                    continue
+                num_profiled += 1
+                if self.slow_queries is not None:
+                    self.add_slow_query(profile_doc)
+        finally:
+            cursor.close()
+        if newest_ts is not None:
+            if newest_ts == last_ts:
+                newest_ids.update(last_ids)
+            self.profile_ts[db_name] = (newest_ts, newest_ids)
+        elif first_poll:
+            # profile timestamps are naive UTC datetimes, so an empty profile resumes from now
+            self.profile_ts[db_name] = (datetime.datetime.utcnow(), set())
+        return num_profiled
+
+    @staticmethod
+    def query_shape(value):
+        # Literal values are replaced so that queries differing only in their arguments share a shape
+        if isinstance(value, dict):
+            return dict((key, MongoStats.query_shape(val)) for key, val in value.items())
+        if isinstance(value, (list, tuple)):
+            shape = [MongoStats.query_shape(val) for val in value]
+            if all(val == "?" for val in shape):
+                return "?"
+            return shape
+        return "?"
+
+    def get_query_shape(self, profile_doc):
+        command = profile_doc.get('command') or profile_doc.get('query') or {}
+        query = {}
+        for key in ("filter", "q", "query", "pipeline"):
+            if key in command:
+                query = command[key]
+                break
+        return self.query_shape(query)
+
+    def add_slow_query(self, profile_doc):
+        shape = self.get_query_shape(profile_doc)
+        # The serialized shape only identifies the bucket, the shape itself is reported as is
+        key = (profile_doc.get('ns', ''), profile_doc.get('op', ''),
+               json.dumps(shape, sort_keys=True)[:MONGO_QUERY_SHAPE_LEN])
+        if key not in self.slow_queries and len(self.slow_queries) >= self.max_query_shapes:
+            # Shapes beyond the budget are folded into a single bucket
+            key = (MONGO_OTHER_SHAPE, MONGO_OTHER_SHAPE, MONGO_OTHER_SHAPE)
+            shape = MONGO_OTHER_SHAPE
+        millis = int(profile_doc.get('millis', 0))
+        bucket = self.slow_queries.get(key)
+        if bucket is None:
+            self.slow_queries[key] = [1, millis, millis, shape]
+        else:
+            bucket[0] += 1
+            bucket[1] += millis
+            bucket[2] = max(bucket[2], millis)
+
+    def get_slow_query_details(self):
+        slow_query_dict = {'_documentType': 'slowQueryDetails', 'numSlowQueries': 0, 'totalMillis': 0, 'maxMillis': 0,
+                           'numQueryShapes': len(self.slow_queries)}
+        for count, total_millis, max_millis, _ in self.slow_queries.values():
+            slow_query_dict['numSlowQueries'] += count
+            slow_query_dict['totalMillis'] += total_millis
+            slow_query_dict['maxMillis'] = max(slow_query_dict['maxMillis'], max_millis)
+        top_queries = []
+        for (ns, op, _), (count, total_millis, max_millis, shape) in heapq.nlargest(
+                self.top_slow_queries, self.slow_queries.items(), key=lambda item: item[1][1]):
+            top_queries.append({'ns': ns, 'op': op, 'queryShape': shape, 'count': count, 'totalMillis': total_millis,
+                                'maxMillis': max_millis, 'avgMillis': round(float(total_millis) / count, 2)})
+        # write_json expands list valued strings back into a list
+        slow_query_dict['topQueries'] = json.dumps(top_queries)
+        return slow_query_dict
+
+    def get_table_details(self, final_dict, db_name, db):
+        try:
+            coll_list = [coll_name for coll_name in db.list_collection_names() if not coll_name.startswith("system.")]
+            # collstats runs once per collection, so the collections are fetched concurrently
+            if self.workers is None:
+                self.workers = ThreadPool(self.num_workers)
+            all_coll_stats = self.workers.map(lambda coll_name: db.command("collstats", coll_name), coll_list)
             agg_db_data = {"size" : 0, "indexSize" : 0,"numdoc":0,"storageSize":0}
-            for coll_name in coll_list:
+            for coll_name, coll_stats in zip(coll_list, all_coll_stats):
                 coll_dict = {}
-                coll_stats = db.command("collstats", coll_name)
                 coll_dict["_dbname"] = db_name
                 coll_dict["_numdoc"] = coll_stats["count"]
                 agg_db_data["numdoc"] += coll_dict["_numdoc"]
@@ -154,13 +258,11 @@ class MongoStats():
         return final_dict
 
 
-    def get_server_data(self):
+    def get_server_data(self, db_list):
         final_dict={}
         server_dict={}
         try:
-            db, con_flag = self.connect_db("admin")
-            db_list = self.get_all_db()
-            if con_flag:
+            if self.conn is not None:
                server_stats = self.db.command("serverStatus")
                server_dict['uptime'] = server_stats['uptime']
                server_dict['version'] = server_stats['version']
@@ -288,10 +390,16 @@ class MongoStats():
 
     def collect_data(self):
         # get data of Mongo
-        server_details = self.get_server_data()
         db_list = self.get_all_db()
-        for db_name in db_list:
-            final_details = self.get_db_data(server_details, db_name)
+        # Slow queries are only grouped by shape when their summary is requested
+        self.slow_queries = {} if "slowQueryDetails" in self.documentsTypes else None
+        final_details = self.get_server_data(db_list)
+        if final_details is not None:
+            for db_name in db_list:
+                final_details = self.get_db_data(final_details, db_name)
+        if final_details and self.slow_queries is not None:
+            final_details['slowQueryDetails'] = self.get_slow_query_details()
+            self.slow_queries = None
         if not final_details:
             collectd.error("Plugin Mongo: Unable to fetch data information of Mongo.")
             return
@@ -337,6 +445,12 @@ class MongoStats():
         collectd.unregister_read(self.read_temp)
         collectd.register_read(self.read, interval=int(self.interval))
 
+    def shutdown(self):
+        if self.workers is not None:
+            self.workers.terminate()
+        if self.conn is not None:
+            self.conn.close()
+
     def init():
         signal.signal(signal.SIGCHLD, signal.SIG_DFL)
 
@@ -344,5 +458,6 @@ class MongoStats():
 obj = MongoStats()
 collectd.register_config(obj.read_config)
 collectd.register_read(obj.read_temp)
+collectd.register_shutdown(obj.shutdown)
 
 
@@ -11,14 +11,13 @@
 
 import signal
 import time
-import socket
 import json
-import psutil
 import collectd
 import copy
 
 # user imports
 import utils
+import libnetdev
 from constants import *
 
 
@@ -38,62 +37,20 @@ class NicStats(object):
             if children.key == INTERVAL:
                 self.interval = children.values[0]
 
-    def get_virtual_interfaces(self):
-        """Function to get all virtual nics."""
-        virt_if_list = []
-        (virt_dev, err) = utils.get_cmd_output(
-            'ls -l /sys/class/net/ | grep devices/virtual')
-        if err:
-            return virt_if_list
-
-        virt_dev = virt_dev.splitlines()
-        for device in virt_dev:
-            # At the end of each line we have "/" followed by interface name
-            index = device.rfind("/")
-            if index != -1:
-                ifname = device[index + 1:]
-                virt_if_list.append(ifname)
-
-        return virt_if_list
-
-    def get_static_data(self):
-        """Returns dictionary with values of NIC_TYPE, IPADDR, MAC, SPEED, MTU and UP info."""
-        dict_nics = {}  # will contain data for all interfaces
-        for if_name, if_info in psutil.net_if_addrs().items():
-            interface = {NIC_TYPE: VIRT}
-        #    interface[NICNAME] = if_name
-            for add_family in if_info:
-                if add_family.family == socket.AF_INET:
-                    interface[IPADDR] = add_family.address
-                elif add_family.family != socket.AF_INET6:
-                    interface[MAC] = add_family.address
-            dict_nics[if_name] = interface
-
+    def get_static_data(self, if_names):
+        """Returns dictionary with values of NIC_TYPE, IPADDR, MAC, SPEED, DUPLEX, DRIVER, MTU and UP info."""
+        dict_nics = libnetdev.get_static_data(if_names)
         if not dict_nics:
             return None
-
-        virt_list = self.get_virtual_interfaces()
-        for if_name, if_info in psutil.net_if_stats().items():
-            if if_name in dict_nics:
-                if if_name not in virt_list:
-                    dict_nics[if_name][NIC_TYPE] = PHY
-                dict_nics[if_name][SPEED] = round(
-                    (float(if_info.speed) / (FACTOR * 8)), FLOATING_FACTOR)
-                dict_nics[if_name][MTU] = if_info.mtu
-                dict_nics[if_name][UP] = if_info.isup
-
         return dict_nics
 
     def get_dynamic_data(self):
         """Returns dictionary with values of RX/TX_PKTS,RX/TX_PKTS,RX/TX_DROPS and RX/TX_BYTES."""
-        dict_nics = {}
-        for if_name, if_info in psutil.net_io_counters(pernic=True).items():
-            interface = {RX_PKTS: if_info.packets_recv, TX_PKTS: if_info.packets_sent, RX_DROPS: if_info.dropin,
-                         TX_DROPS: if_info.dropout, RX_BYTES: if_info.bytes_recv, TX_BYTES: if_info.bytes_sent}
-        #    interface[NICNAME]  = if_name
-            dict_nics[if_name] = interface
-
-        return dict_nics
+        try:
+            return libnetdev.get_counters()
+        except (IOError, OSError, ValueError, IndexError) as err:
+            collectd.error("Plugin nic_stats: Unable to read %s due to %s" % (PROC_NET_DEV, err))
+            return {}
 
     def join_dicts(self, if_static_data, if_dynamic_data):
         """Merges param1 with param2.
@@ -174,13 +131,6 @@ class NicStats(object):
 
     def collect_data(self):
         """Collects all data."""
-        # get static data of interfaces
-        if_static_data = self.get_static_data()
-        if not if_static_data:
-            collectd.error(
-                "Plugin nic_stats: Unable to fetch static data for interfaces.")
-            return None
-
         # get dynamic data
         if_dynamic_data = self.get_dynamic_data()
         if not if_dynamic_data:
@@ -188,6 +138,13 @@ class NicStats(object):
                 "Plugin nic_stats: Unable to fetch dynamic data for interfaces.")
             return None
 
+        # get static data of interfaces
+        if_static_data = self.get_static_data(if_dynamic_data.keys())
+        if not if_static_data:
+            collectd.error(
+                "Plugin nic_stats: Unable to fetch static data for interfaces.")
+            return None
+
         # join data
         dict_nics = self.join_dicts(if_static_data, if_dynamic_data)
 
@@ -13,7 +13,12 @@ import time
 import json
 import psycopg2
 import calendar
+import heapq
 import traceback
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from psycopg2 import extensions
 
 # user imports
 from constants import *
@@ -21,6 +26,141 @@ from utils import *
 from libdiskstat import *
 from copy import deepcopy
 
+
+class PostgresConnectionPool(object):
+    """Bounded pool of long-lived connections, keyed by database name.
+
+    Connections are opened in autocommit mode so that every poll sees fresh
+    pg_stat_* snapshots, and carry a server side statement_timeout so that a
+    slow catalog query cannot hold the read callback. Each database has its own
+    CircuitBreaker, so one whose connect failed is skipped with a growing backoff
+    starting at retry_interval instead of sleeping.
+    """
+
+    def __init__(self, host, user, password, port, max_connections=Postgres.max_connections,
+                 statement_timeout=Postgres.statement_timeout, connect_timeout=Postgres.connect_timeout,
+                 retry_interval=Postgres.retry_interval):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.port = port
+        self.max_connections = int(max_connections)
+        self.statement_timeout = int(statement_timeout)
+        self.connect_timeout = int(connect_timeout)
+        self.retry_interval = int(retry_interval)
+        self.lock = threading.Lock()
+        # dbname -> list of (connection, last used time)
+        self.idle = {}
+        self.num_open = 0
+        self.breakers = {}
+
+    def _connect(self, dbname):
+        conn_str_db = Postgres.conn_str % (self.host, self.user, self.password, self.port, dbname)
+        conn = psycopg2.connect(conn_str_db, connect_timeout=self.connect_timeout,
+                                options="-c statement_timeout=%d" % self.statement_timeout)
+        conn.autocommit = True
+        return conn
+
+    @staticmethod
+    def _is_usable(conn, idle_since):
+        if conn.closed or conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.time() - idle_since < Postgres.health_check_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute(Postgres.ping_query)
+            cur.fetchall()
+            cur.close()
+            return True
+        except Exception as e:
+            collectd.debug("Health check of pooled postgres connection failed due to %s" % e)
+            return False
+
+    def _discard(self, conn):
+        """Close a connection and free its slot. Caller must hold the lock."""
+        self.num_open -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self):
+        """Close the least recently used idle connection. Caller must hold the lock."""
+        oldest_db = None
+        oldest_time = None
+        for dbname, conns in self.idle.items():
+            if conns and (oldest_time is None or conns[0][1] < oldest_time):
+                oldest_db = dbname
+                oldest_time = conns[0][1]
+        if oldest_db is None:
+            return False
+        conn, _ = self.idle[oldest_db].pop(0)
+        self._discard(conn)
+        return True
+
+    def breaker(self, dbname):
+        with self.lock:
+            if dbname not in self.breakers:
+                self.breakers[dbname] = CircuitBreaker("%s database" % dbname, self.retry_interval)
+            return self.breakers[dbname]
+
+    def num_unreachable(self):
+        with self.lock:
+            return len([breaker for breaker in self.breakers.values() if breaker.state != CircuitBreaker.CLOSED])
+
+    def get_connection(self, dbname):
+        """Returns a healthy connection to dbname, or None if none can be had right now."""
+        while True:
+            with self.lock:
+                conns = self.idle.get(dbname)
+                if not conns:
+                    break
+                conn, idle_since = conns.pop()
+            # The health check may hit the network, so it runs without holding the lock
+            if self._is_usable(conn, idle_since):
+                return conn
+            with self.lock:
+                self._discard(conn)
+        breaker = self.breaker(dbname)
+        with self.lock:
+            if not breaker.allow():
+                return None
+            if self.num_open >= self.max_connections and not self._evict_idle():
+                collectd.error("Postgres connection pool exhausted (%s connections), skipping db %s"
+                               % (self.max_connections, dbname))
+                return None
+            # Reserve the slot before connecting so that concurrent callers respect the bound
+            self.num_open += 1
+        try:
+            conn = self._connect(dbname)
+        except Exception as e:
+            collectd.error("Connection to %s database failed due to %s" % (dbname, e))
+            with self.lock:
+                self.num_open -= 1
+                breaker.failure()
+            return None
+        with self.lock:
+            breaker.success()
+        collectd.info("Connection to %s database is successfull" % dbname)
+        return conn
+
+    def release(self, dbname, conn):
+        """Hands a connection back to the pool, dropping it if it is no longer usable."""
+        with self.lock:
+            if conn.closed or conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(conn)
+                return
+            self.idle.setdefault(dbname, []).append((conn, time.time()))
+
+    def close_all(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn, _ in conns:
+                    self._discard(conn)
+            self.idle = {}
+
+
 class PostgresStats:
     def __init__(self):
         self.interval = DEFAULT_INTERVAL
@@ -29,21 +169,34 @@ class PostgresStats:
         self.password = None
         self.cur = None
         self.port = None
+        self.conn = None
+        self.pool = None
+        self.max_connections = Postgres.max_connections
+        self.statement_timeout = Postgres.statement_timeout
+        self.connect_timeout = Postgres.connect_timeout
+        self.retry_interval = Postgres.retry_interval
         self.version = None
         self.pollCounter = 0
-        self.pollDiff = {}
+        # db name -> counters of the previous poll
+        self.prevDbCounters = {}
+        # (userid, dbid, queryid) -> counters of the previous poll, and queryid -> normalised text
+        self.prevStatements = {}
+        self.statementText = {}
+        self.top_statements = Postgres.top_statements
+        self.statements_db = Postgres.maintenance_db
+        # db name -> {relid: counters} of the previous poll
+        self.prevTableCounters = {}
+        self.prevIndexCounters = {}
         self.cacheHitRatio = 0
         self.numdatabase = 0
-        self.heapBlksRead = 0
-        self.heapBlksHit = 0
-        self.idxBlksHit = 0
-        self.idxBlksRead = 0
         self.documentsTypes = []
-        self.aggr_server_data = {'dbSize': 0, 'numDelete': 0, 'numUpdate': 0, 'numInsert': 0, 'numFetch': 0,
-                                 'numTransactions': 0, 'cacheHits': 0, 'numCreatedTempFiles': 0, 'tempFileSize': 0,
-                                 'indexSize': 0, 'cacheHitRatio': 0}
-        self.aggr_db_data = {'numLiveTuple': 0, 'numDeadTuple': 0, 'indexSize': 0, 'cacheHitRatio': 0,
-                             'indexHitRatio': 0}
+        self.aggr_server_data = self.new_server_aggr()
+        self.aggr_server_data['cacheHitRatio'] = 0
+        self.workers = None
+        self.num_workers = Postgres.workers
+        self.poll_deadline = None
+        # databases whose collection is still running on the worker pool
+        self.inflight = set()
 
     def read_config(self, cfg):
         for children in cfg.children:
@@ -59,65 +212,58 @@ class PostgresStats:
                 self.port = children.values[0]
             if children.key == DOCUMENTSTYPES:
                 self.documentsTypes = children.values[0]
-
-    # Trying to connect to the postgres server
+            if children.key == "max_connections":
+                self.max_connections = int(children.values[0])
+            if children.key == "statement_timeout":
+                self.statement_timeout = int(children.values[0])
+            if children.key == "connect_timeout":
+                self.connect_timeout = int(children.values[0])
+            if children.key == "retry_interval":
+                self.retry_interval = int(children.values[0])
+            if children.key == "workers":
+                self.num_workers = int(children.values[0])
+            if children.key == "poll_deadline":
+                self.poll_deadline = float(children.values[0])
+            if children.key == "top_statements":
+                self.top_statements = int(children.values[0])
+            if children.key == "statements_db":
+                self.statements_db = children.values[0]
+
+    # Checking out the server level connection from the pool
     def connect_postgres(self):
         try:
-            conn_str_org = Postgres.conn_str % (self.host, self.user, self.password, self.port, 'postgres')
-            retry_flag = True
-            retry_count = 0
-            while retry_flag and retry_count < 3:
-                try:
-                    self.conn = psycopg2.connect(conn_str_org)
-                    self.cur = self.conn.cursor()
-                    retry_flag = False
-                    collectd.info("Connection to Postgres is successfull in attempt %s" % retry_count)
-                except Exception as e:
-                    collectd.debug("Retry after 5 sec as connection to Postgres failed in attempt %s" % retry_count)
-                    retry_count += 1
-                    time.sleep(5)
+            if self.pool is None:
+                self.pool = PostgresConnectionPool(self.host, self.user, self.password, self.port,
+                                                   self.max_connections, self.statement_timeout,
+                                                   self.connect_timeout, self.retry_interval)
+            self.conn = self.pool.get_connection(Postgres.maintenance_db)
+            if self.conn is None:
+                self.cur = None
+                return False
+            self.cur = self.conn.cursor()
+            return True
         except Exception as e:
             collectd.error("Exception in the connect_postgres due to %s" % e)
-            return
+            return False
+
+    def release_postgres(self):
+        if self.conn is not None:
+            self.pool.release(Postgres.maintenance_db, self.conn)
+        self.conn = None
+        self.cur = None
 
     def connect_db(self, dbname):
-        try:
-            conn_str_db = Postgres.conn_str % (self.host, self.user, self.password, self.port, dbname)
-            conn = psycopg2.connect(conn_str_db)
-            collectd.info("Connection to %s database is successfull"% dbname)
-            cursor = conn.cursor()
-            conn_flag = True
-        except Exception as e:
-            collectd.error("Exception in the connect_db due to %s" % e)
-            conn_flag = False
-            cursor = None
-        return cursor, conn_flag
-
-    # Get the list of databases from the server
-    def get_inventory(self):
-        database_names = []
-        try:
-            self.cur.execute(Postgres.db_info_query)
-            db_list = self.cur.fetchall()
-            if db_list:
-                for database_name in db_list:
-                    database_names.append(database_name[0])
-            else:
-                collectd.info("No databases present")
-        except Exception as e:
-            collectd.error("Exception from the get_inventory due to %s in %s" %(e, traceback.format_exc()))
-        return database_names
+        conn = self.pool.get_connection(dbname)
+        if conn is None:
+            collectd.error("No connection available to the %s database" % dbname)
+            return None, False
+        return conn, True
 
     # To get the postgres server details
     def get_server_details(self):
         final_server_dict = {}
         server_dict = {}
         try:
-            # Getting Inventory details
-            num_databases = self.get_inventory()
-            server_dict["numDatabases"] = len(num_databases)
-            self.numdatabase = server_dict["numDatabases"]
-
             # Getting postgreSQL server version
             self.cur.execute(Postgres.server_version)
             ser_version = self.cur.fetchall()
@@ -236,267 +382,315 @@ class PostgresStats:
             collectd.error("Exception from the query_details due to %s in %s" %(e, traceback.format_exc()))
         return final_long_runn_dict
 
+    @staticmethod
+    def new_server_aggr():
+        return {'dbSize': 0, 'numDelete': 0, 'numUpdate': 0, 'numInsert': 0, 'numSelect': 0,
+                'numTransactions': 0, 'cacheHits': 0, 'numCreatedTempFiles': 0, 'tempFileSize': 0, 'indexSize': 0}
+
+    @staticmethod
+    def new_db_aggr():
+        return {'numLiveTuple': 0, 'numDeadTuple': 0, 'indexSize': 0, 'heapBlksRead': 0, 'heapBlksHit': 0,
+                'idxBlksRead': 0, 'idxBlksHit': 0}
+
+    def major_version(self):
+        return int(self.version.split('.')[0].split()[0])
+
+    # Get the TOP N statements from pg_stat_statements by execution time spent since the previous poll
+    def get_statement_details(self, final_statement_dict):
+        conn = None
+        try:
+            if self.statements_db == Postgres.maintenance_db:
+                cur = self.cur
+            else:
+                conn = self.pool.get_connection(self.statements_db)
+                if conn is None:
+                    collectd.error("No connection available to the %s database for pg_stat_statements"
+                                   % self.statements_db)
+                    return final_statement_dict
+                cur = conn.cursor()
+            if self.major_version() >= 13:
+                cur.execute(Postgres.statements_query % "total_exec_time")
+            else:
+                cur.execute(Postgres.statements_query % "total_time")
+            statements = cur.fetchall()
+            fields = [column[0] for column in cur.description][3:]
+            num_counters = len(Postgres.statement_counters)
+            previous_counters = self.prevStatements
+            current_counters = {}
+            # Bounded min-heap holding the top N statements by delta time seen so far
+            top_statements = []
+            for row in statements:
+                key = row[:3]
+                if key[2] is None:
+                    continue
+                counters = row[-num_counters:]
+                current_counters[key] = counters
+                prev = previous_counters.get(key)
+                # Skipping statements which are new, not executed or reset since the previous poll
+                if prev is None or counters[0] <= prev[0]:
+                    continue
+                entry = (counters[1] - prev[1], key, row, prev)
+                if len(top_statements) < self.top_statements:
+                    heapq.heappush(top_statements, entry)
+                elif entry[0] > top_statements[0][0]:
+                    heapq.heapreplace(top_statements, entry)
+            self.prevStatements = current_counters
+            if self.pollCounter <= 1 or not top_statements:
+                return final_statement_dict
+
+            # Normalising the query text only once per queryid, dropping the ones which are gone
+            live_ids = set(key[2] for key in current_counters)
+            for queryid in self.statementText.keys():
+                if queryid not in live_ids:
+                    del self.statementText[queryid]
+            missing_ids = list(set(entry[1][2] for entry in top_statements) - set(self.statementText))
+            if missing_ids:
+                cur.execute(Postgres.statements_text_query, (missing_ids,))
+                for queryid, query in cur.fetchall():
+                    if query:
+                        self.statementText[queryid] = " ".join(query.split())[:Postgres.statement_text_length]
+
+            for rank, (delta_time, key, row, prev) in enumerate(sorted(top_statements, reverse=True), 1):
+                statement_dict = dict(zip(fields, row[3:]))
+                self.diff_counters(statement_dict, Postgres.statement_counters, row[-num_counters:], prev)
+                statement_dict['totalTime'] = round(statement_dict['totalTime'], 2)
+                statement_dict['meanTime'] = round(statement_dict['totalTime'] / statement_dict['calls'], 2)
+                statement_dict['rank'] = rank
+                statement_dict['_queryId'] = key[2]
+                statement_dict['_queryText'] = self.statementText.get(key[2], "")
+                statement_dict['_documentType'] = "statementDetails"
+                final_statement_dict["statement_%s_%s_%s" % (key[2], key[1], key[0])] = statement_dict
+        except Exception as e:
+            collectd.error("Exception from the statement_details due to %s in %s" %(e, traceback.format_exc()))
+        finally:
+            if conn is not None:
+                self.pool.release(self.statements_db, conn)
+        return final_statement_dict
+
+    # Get transaction and size details of all the databases from a single server wide query
+    def get_database_stats(self):
+        db_names = []
+        db_stats = {}
+        try:
+            self.cur.execute(Postgres.db_stats_query)
+            db_rows = self.cur.fetchall()
+            fields = [column[0] for column in self.cur.description][1:]
+            num_counters = len(Postgres.db_counters)
+            current_counters = {}
+            for row in db_rows:
+                db_name = row[0]
+                db_names.append(db_name)
+                counters = row[-num_counters:]
+                current_counters[db_name] = counters
+                db_details_dict = dict(zip(fields, row[1:]))
+                if db_details_dict['dbSize'] is None:
+                    del db_details_dict['dbSize']
+                else:
+                    db_details_dict['dbSize'] = round(float(db_details_dict['dbSize']) / (1024 * 1024.0), 2)
+                    self.aggr_server_data['dbSize'] += db_details_dict['dbSize']
+                # Finding the difference of values between two polls
+                if self.pollCounter <= 1 or db_name not in self.prevDbCounters:
+                    continue
+                self.diff_counters(db_details_dict, Postgres.db_counters, counters, self.prevDbCounters[db_name])
+                db_details_dict["tempFileSize"] = round(db_details_dict["tempFileSize"] / (1024 * 1024.0), 2)
+                db_details_dict["transPerSec"] = db_details_dict["numTransactions"] / int(self.interval)
+                self.aggr_server_data["numTransactions"] += db_details_dict["numTransactions"]
+                self.aggr_server_data["cacheHits"] += db_details_dict["blocksHit"]
+                self.aggr_server_data["numInsert"] += db_details_dict["numInsert"]
+                self.aggr_server_data["numDelete"] += db_details_dict["numDelete"]
+                self.aggr_server_data["numSelect"] += db_details_dict["numFetch"]
+                self.aggr_server_data["numUpdate"] += db_details_dict["numUpdate"]
+                self.aggr_server_data["numCreatedTempFiles"] += db_details_dict["numTempFile"]
+                self.aggr_server_data["tempFileSize"] += db_details_dict["tempFileSize"]
+                db_details_dict['_documentType'] = 'databaseDetails'
+                db_details_dict['_dbName'] = db_name
+                db_stats[db_name] = db_details_dict
+            self.prevDbCounters = current_counters
+            if not db_names:
+                collectd.info("No databases present")
+        except Exception as e:
+            collectd.error("Exception from the get_database_stats due to %s in %s"%( e, traceback.format_exc()))
+        return db_names, db_stats
+
     # Get the postgres data
     def get_postgres_data(self, db_dict):
         try:
-            db_info = self.get_inventory()
-            # Getting details for all the databases present in the server
+            db_info, db_stats = self.get_database_stats()
+            self.numdatabase = len(db_info)
+            if "serverDetails" in db_dict:
+                db_dict["serverDetails"]["numDatabases"] = self.numdatabase
+            # Getting table and index details for all the databases present in the server
+            db_results, skipped = self.collect_databases(db_info)
+            self.numdatabase -= len(skipped)
             for db_name in db_info:
-                self.get_db_details(db_dict, db_name)
+                if db_name in db_stats:
+                    db_dict[db_name] = db_stats[db_name]
+                if db_name not in db_results:
+                    continue
+                db_details, db_aggr = db_results[db_name]
+                self.aggr_server_data["indexSize"] += db_aggr['indexSize']
+                self.aggr_server_data["indexSize"] = round(self.aggr_server_data["indexSize"], 2)
+                aggr_db_data = {'numLiveTuple': db_aggr['numLiveTuple'], 'numDeadTuple': db_aggr['numDeadTuple'],
+                                'indexSize': round(db_aggr['indexSize'], 2), 'cacheHitRatio': 0, 'indexHitRatio': 0}
+                if 'numTables' in db_aggr:
+                    aggr_db_data['numTables'] = db_aggr['numTables']
                 if self.pollCounter > 1:
                     # Calculating cache hit ratio
-                    sumOfHeap = self.heapBlksRead + self.heapBlksHit
+                    sumOfHeap = db_aggr['heapBlksRead'] + db_aggr['heapBlksHit']
                     if sumOfHeap == 0:
-                        self.aggr_db_data["cacheHitRatio"] = 0.0
-                        self.cacheHitRatio += self.aggr_db_data["cacheHitRatio"]
+                        aggr_db_data["cacheHitRatio"] = 0.0
                         self.numdatabase -= 1
                     else:
-                        self.aggr_db_data["cacheHitRatio"] = round((float(self.heapBlksHit) / sumOfHeap) * 100, 2)
-                        self.cacheHitRatio += self.aggr_db_data["cacheHitRatio"]
+                        aggr_db_data["cacheHitRatio"] = round((float(db_aggr['heapBlksHit']) / sumOfHeap) * 100, 2)
+                        self.cacheHitRatio += aggr_db_data["cacheHitRatio"]
                     # Calculating index hit ratio
-                    sumIndexHeap = self.idxBlksRead + self.idxBlksHit
+                    sumIndexHeap = db_aggr['idxBlksRead'] + db_aggr['idxBlksHit']
                     if sumIndexHeap == 0:
-                        self.aggr_db_data["indexHitRatio"] = 0.0
+                        aggr_db_data["indexHitRatio"] = 0.0
                     else:
-                        self.aggr_db_data["indexHitRatio"] = round((float(self.idxBlksHit) / sumIndexHeap) * 100, 2)
-                    self.heapBlksHit = 0
-                    self.heapBlksRead = 0
-                    self.idxBlksHit = 0
-                    self.idxBlksRead = 0
+                        aggr_db_data["indexHitRatio"] = round((float(db_aggr['idxBlksHit']) / sumIndexHeap) * 100, 2)
                 # Updating aggregate values to db details
-                for key, value in self.aggr_db_data.items():
-                    db_dict[db_name][key] = value
-                # Re-initialising aggregate values
-                self.aggr_db_data = {'numLiveTuple': 0, 'numDeadTuple': 0, 'indexSize': 0, 'cacheHitRatio': 0,
-                                             'indexHitRatio': 0}
-                continue
+                if db_name in db_dict:
+                    db_dict[db_name].update(aggr_db_data)
+                db_dict.update(db_details)
+            if "serverDetails" in db_dict:
+                db_dict["serverDetails"]["numDatabasesSkipped"] = len(skipped)
+                db_dict["serverDetails"]["numDatabasesUnreachable"] = self.pool.num_unreachable()
+                db_dict["serverDetails"].update(self.pool.breaker(Postgres.maintenance_db).get_metrics())
         except Exception as e:
             collectd.error("Exception from the get_postgres_data due to %s in %s"%( e, traceback.format_exc()))
         return db_dict
 
-    # Get all details per database
-    def get_db_details(self, final_db_dict, db_name):
+    # Collect the databases concurrently, waiting no longer than the poll deadline
+    def collect_databases(self, db_names):
+        if self.workers is None:
+            self.workers = ThreadPool(max(1, min(self.num_workers, self.max_connections - 1)))
+        if self.poll_deadline is not None:
+            deadline = time.time() + float(self.poll_deadline)
+        else:
+            deadline = time.time() + int(self.interval) * Postgres.deadline_factor
+        pending = {}
+        skipped = []
+        for db_name in db_names:
+            # A database still being collected by an earlier poll is not queued twice
+            if db_name in self.inflight:
+                skipped.append(db_name)
+                continue
+            self.inflight.add(db_name)
+            pending[db_name] = self.workers.apply_async(self.get_db_details, (db_name,))
+        db_results = {}
+        for db_name, async_result in pending.items():
+            try:
+                result = async_result.get(max(deadline - time.time(), 0))
+            except multiprocessing.TimeoutError:
+                skipped.append(db_name)
+                continue
+            if result:
+                db_results[db_name] = result
+        if skipped:
+            collectd.error("Plugin Postgres: Skipped databases %s as their collection did not finish before the poll deadline"
+                           % ", ".join(skipped))
+        return db_results, skipped
+
+    # Get table and index details per database, runs on the worker pool
+    def get_db_details(self, db_name):
         try:
             # Getting specific db conn
-            cur, connection_flag = self.connect_db(db_name)
+            conn, connection_flag = self.connect_db(db_name)
             if connection_flag is True:
-                # Collecting all the details for the provided database
-                db_trans_query_org = Postgres.db_trans_query % db_name
-                self.cur.execute(db_trans_query_org)
-                db_trans_details = self.cur.fetchall()
-                if db_trans_details:
-                    fields = map(lambda x: x[0], self.cur.description)
-                    db_details_list = [dict(zip(fields, row)) for row in db_trans_details]
-                    db_details_dict = db_details_list[0]
-                    if db_details_dict["tempFileSize"]:
-                        db_details_dict["tempFileSize"] = round(db_details_dict["tempFileSize"] / (1024 * 1024.0), 2)
-                    final_db_dict[db_name] = db_details_dict
-                else:
-                    collectd.debug("Unable to fetch db details of db %s"% db_name)
-                db_size_query_org = Postgres.db_size_query % db_name
-                self.cur.execute(db_size_query_org)
-                db_size_details = self.cur.fetchall()
-                if db_size_details:
-                    final_db_dict[db_name]['dbSize'] = round(float(db_size_details[0][0]) / (1024 * 1024.0), 2)
-                    self.aggr_server_data['dbSize'] += final_db_dict[db_name]['dbSize']
-                else:
-                    collectd.debug("Unable to fetch db size of db %s"% db_name)
-
-                # Using specific db conn to get the count of tables instead of global conn
-                cur.execute(Postgres.db_num_tables_query)
-                num_tables = cur.fetchall()
-                if num_tables:
-                    final_db_dict[db_name]['numTables'] = num_tables[0][0]
-                else:
-                    collectd.debug("Unable to fetch number of tables in the db %s"% db_name)
-
-                # Checking whether there are any details in the final dict
-                if final_db_dict[db_name]:
-                    final_db_dict[db_name]['_documentType'] = 'databaseDetails'
-                    final_db_dict[db_name]['_dbName'] = db_name
-                    # Finding the difference of values between two polls
-                    if self.pollCounter > 1:
-                        try:
-                            final_dict_copy = deepcopy(final_db_dict[db_name])
-                            previousPoll = self.pollDiff
-                            final_db_dict[db_name]["numTransactions"] -= previousPoll[db_name]["numTransactions"]
-                            final_db_dict[db_name]["transPerSec"] = final_db_dict[db_name]["numTransactions"] / int(self.interval)
-
-                            self.aggr_server_data["numTransactions"] += final_db_dict[db_name]["numTransactions"]
-
-                            final_db_dict[db_name]["blocksRead"] -= previousPoll[db_name]["blocksRead"]
-
-                            final_db_dict[db_name]["blocksHit"] -= previousPoll[db_name]["blocksHit"]
-                            self.aggr_server_data["cacheHits"] += final_db_dict[db_name]["blocksHit"]
-
-                            final_db_dict[db_name]["numReturn"] -= previousPoll[db_name]["numReturn"]
-
-                            final_db_dict[db_name]["numInsert"] -= previousPoll[db_name]["numInsert"]
-                            self.aggr_server_data["numInsert"] += final_db_dict[db_name]["numInsert"]
-
-                            final_db_dict[db_name]["numDelete"] -= previousPoll[db_name]["numDelete"]
-                            self.aggr_server_data["numDelete"] += final_db_dict[db_name]["numDelete"]
-
-                            final_db_dict[db_name]["numFetch"] -= previousPoll[db_name]["numFetch"]
-                            self.aggr_server_data["numSelect"] += final_db_dict[db_name]["numFetch"]
-
-                            final_db_dict[db_name]["numUpdate"] -= previousPoll[db_name]["numUpdate"]
-                            self.aggr_server_data["numUpdate"] += final_db_dict[db_name]["numUpdate"]
-
-                            final_db_dict[db_name]["numTempFile"] -= previousPoll[db_name]["numTempFile"]
-                            self.aggr_server_data["numCreatedTempFiles"] += final_db_dict[db_name]["numTempFile"]
+                final_db_dict = {}
+                db_aggr = self.new_db_aggr()
+                try:
+                    self.collect_db_details(final_db_dict, db_name, conn.cursor(), db_aggr)
+                finally:
+                    self.pool.release(db_name, conn)
+                return final_db_dict, db_aggr
+            else:
+                collectd.error("Connection to this database %s is not successful to get table details" % db_name)
+        except Exception as e:
+            collectd.error("Exception from the db_details due to %s in %s"% (e, traceback.format_exc()))
+        finally:
+            self.inflight.discard(db_name)
 
-                            final_db_dict[db_name]["tempFileSize"] -= previousPoll[db_name]["tempFileSize"]
-                            self.aggr_server_data["tempFileSize"] += final_db_dict[db_name]["tempFileSize"]
+    def collect_db_details(self, final_db_dict, db_name, cur, db_aggr):
+        try:
+            # Using specific db conn to get the count of tables
+            cur.execute(Postgres.db_num_tables_query)
+            num_tables = cur.fetchall()
+            if num_tables:
+                db_aggr['numTables'] = num_tables[0][0]
+            else:
+                collectd.debug("Unable to fetch number of tables in the db %s"% db_name)
 
-                            final_db_dict[db_name]["blkReadTime"] -= previousPoll[db_name]["blkReadTime"]
-                            final_db_dict[db_name]["blkWriteTime"] -= previousPoll[db_name]["blkWriteTime"]
-                            self.pollDiff[db_name] = final_dict_copy
-                        except Exception as e:
-                            collectd.error("Exception from the db_details due to %s in %s"% (e, traceback.format_exc()))
-                            self.pollDiff[db_name] = final_db_dict[db_name]
-                            final_db_dict[db_name] = {}
-                else:
-                    collectd.info("Couldn't get any details for the given db %s"% db_name)
-                # To get table details for the given database
-                if final_db_dict[db_name]:
-                    if final_db_dict[db_name]['numTables'] != 0:
-                        self.get_table_details(final_db_dict, db_name, cur)
-                    else:
-                        collectd.info("No tables found in the db %s from the db_details"% db_name)
+            # To get table details for the given database
+            if db_aggr.get('numTables'):
+                self.get_table_details(final_db_dict, db_name, cur, db_aggr)
             else:
-                collectd.error("Connection to this database %s is not successful to get table details" % db_name)
+                collectd.info("No tables found in the db %s from the db_details"% db_name)
         except Exception as e:
             collectd.error("Exception from the db_details due to %s in %s"% (e, traceback.format_exc()))
             return
 
-    def get_table_details(self, final_dict, db_name, cursor):
+    @staticmethod
+    def diff_counters(doc, counter_names, current, previous):
+        """Replaces the cumulative counters in doc by their change since the previous poll."""
+        for name, curr_value, prev_value in zip(counter_names, current, previous):
+            doc[name] = curr_value - prev_value
+
+    def get_table_details(self, final_dict, db_name, cursor, db_aggr):
         try:
-            # Get the table details per database
+            # Get the table details per database, stat and statio already joined on relid
             cursor.execute(Postgres.table_query)
             table_info = cursor.fetchall()
-            fields = map(lambda x: x[0], cursor.description)
-            if table_info:
-                table_details_list = [dict(zip(fields, row)) for row in table_info]
-                for table_dict in table_details_list:
-                    if table_dict['tableSize']:
-                        table_dict['tableSize'] = round(table_dict['tableSize'] / (1024 * 1024.0), 2)
-                    if table_dict['indexSize']:
-                        table_dict['indexSize'] = round(table_dict['indexSize'] / (1024 * 1024.0), 2)
-                        self.aggr_server_data["indexSize"] += table_dict['indexSize']
-                        self.aggr_server_data["indexSize"] = round(self.aggr_server_data["indexSize"], 2)
-                        self.aggr_db_data["indexSize"] += table_dict['indexSize']
-                        self.aggr_db_data["indexSize"] = round(self.aggr_db_data["indexSize"], 2)
-                    if not table_dict['idxBlksRead']:
-                        table_dict['idxBlksRead'] = 0
-                    if not table_dict['idxBlksHit']:
-                        table_dict['idxBlksHit'] = 0
-                    table_dict['_documentType'] = "tableDetails"
-                    table_dict['_dbName'] = db_name
-                    final_dict[table_dict["_tableName"] + db_name] = table_dict
-
-                # Executing static input/output query for the given table
-                cursor.execute(Postgres.stat_table_query)
-                stat_table_info = cursor.fetchall()
-                if stat_table_info:
-                    for tableRow in stat_table_info:
-                        for table_dict in final_dict:
-                            if table_dict == tableRow[0] + db_name:
-                                final_dict[table_dict]["seqScan"] = tableRow[1]
-                                final_dict[table_dict]["seqScanFetch"] = tableRow[2]
-
-                                if not tableRow[3]:
-                                    final_dict[table_dict]["indexScan"] = 0
-                                else:
-                                    final_dict[table_dict]["indexScan"] = tableRow[3]
-
-                                if not tableRow[4]:
-                                    final_dict[table_dict]["indexScanFetch"] = 0
-                                else:
-                                    final_dict[table_dict]["indexScanFetch"] = tableRow[4]
-
-                                final_dict[table_dict]["numInsert"] = tableRow[5]
-                                final_dict[table_dict]["numDelete"] = tableRow[6]
-                                final_dict[table_dict]["numUpdate"] = tableRow[7]
-                                final_dict[table_dict]["numLiveTuple"] = tableRow[8]
-                                self.aggr_db_data["numLiveTuple"] += final_dict[table_dict]["numLiveTuple"]
-                                final_dict[table_dict]["numDeadTuple"] = tableRow[9]
-                                self.aggr_db_data["numDeadTuple"] += final_dict[table_dict]["numDeadTuple"]
+            if not table_info:
+                collectd.info("No table details found in the database %s"% db_name)
+                return
+            fields = [column[0] for column in cursor.description][1:]
+            num_counters = len(Postgres.table_counters)
+            previous_counters = self.prevTableCounters.get(db_name, {})
+            current_counters = {}
+            for row in table_info:
+                relid = row[0]
+                counters = row[-num_counters:]
+                current_counters[relid] = counters
+                table_dict = dict(zip(fields, row[1:]))
+                if table_dict['tableSize']:
+                    table_dict['tableSize'] = round(table_dict['tableSize'] / (1024 * 1024.0), 2)
+                if table_dict['indexSize']:
+                    table_dict['indexSize'] = round(table_dict['indexSize'] / (1024 * 1024.0), 2)
+                    db_aggr["indexSize"] += table_dict['indexSize']
+                db_aggr["numLiveTuple"] += table_dict["numLiveTuple"]
+                db_aggr["numDeadTuple"] += table_dict["numDeadTuple"]
+
+                # Finding the difference of values between two polls, tables created
+                # since the previous poll are reported from the next one onwards
+                if self.pollCounter <= 1 or relid not in previous_counters:
+                    continue
+                self.diff_counters(table_dict, Postgres.table_counters, counters, previous_counters[relid])
+                db_aggr["heapBlksRead"] += table_dict["heapBlksRead"]
+                db_aggr["heapBlksHit"] += table_dict["heapBlksHit"]
+                db_aggr["idxBlksRead"] += table_dict["idxBlksRead"]
+                db_aggr["idxBlksHit"] += table_dict["idxBlksHit"]
+
+                sumHit = table_dict["heapBlksRead"] + table_dict["heapBlksHit"]
+                if sumHit == 0:
+                    table_dict["cacheHitRatio"] = 0.0
                 else:
-                    collectd.info("No static table details found in the database %s"% db_name)
-                # Finding the difference of values between two polls
-                if table_info and stat_table_info:
-                    if self.pollCounter > 1:
-                        try:
-                            previousPoll = self.pollDiff
-                            for table_dict in table_details_list:
-                                final_dict_table_copy = deepcopy(final_dict[table_dict["_tableName"] + db_name])
-                                final_dict[table_dict["_tableName"] + db_name]["heapBlksRead"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["heapBlksRead"]
-                                self.heapBlksRead += final_dict[table_dict["_tableName"] + db_name]["heapBlksRead"]
-
-                                final_dict[table_dict["_tableName"] + db_name]["heapBlksHit"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["heapBlksHit"]
-                                self.heapBlksHit += final_dict[table_dict["_tableName"] + db_name]["heapBlksHit"]
-
-                                sumHit = final_dict[table_dict["_tableName"] + db_name]["heapBlksRead"] + \
-                                         final_dict[table_dict["_tableName"] + db_name]["heapBlksHit"]
-                                if sumHit == 0:
-                                    final_dict[table_dict["_tableName"] + db_name]["cacheHitRatio"] = 0.0
-                                else:
-                                    final_dict[table_dict["_tableName"] + db_name]["cacheHitRatio"] = \
-                                    round((float(final_dict[table_dict["_tableName"] + db_name]["heapBlksHit"]) / sumHit) * 100, 2)
-
-                                final_dict[table_dict["_tableName"] + db_name]["idxBlksRead"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["idxBlksRead"]
-                                self.idxBlksRead += final_dict[table_dict["_tableName"] + db_name]["idxBlksRead"]
-
-                                final_dict[table_dict["_tableName"] + db_name]["idxBlksHit"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["idxBlksHit"]
-                                self.idxBlksHit += final_dict[table_dict["_tableName"] + db_name]["idxBlksHit"]
-
-                                idxSumHit = final_dict[table_dict["_tableName"] + db_name]["idxBlksRead"] + \
-                                            final_dict[table_dict["_tableName"] + db_name]["idxBlksHit"]
-
-                                if idxSumHit == 0:
-                                    final_dict[table_dict["_tableName"] + db_name]["indexHitRatio"] = 0.0
-                                else:
-                                    final_dict[table_dict["_tableName"] + db_name]["indexHitRatio"] = \
-                                    round((float(final_dict[table_dict["_tableName"] + db_name]["idxBlksHit"]) / idxSumHit) * 100, 2)
-
-                                final_dict[table_dict["_tableName"] + db_name]["numInsert"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["numInsert"]
-
-                                final_dict[table_dict["_tableName"] + db_name]["numDelete"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["numDelete"]
-
-                                final_dict[table_dict["_tableName"] + db_name]["numUpdate"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["numUpdate"]
-
-                                final_dict[table_dict["_tableName"] + db_name]["seqScan"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["seqScan"]
-
-                                final_dict[table_dict["_tableName"] + db_name]["seqScanFetch"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["seqScanFetch"]
-
-                                final_dict[table_dict["_tableName"] + db_name]["indexScanFetch"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["indexScanFetch"]
-
-                                final_dict[table_dict["_tableName"] + db_name]["indexScan"] -= \
-                                previousPoll[table_dict["_tableName"] + db_name]["indexScan"]
-
-                                self.pollDiff[table_dict["_tableName"] + db_name] = final_dict_table_copy
-                        except:
-                            for table_dict in table_details_list:
-                                self.pollDiff[table_dict["_tableName"] + db_name] = final_dict[table_dict["_tableName"] + db_name]
-                                final_dict[table_dict["_tableName"] + db_name] = {}
+                    table_dict["cacheHitRatio"] = round((float(table_dict["heapBlksHit"]) / sumHit) * 100, 2)
+
+                idxSumHit = table_dict["idxBlksRead"] + table_dict["idxBlksHit"]
+                if idxSumHit == 0:
+                    table_dict["indexHitRatio"] = 0.0
                 else:
-                    collectd.error("Couldn't find table diffference details for the db %s"% db_name)
+                    table_dict["indexHitRatio"] = round((float(table_dict["idxBlksHit"]) / idxSumHit) * 100, 2)
 
-                # To collect the index_details for the given table
-                self.get_index_details(final_dict, db_name, cursor)
-            else:
-                collectd.info("No table details found in the database %s"% db_name)
+                table_dict['_documentType'] = "tableDetails"
+                table_dict['_dbName'] = db_name
+                final_dict[table_dict["_tableName"] + db_name] = table_dict
+            self.prevTableCounters[db_name] = current_counters
+
+            # To collect the index_details for the given table
+            self.get_index_details(final_dict, db_name, cursor)
         except Exception as e:
             collectd.error("Exception from the get_table_details due to %s in %s" %( e, traceback.format_exc()))
             return
@@ -506,55 +700,26 @@ class PostgresStats:
         try:
             cur.execute(Postgres.index_query)
             index_query_info = cur.fetchall()
-            fields = map(lambda x: x[0], cur.description)
-            if index_query_info:
-                index_details_list = [dict(zip(fields, row)) for row in index_query_info]
-                for index_dict in index_details_list:
-                    index_dict['_documentType'] = "indexDetails"
-                    index_dict['_dbName'] = db_name
-                    final_db_dict[index_dict["_indexName"] + db_name] = index_dict
-                # Executing statio input/output query for the given table
-                cur.execute(Postgres.stat_index_query)
-                stat_index_query_info = cur.fetchall()
-                if stat_index_query_info:
-                    for stat_index in stat_index_query_info:
-                        for index_dict in final_db_dict:
-                            if index_dict == stat_index[2] + db_name:
-                                final_db_dict[index_dict]["blksRead"] = stat_index[3]
-                                final_db_dict[index_dict]["blksHit"] = stat_index[4]
-                else:
-                    collectd.debug("Couldn't get any statio index details for the given db %s"% db_name)
-                # Finding the difference of values between two polls
-                if index_query_info and stat_index_query_info:
-                    if self.pollCounter > 1:
-                        try:
-                            previousPoll = self.pollDiff
-                            for index_dict in index_details_list:
-                                final_dict_index_copy = deepcopy(final_db_dict[index_dict["_indexName"] + db_name])
-                                final_db_dict[index_dict["_indexName"] + db_name]["numReturn"] -= \
-                                previousPoll[index_dict["_indexName"] + db_name]["numReturn"]
-
-                                final_db_dict[index_dict["_indexName"] + db_name]["indexScan"] -= \
-                                previousPoll[index_dict["_indexName"] + db_name]["indexScan"]
-
-                                final_db_dict[index_dict["_indexName"] + db_name]["numFetch"] -= \
-                                previousPoll[index_dict["_indexName"] + db_name]["numFetch"]
-
-                                final_db_dict[index_dict["_indexName"] + db_name]["blksHit"] -= \
-                                previousPoll[index_dict["_indexName"] + db_name]["blksHit"]
-
-                                final_db_dict[index_dict["_indexName"] + db_name]["blksRead"] -= \
-                                previousPoll[index_dict["_indexName"] + db_name]["blksRead"]
-
-                                self.pollDiff[index_dict["_indexName"] + db_name] = final_dict_index_copy
-                        except:
-                            for index_dict in index_details_list:
-                                self.pollDiff[index_dict["_indexName"] + db_name] = final_db_dict[index_dict["_indexName"] + db_name]
-                                final_db_dict[index_dict["_indexName"] + db_name] = {}
-                else:
-                    collectd.debug("Couldn't get index difference details and statio details for the given db %s"% db_name)
-            else:
+            if not index_query_info:
                 collectd.debug("Couldn't get any index details for the given db %s"% db_name)
+                return
+            fields = [column[0] for column in cur.description][1:]
+            num_counters = len(Postgres.index_counters)
+            previous_counters = self.prevIndexCounters.get(db_name, {})
+            current_counters = {}
+            for row in index_query_info:
+                indexrelid = row[0]
+                counters = row[-num_counters:]
+                current_counters[indexrelid] = counters
+                # Finding the difference of values between two polls
+                if self.pollCounter <= 1 or indexrelid not in previous_counters:
+                    continue
+                index_dict = dict(zip(fields, row[1:]))
+                self.diff_counters(index_dict, Postgres.index_counters, counters, previous_counters[indexrelid])
+                index_dict['_documentType'] = "indexDetails"
+                index_dict['_dbName'] = db_name
+                final_db_dict[index_dict["_indexName"] + db_name] = index_dict
+            self.prevIndexCounters[db_name] = current_counters
         except Exception as e:
             collectd.error("Exception from the index_details due to %s in %s"%( e, traceback.format_exc()))
             return
@@ -563,6 +728,8 @@ class PostgresStats:
     def collect_data(self):
         server_details = self.get_server_details()
         query_details = self.get_query_details(server_details)
+        if "statementDetails" in self.documentsTypes:
+            self.get_statement_details(query_details)
         db_details = self.get_postgres_data(query_details)
 
         #Calculating cacheHitRatio in server level
@@ -576,9 +743,8 @@ class PostgresStats:
         for key, value in self.aggr_server_data.items():
             db_details["serverDetails"][key] = value
         # Re-initialising aggregate values
-        self.aggr_server_data = {'dbSize': 0, 'numDelete': 0, 'numUpdate': 0, 'numInsert': 0, 'numSelect': 0, \
-                                 'numTransactions': 0, 'cacheHits': 0, 'numCreatedTempFiles': 0, 'indexSize': 0,
-                                 'tempFileSize': 0, 'cacheHitRatio': 0}
+        self.aggr_server_data = self.new_server_aggr()
+        self.aggr_server_data['cacheHitRatio'] = 0
         self.cacheHitRatio = 0
         self.numdatabase = 0
 
@@ -600,23 +766,26 @@ class PostgresStats:
             details[TIMESTAMP] = timestamp
             details[PLUGIN] = Postgres.POSTGRES
             details[ACTUALPLUGINTYPE] = Postgres.POSTGRES
-            #Grouping all long running queries into single dir "queryDetails" in /data/postgres
-            if details["_documentType"] == "queryDetails":
-                details[PLUGIN_INS] = "queryDetails"
+            #Grouping all long running queries and top statements into single dirs in /data/postgres
+            if details["_documentType"] in ("queryDetails", "statementDetails"):
+                details[PLUGIN_INS] = details["_documentType"]
             else:
                 details[PLUGIN_INS] = details_type
 
     def read(self):
         try:
             self.pollCounter += 1
-            self.connect_postgres()
+            if not self.connect_postgres():
+                collectd.error("Plugin Postgres: No connection to the Postgres server, skipping this poll.")
+                self.dispatch_connection_state()
+                return
             # collect data
-            dict_postgres = self.collect_data()
+            try:
+                dict_postgres = self.collect_data()
+            finally:
+                self.release_postgres()
             #collectd.info(dict_postgres)
-            if dict_postgres:
-                if self.pollCounter == 1:
-                    self.pollDiff = deepcopy(dict_postgres)
-            else:
+            if not dict_postgres:
                 collectd.error("Plugin Postgres: Unable to fetch data for Postgres.")
                 return
 
@@ -632,6 +801,16 @@ class PostgresStats:
             collectd.error("Couldn't read and gather the postgres metrics due to the exception :%s" % e)
             return
 
+    # Report the breaker state while the server can not be reached
+    def dispatch_connection_state(self):
+        if self.pool is None or "serverDetails" not in self.documentsTypes:
+            return
+        server_dict = {"_documentType": "serverDetails", "numDatabasesUnreachable": self.pool.num_unreachable()}
+        server_dict.update(self.pool.breaker(Postgres.maintenance_db).get_metrics())
+        final_server_dict = {"serverDetails": server_dict}
+        self.add_common_params(final_server_dict)
+        self.dispatch_data(final_server_dict)
+
     @staticmethod
     def dispatch_data(dict_disks_copy):
         for details_type, details in dict_disks_copy.items():
@@ -647,6 +826,12 @@ class PostgresStats:
         collectd.unregister_read(self.read_temp)
         collectd.register_read(self.read, interval=int(self.interval))
 
+    def shutdown(self):
+        if self.workers is not None:
+            self.workers.terminate()
+        if self.pool is not None:
+            self.pool.close_all()
+
 def init():
     signal.signal(signal.SIGCHLD, signal.SIG_DFL)
 
@@ -654,3 +839,4 @@ def init():
 obj = PostgresStats()
 collectd.register_config(obj.read_config)
 collectd.register_read(obj.read_temp)
+collectd.register_shutdown(obj.shutdown)
@@ -11,11 +11,11 @@
 import signal
 import json
 import time
-import psutil
 import collectd
 
 # user imports
 import utils
+import libprocfs
 from constants import *
 
 
@@ -37,19 +37,19 @@ class RamUtil(object):
         """
         Returns dictionary with values of available and ram utilization information.
         """
-        mem = psutil.virtual_memory()
-        swp = psutil.swap_memory()
+        mem = libprocfs.get_virtual_memory()
+        swp = libprocfs.get_swap_memory()
         dict_ram_util = {'available': round(
-            float(mem.available) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR), 'RAMUtil': mem.percent,
-            'totalRAM': round(float(mem.total) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR), 
-            'free': round(float(mem.free) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
-            'cached':round(float(mem.cached) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
-            'buffered':round(float(mem.buffers) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
-            'used': round(float(mem.used) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
-            'swap_totalRAM': round(float(swp.total) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
-            'swap_used': round(float(swp.used) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
-            'swap_free': round(float(mem.free) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
-            'swap_RAMUtil': swp.percent
+            float(mem["available"]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR), 'RAMUtil': mem["percent"],
+            'totalRAM': round(float(mem["total"]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR), 
+            'free': round(float(mem["free"]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
+            'cached':round(float(mem["cached"]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
+            'buffered':round(float(mem["buffers"]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
+            'used': round(float(mem["used"]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
+            'swap_totalRAM': round(float(swp["total"]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
+            'swap_used': round(float(swp["used"]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
+            'swap_free': round(float(swp["free"]) / (FACTOR * FACTOR * FACTOR), FLOATING_FACTOR),
+            'swap_RAMUtil': swp["percent"]
         }
         return dict_ram_util
 
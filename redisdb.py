@@ -13,7 +13,8 @@ import time
 import json
 import redis as red
 import traceback
-import subprocess
+from threading import Thread, Lock
+from multiprocessing.pool import ThreadPool
 
 # user imports
 from constants import *
@@ -21,6 +22,81 @@ from utils import *
 from copy import deepcopy
 
 
+class LatencySampler(Thread):
+    """ Thread sampling scheduling latency into a histogram between polls """
+
+    def __init__(self, redis_stats):
+        Thread.__init__(self)
+        self.daemon = True
+        self.killed = False
+        self.redis_stats = redis_stats
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.buckets = [0] * REDIS_LATENCY_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.server_latency = 0
+
+    def run(self):
+        """ Main thread entrypoint """
+        next_server_sample = 0
+        while not self.killed:
+            start = time.time()
+            time.sleep(REDIS_LATENCY_TICK)
+            self.record(int((time.time() - start - REDIS_LATENCY_TICK) * 1000000))
+            if self.redis_stats.latency_monitor and start >= next_server_sample:
+                next_server_sample = start + REDIS_LATENCY_SERVER_INTERVAL
+                self.sample_server()
+
+    def record(self, latency):
+        """ Add one wake up delay in microseconds to the histogram """
+        latency = max(latency, 0)
+        with self.lock:
+            self.buckets[min(latency.bit_length(), REDIS_LATENCY_BUCKETS - 1)] += 1
+            self.count += 1
+            self.total += latency
+            self.max = max(self.max, latency)
+
+    def sample_server(self):
+        """ Keep the worst latest spike reported by the instances' latency monitor """
+        for instance in self.redis_stats.instances.values():
+            client = instance.redis_client
+            if client is None:
+                continue
+            try:
+                latest = max([int(event[2]) for event in client.execute_command("LATENCY", "LATEST")] or [0])
+            except Exception as e:
+                collectd.debug("Unable to sample LATENCY LATEST due to %s" % str(e))
+                continue
+            with self.lock:
+                self.server_latency = max(self.server_latency, latest)
+
+    def snapshot(self):
+        """ Return the summary of the samples taken since the previous snapshot """
+        with self.lock:
+            buckets, count, total, max_latency, server_latency = self.buckets, self.count, self.total, self.max, \
+                                                                 self.server_latency
+            self.reset()
+        latency_dict = {"latency": round(float(total) / count, 2) if count else 0, "latencyMax": max_latency,
+                        "latencyP50": 0, "latencyP99": 0}
+        if self.redis_stats.latency_monitor:
+            latency_dict["serverLatencyMs"] = server_latency
+        seen = 0
+        for index, bucket in enumerate(buckets):
+            seen += bucket
+            # Upper bound of the bucket, capped at the largest sample seen
+            bound = min((1 << index) - 1, max_latency)
+            if not latency_dict["latencyP50"] and seen * 2 >= count:
+                latency_dict["latencyP50"] = bound
+            if seen * 100 >= count * 99:
+                latency_dict["latencyP99"] = bound
+                break
+        return latency_dict
+
+
 class RedisStats:
     def __init__(self):
         self.interval = DEFAULT_INTERVAL
@@ -32,6 +108,16 @@ class RedisStats:
         self.pollCounter = 0
         self.documentsTypes = []
         self.previousData = {}
+        self.latency_monitor = False
+        self.latency_sampler = None
+        self.timeout = REDIS_TIMEOUT
+        self.addresses = []
+        self.cluster_seed = None
+        self.seed_instance = None
+        self.instances = {}
+        self.workers = None
+        self.num_workers = REDIS_WORKERS
+        self.breaker = CircuitBreaker("Redis server")
 
     def read_config(self, cfg):
         for children in cfg.children:
@@ -45,39 +131,95 @@ class RedisStats:
                 self.password = children.values[0]
             if children.key == DOCUMENTSTYPES:
                 self.documentsTypes = children.values[0]
+            if children.key == "latency_monitor":
+                self.latency_monitor = str(children.values[0]).lower() == "true"
+            if children.key == "timeout":
+                self.timeout = float(children.values[0])
+            if children.key == "workers":
+                self.num_workers = int(children.values[0])
+            if children.key == "instances":
+                # host:port pairs, either as separate values or in one space/comma separated string
+                for value in children.values:
+                    self.addresses.extend(self.parse_address(address) for address in
+                                          str(value).replace(",", " ").split())
+            if children.key == "cluster_seed":
+                self.cluster_seed = self.parse_address(children.values[0])
+
+    @staticmethod
+    def parse_address(address):
+        host, _, port = address.rpartition(":")
+        return host, port
+
+    def new_instance(self, host, port):
+        instance = RedisStats()
+        instance.host = host
+        instance.port = port
+        instance.user = self.user
+        instance.password = self.password
+        instance.interval = self.interval
+        instance.timeout = self.timeout
+        instance.breaker = CircuitBreaker("Redis %s:%s" % (host, port))
+        return instance
+
     def connect_redis(self):
-        try:
-            retry_flag = True
-            retry_count = 0
-            password_flag = False
-            while retry_flag and retry_count < 3:
-                try:
-                    if password_flag:
-                        self.redis_client = red.StrictRedis(host=self.host, port=self.port, password=self.password, db=0)
-                    else:
-                        self.redis_client = red.StrictRedis(host=self.host, port = self.port, db=0)
-                    server_details = self.redis_client.info(section="server")
-                    retry_flag = False
-                    collectd.info("Connection to Redis successfull in attempt %s" % (retry_count))
-                except Exception as e:
-                    collectd.error("Retry after 5 sec as connection to Redis failed in attempt %s" % (retry_count))
-                    retry_count += 1
-                    if (not password_flag) and retry_count == 3:
-                        retry_count = 0
-                        password_flag = True
-                    time.sleep(5)
-        except Exception as e:
-            collectd.error("Exception in the connect_redis due to %s" % e)
+        # The client and its connection pool are kept across polls
+        if self.redis_client is not None:
+            return
+        # An unreachable instance is retried with a backoff on later polls, never waited for
+        if not self.breaker.allow():
             return
+        # The password is only tried once the instance refused the connection without it
+        for password in [None] + ([self.password] if self.password else []):
+            try:
+                redis_client = red.StrictRedis(host=self.host, port=self.port, password=password, db=0,
+                                               socket_timeout=self.timeout, socket_connect_timeout=self.timeout)
+                redis_client.set_response_callback("INFO", self.parse_info)
+                redis_client.ping()
+                self.redis_client = redis_client
+                self.breaker.success()
+                collectd.info("Connection to Redis %s:%s successfull" % (self.host, self.port))
+                return
+            except Exception as e:
+                collectd.error("Connection to Redis %s:%s failed due to %s" % (self.host, self.port, e))
+        self.breaker.failure()
+
+    @staticmethod
+    def get_info_value(value):
+        # Same typing as redis-py: only values with a "." are floats, so "9e1" stays a string
+        try:
+            return float(value) if "." in value else int(value)
+        except ValueError:
+            return value
 
-    def get_redis_details(self):
+    @staticmethod
+    def parse_info(response, **options):
+        # Single pass over the INFO reply, giving one dict per "# Section" header
+        info = {}
+        section = info.setdefault("default", {})
+        for line in response.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#"):
+                section = info.setdefault(line[1:].strip().lower(), {})
+                continue
+            key, _, value = line.partition(":")
+            if "=" in value:
+                # keyspace, commandstats and replica lines hold comma separated key=value pairs
+                section[key] = dict((sub_key, RedisStats.get_info_value(sub_value)) for sub_key, _, sub_value in
+                                    (item.partition("=") for item in value.split(",")))
+            else:
+                section[key] = RedisStats.get_info_value(value)
+        return info
+
+    def get_redis_details(self, info):
         details_dict={}
         stats_dict={}
         persistence_dict = {}
         cpu_dict = {}
         final_redis_dict={}
         try:
-            server_details = self.redis_client.info(section="server")
+            server_details = info.get("server")
             if server_details:
                 details_dict["version"] = server_details.get("redis_version",None)
                 details_dict["buildId"] = server_details.get("redis_build_id",None)
@@ -86,13 +228,13 @@ class RedisStats:
                 details_dict["tcpPort"] = server_details.get("tcp_port")
                 details_dict["runId"] = server_details.get("run_id")
                 details_dict["upTime"] = server_details.get("uptime_in_seconds",None)
-            server_conn_details = self.redis_client.info("clients")
+            server_conn_details = info.get("clients")
             if server_conn_details:
                 stats_dict["clientLongestOutputList"] = server_conn_details.get("client_longest_output_list")
                 stats_dict["clientBiggestInputBuf"] = server_conn_details.get("client_biggest_input_buf")
                 stats_dict["blockedClients"] = server_conn_details.get("blocked_clients",0)
                 stats_dict["connectedClients"] = server_conn_details.get("connected_clients",0)
-            server_stats = self.redis_client.info(section="stats")
+            server_stats = info.get("stats")
             if server_stats:
                 input_bytes = None
                 try:
@@ -104,7 +246,7 @@ class RedisStats:
                     output_bytes = round(server_stats.get("total_net_output_bytes",0) / (1024.0 * 1024.0), 2)
                 except Exception as e:
                     collectd.error("Error in getting total input bytes due to %s" % str(e))
-                stats_dict["clusterEnabled"] = True if self.redis_client.info().get("cluster_enabled")== 1 else False
+                stats_dict["clusterEnabled"] = True if info.get("cluster", {}).get("cluster_enabled")== 1 else False
                 stats_dict["instantaneousInputKbps"] = server_stats.get("instantaneous_input_kbps",0.0)
                 stats_dict["instantaneousOutputKbps"] = server_stats.get("instantaneous_output_kbps",0.0)
                 if self.pollCounter <= 1:
@@ -166,7 +308,7 @@ class RedisStats:
                     self.previousData["expiredKeys"] = server_stats.get("expired_keys",0)
                     self.previousData["evictedKeys"] = server_stats.get("evicted_keys",0)
                     self.previousData["rejectedConn"] = server_stats.get("rejected_connections",0)
-                keyspace_details = self.redis_client.info("keyspace")
+                keyspace_details = info.get("keyspace")
                 if keyspace_details:
                     totalk = 0
                     dbcount = 0
@@ -177,15 +319,7 @@ class RedisStats:
                 else:
                     collectd.error("No Key details found")
                     stats_dict["totKeys"] = 0
-
-                outlis = subprocess.check_output(["redis-cli", "--intrinsic-latency", "1"]).split()
-                if len(outlis) > 0:
-                    try:
-                        stats_dict["latency"] = float(outlis[-16])
-                    except ValueError:
-                        collectd.error("No latency details found")
-                        stats_dict["latency"] = 0
-            memory_stats = self.redis_client.info(section="memory")
+            memory_stats = info.get("memory")
             if memory_stats:
                 stats_dict["usedMemoryPeak"] = round(memory_stats.get("used_memory_peak",0) / (1024.0 * 1024.0), 2)
                 stats_dict["totalSystemMemory"] = round(memory_stats.get("total_system_memory",0) / (1024.0 * 1024.0), 2)
@@ -196,7 +330,7 @@ class RedisStats:
             else:
                 collectd.error("No memory stats found")
                 pass
-            cpu_stats = self.redis_client.info(section="cpu")
+            cpu_stats = info.get("cpu")
             if cpu_stats:
                 if self.pollCounter <= 1:
                     self.previousData["usedCpuSys"] = cpu_stats.get("used_cpu_sys",0.0)
@@ -216,7 +350,7 @@ class RedisStats:
                     self.previousData["usedCpuUser"] = cpu_stats.get("used_cpu_user",0.0)
                     self.previousData["usedCpuUserChildren"] = cpu_stats.get("used_cpu_user_children",0.0)
                     self.previousData["usedCpuSysChildren"] = cpu_stats.get("used_cpu_sys_children",0.0)
-            persistence_stats = self.redis_client.info(section="persistence")
+            persistence_stats = info.get("persistence")
             if persistence_stats:
                 persistence_dict["aofEnabled"] = True if persistence_stats.get("aof_enabled") == 1 else False
                 persistence_dict["aofRewriteInProgress"] = True if persistence_stats.get("aof_rewrite_in_progress") == 1 else False
@@ -238,7 +372,7 @@ class RedisStats:
                 persistence_dict["loadingLoadedPerc"] = int(persistence_stats.get("loading_loaded_perc",0))
                 persistence_dict["loadingEtaSeconds"] = int(persistence_stats.get("loading_eta_seconds",0))
             persistence_dict[PLUGINTYPE] = "redisPersistence"
-            rep_stats = self.redis_client.info(section="replication")
+            rep_stats = info.get("replication")
             if rep_stats:
                 details_dict["role"] = rep_stats.get("role",None)
                 stats_dict["connectedSlaves"] = rep_stats.get("connected_slaves",0)
@@ -263,10 +397,10 @@ class RedisStats:
             collectd.error("Unable to fetch the details due to %s" % str(err))
             return final_redis_dict
 
-    def get_keyspace_details(self):
+    def get_keyspace_details(self, info):
             key_dict = []
             try:
-                key_stats = self.redis_client.info("keyspace")
+                key_stats = info.get("keyspace")
                 if key_stats:
                     for ky,val in key_stats.items():
                         final_redis_dict={}
@@ -294,35 +428,137 @@ class RedisStats:
             details[PLUGIN] = "redisdb"
             details[ACTUALPLUGINTYPE] = "redisdb"
             details[PLUGINTYPE] = details_type
+
     @staticmethod
     def dispatch_data(dict_disks_copy):
         collectd.debug(json.dumps(dict_disks_copy.keys()))
         for details_type, details in dict_disks_copy.items():
             dispatch(details)
-    def read(self):
+
+    @staticmethod
+    def parse_cluster_nodes(reply):
+        # Depending on the redis-py version CLUSTER NODES comes back either parsed or as raw text
+        if isinstance(reply, dict):
+            nodes = [(address, node.get("flags", "")) for address, node in reply.items()]
+        else:
+            nodes = [tuple(line.split()[1:3]) for line in reply.splitlines() if line.strip()]
+        addresses = []
+        for address, flags in nodes:
+            if not isinstance(flags, basestring):
+                flags = ",".join(flags)
+            if "fail" in flags or "noaddr" in flags or "handshake" in flags:
+                continue
+            # Redis 4+ appends the cluster bus port as ip:port@cport
+            addresses.append(RedisStats.parse_address(address.split("@")[0]))
+        return addresses
+
+    def get_cluster_nodes(self):
+        seed = self.instances.get(self.cluster_seed)
+        if seed is None:
+            # The seed may not be listed under the address it was configured with, its own
+            # instance is kept for its connection and breaker
+            if self.seed_instance is None:
+                self.seed_instance = self.new_instance(*self.cluster_seed)
+            seed = self.seed_instance
+        seed.connect_redis()
+        if seed.redis_client is None:
+            return []
+        try:
+            return self.parse_cluster_nodes(seed.redis_client.execute_command("CLUSTER NODES"))
+        except Exception as e:
+            collectd.error("Unable to discover Redis cluster nodes from %s:%s due to %s" % (
+                self.cluster_seed[0], self.cluster_seed[1], str(e)))
+            seed.redis_client = None
+            seed.breaker.failure()
+            return []
+
+    def discover_instances(self):
+        if self.cluster_seed is not None:
+            # Keep polling the known nodes when the seed can not be reached
+            addresses = self.get_cluster_nodes() or self.instances.keys() or [self.cluster_seed]
+        else:
+            addresses = self.addresses or [(self.host, self.port)]
+        # Instances are kept across polls for their connections and previous counters
+        self.instances = dict((address, self.instances.get(address) or self.new_instance(*address))
+                              for address in addresses)
+
+    def get_connection_state(self):
+        # Only the breaker state is reported while the instance can not be reached
+        dict_redis = {"redisStat": self.breaker.get_metrics()}
+        self.add_common_params(dict_redis)
+        dict_redis["redisStat"]["_nodeName"] = "%s:%s" % (self.host, self.port)
+        return dict_redis
+
+    def poll(self):
+        # Collecting the documents of one instance, runs on the worker pool
+        docs = []
         try:
             self.pollCounter += 1
             self.connect_redis()
+            if self.redis_client is None:
+                return [self.get_connection_state()]
+            # All sections come from one INFO round trip per poll
+            try:
+                info = self.redis_client.info("all")
+            except red.RedisError as e:
+                collectd.error("Unable to fetch INFO from Redis %s:%s due to %s" % (self.host, self.port, str(e)))
+                self.redis_client = None
+                return [self.get_connection_state()]
             # collect data
-            dict_redis = self.get_redis_details()
+            dict_redis = self.get_redis_details(info)
             if not dict_redis:
-                collectd.error("Plugin Redis: Unable to fetch data for Redis.")
-                return
-            else:
+                collectd.error("Plugin Redis: Unable to fetch data for Redis %s:%s." % (self.host, self.port))
+                return docs
+            if "redisStat" in dict_redis:
+                dict_redis["redisStat"].update(self.breaker.get_metrics())
+            docs = [dict_redis] + self.get_keyspace_details(info)
+            for doc in docs:
+                for details in doc.values():
+                    details["_nodeName"] = "%s:%s" % (self.host, self.port)
+        except Exception as e:
+            collectd.debug(traceback.format_exc())
+            collectd.error("Couldn't read and gather the Redis metrics of %s:%s due to the exception :%s" % (
+                self.host, self.port, e))
+        return docs
+
+    def read(self):
+        try:
+            self.discover_instances()
+            if self.workers is None:
+                self.workers = ThreadPool(self.num_workers)
+            latency = self.latency_sampler.snapshot() if self.latency_sampler is not None else {}
+            # The instances are polled concurrently, each bounded by its socket timeout
+            for docs in self.workers.map(lambda instance: instance.poll(), self.instances.values()):
+                if not docs:
+                    continue
+                dict_redis = docs[0]
+                if "redisStat" in dict_redis:
+                    dict_redis["redisStat"].update(latency)
                 # Deleteing documentsTypes which were not requetsed
                 for doc in dict_redis.keys():
                     if dict_redis[doc]['_documentType'] not in self.documentsTypes:
                         del dict_redis[doc]
-            self.dispatch_data(dict_redis)
-            for keyDetails in self.get_keyspace_details():
-                self.dispatch_data(keyDetails)
+                self.dispatch_data(dict_redis)
+                for keyDetails in docs[1:]:
+                    self.dispatch_data(keyDetails)
         except Exception as e:
             collectd.debug(traceback.format_exc())
             collectd.error("Couldn't read and gather the SQL metrics due to theexception :%s" % e)
             return
+
     def read_temp(self):
         collectd.unregister_read(self.read_temp)
         collectd.register_read(self.read, interval=int(self.interval))
+        if self.latency_sampler is None:
+            self.latency_sampler = LatencySampler(self)
+            self.latency_sampler.start()
+
+    def shutdown(self):
+        if self.latency_sampler is not None:
+            self.latency_sampler.killed = True
+            self.latency_sampler.join()
+        if self.workers is not None:
+            self.workers.terminate()
 
 
 def init():
@@ -331,3 +567,4 @@ def init():
 obj = RedisStats()
 collectd.register_config(obj.read_config)
 collectd.register_read(obj.read_temp)
+collectd.register_shutdown(obj.shutdown)
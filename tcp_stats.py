@@ -14,10 +14,14 @@ in one single document.
 import signal
 import json
 import time
+import socket
+import struct
 import collectd
 
 # user imports
 import utils
+import libprocfs
+import libsockdiag
 from constants import *
 
 
@@ -34,36 +38,28 @@ class TcpStats(object):
                              "writeTcpWinLow": 0, "writeTcpWinMedium": 0, "writeTcpWinHigh": 0,
                              "tcpRetrans": 0, "tcpReset": 0
                              }
+        self.prev_tcp_ext = None
+        self.sock_diag = False
 
     def read_config(self, cfg):
         """Initializes variables from conf files."""
         for children in cfg.children:
             if children.key == INTERVAL:
                 self.interval = children.values[0]
+            if children.key == "sock_diag":
+                self.sock_diag = str(children.values[0]).lower() == "true"
 
     def get_retransmit_and_reset(self):
         """
         Function to get tcp_reset and tcp_retrans values.
         """
-        retrans = resets_recv = resets_sent = 0
         try:
-            with open("/proc/net/snmp") as snmp_file:
-                snmp_output = snmp_file.readlines()
-        except IOError:
+            tcp_stat = libprocfs.get_snmp()["Tcp"]
+        except (IOError, OSError, KeyError):
             collectd.error("Plugin tcp_stats: Could not open file : /proc/net/snmp")
             return FAILURE, None
 
-        flag = 0
-        for i in range(0, len(snmp_output)):
-            if 'Tcp:' not in snmp_output[i]:
-                continue
-            if flag:
-                tcp_stat = snmp_output[i].split(" ")
-                resets_recv = tcp_stat[8]
-                retrans = tcp_stat[12]
-                resets_sent = tcp_stat[14]
-                return SUCCESS, [retrans, resets_sent, resets_recv]
-            flag += 1
+        return SUCCESS, [tcp_stat["RetransSegs"], tcp_stat["OutRsts"], tcp_stat["EstabResets"]]
 
     def get_tcp_buffersize(self):
         """Returns dictionary with values of tcpWin(low, medium and high),
@@ -71,16 +67,14 @@ class TcpStats(object):
         dict_tcp = {}
 
         try:
-            with open("/proc/sys/net/ipv4/tcp_wmem") as tcp_wmem_file:
-                wmem_lines = tcp_wmem_file.readline()
-        except IOError:
+            wmem_lines = libprocfs.read(PROC_TCP_WMEM)
+        except (IOError, OSError):
             collectd.error("Plugin tcp_stats: Could not open file : /proc/sys/net/ipv4/tcp_wmem")
             return None
 
         try:
-            with open("/proc/sys/net/ipv4/tcp_rmem") as tcp_rmem_file:
-                rmem_lines = tcp_rmem_file.readline()
-        except IOError:
+            rmem_lines = libprocfs.read(PROC_TCP_RMEM)
+        except (IOError, OSError):
             collectd.error("Plugin tcp_stats: Could not open file : /proc/sys/net/ipv4/tcp_rmem")
             return None
 
@@ -151,8 +145,33 @@ class TcpStats(object):
                 self.previousData["tcpRetrans"] = int(val_list[0])
                 self.previousData["tcpReset"] = tcp_resets
 
+        try:
+            tcp_ext = libprocfs.get_tcp_ext()
+        except (IOError, OSError):
+            collectd.error("Plugin tcp_stats: Could not open file : %s" % PROC_NET_NETSTAT)
+            tcp_ext = {}
+        if self.prev_tcp_ext is not None:
+            for key, value in tcp_ext.items():
+                if key in self.prev_tcp_ext:
+                    dict_tcp[key] = value - self.prev_tcp_ext[key]
+        self.prev_tcp_ext = tcp_ext
+
+        if self.sock_diag:
+            dict_tcp.update(self.get_socket_stats())
+
         return dict_tcp
 
+    def get_socket_stats(self):
+        """Returns the socket count of every TCP state and the rtt of the connections of the busiest
+        listening ports, from a NETLINK_SOCK_DIAG dump."""
+        try:
+            dict_sockets, port_list = libsockdiag.get_tcp_socket_stats()
+        except (socket.error, struct.error) as err:
+            collectd.error("Plugin tcp_stats: Unable to dump the TCP sockets due to %s" % err)
+            return {}
+        dict_sockets[TCP_LISTEN_PORTS] = json.dumps(port_list)
+        return dict_sockets
+
     def add_common_params(self, dict_tcp):
         """Adds TIMESTAMP, PLUGIN, PLUGIN_INS to dictionary."""
         timestamp = int(round(time.time()))
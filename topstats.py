@@ -4,21 +4,163 @@
 *
 ********************
 """
-"""Python plugin for collectd to get highest CPU/Memory usage process using top command"""
+"""Python plugin for collectd to get highest CPU/Memory usage process from /proc"""
 
 
 #!/usr/bin/python
+import os
+import pwd
 import signal
 import json
 import time
+import math
+import heapq
 import collectd
-import subprocess
 import re
+from array import array
+from threading import Thread, Lock
 
 # user imports
 import utils
+import libprocfs
 from constants import *
 
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_proc_file(path):
+    """Reads a small /proc file with a single read(), returns None if the process is gone."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return os.read(fd, PROC_READ_SIZE)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def iter_processes():
+    """Yields pid, name, start time, cpu ticks, vsize and rss bytes of every process."""
+    for pid in os.listdir(PROC):
+        if not pid.isdigit():
+            continue
+        data = read_proc_file(PROC + "/" + pid + "/stat")
+        if not data:
+            continue
+        # the command name may hold blanks and parentheses, the fields follow the last ")"
+        rparen = data.rfind(")")
+        fields = data[rparen + 2:].split(None, 22)
+        yield (int(pid), data[data.find("(") + 1:rparen], int(fields[19]), int(fields[11]) + int(fields[12]),
+               int(fields[20]), int(fields[21]) * PAGE_SIZE)
+
+
+def read_io_bytes(pid):
+    """Bytes the process caused to be read from or written to storage, 0 if /proc/<pid>/io is not readable."""
+    data = read_proc_file(PROC + "/" + str(pid) + "/io")
+    io_bytes = 0
+    if data:
+        for line in data.splitlines():
+            if line.startswith("read_bytes:") or line.startswith("write_bytes:"):
+                io_bytes += int(line.split()[1])
+    return io_bytes
+
+
+class ProcessSampler(Thread):
+    """ Thread scanning every process between polls into exponentially weighted averages of
+    cpu, io and resident memory per pid, so that short bursts between two polls are not missed """
+
+    def __init__(self, sample_interval, window):
+        Thread.__init__(self)
+        self.daemon = True
+        self.killed = False
+        self.lock = Lock()
+        self.sample_interval = sample_interval
+        # weight of a new sample, older samples fade out over one window
+        self.alpha = 1 - math.exp(-float(sample_interval) / window)
+        self.prev_uptime = None
+        # pid -> slot in the arrays below, slots of dead pids are reused
+        self.slots = {}
+        self.free_slots = []
+        self.names = []
+        self.start_times = array('L')
+        self.prev_ticks = array('L')
+        self.prev_io = array('L')
+        self.vsize = array('d')
+        self.cpu = array('d')
+        self.io = array('d')
+        self.rss = array('d')
+
+    def run(self):
+        """ Main thread entrypoint """
+        while not self.killed:
+            start = time.time()
+            try:
+                self.sample()
+            except (IOError, OSError, ValueError, IndexError) as err:
+                collectd.error("Plugin topstats: Unable to sample processes due to %s" % err)
+            time.sleep(max(self.sample_interval - (time.time() - start), 0))
+
+    def new_slot(self, pid):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = len(self.names)
+            self.names.append(None)
+            for values in (self.start_times, self.prev_ticks, self.prev_io, self.vsize, self.cpu, self.io,
+                           self.rss):
+                values.append(0)
+        self.slots[pid] = slot
+        return slot
+
+    def sample(self):
+        """ Scan every process once and fold it into the averages """
+        uptime = float(read_proc_file(PROC_UPTIME).split()[0])
+        elapsed = uptime - self.prev_uptime if self.prev_uptime is not None else 0
+        alpha = self.alpha
+        seen = set()
+        with self.lock:
+            for pid, name, start_time, ticks, vsize, rss in iter_processes():
+                io_bytes = read_io_bytes(pid)
+                seen.add(pid)
+                slot = self.slots.get(pid)
+                if slot is None or self.start_times[slot] != start_time:
+                    # new process, or the pid was reused since the last sample
+                    if slot is None:
+                        slot = self.new_slot(pid)
+                    lifetime = uptime - float(start_time) / CLOCK_TICKS
+                    self.start_times[slot] = start_time
+                    self.cpu[slot] = ticks * 100.0 / CLOCK_TICKS / lifetime if lifetime > 0 else 0.0
+                    self.io[slot] = 0.0
+                    self.rss[slot] = rss
+                elif elapsed > 0:
+                    self.cpu[slot] += alpha * ((ticks - self.prev_ticks[slot]) * 100.0 / CLOCK_TICKS / elapsed -
+                                               self.cpu[slot])
+                    self.io[slot] += alpha * (max(io_bytes - self.prev_io[slot], 0) / elapsed - self.io[slot])
+                    self.rss[slot] += alpha * (rss - self.rss[slot])
+                # exec changes the name of a running process
+                self.names[slot] = name
+                self.prev_ticks[slot] = ticks
+                self.prev_io[slot] = io_bytes
+                self.vsize[slot] = vsize
+            for pid in set(self.slots) - seen:
+                self.free_slots.append(self.slots.pop(pid))
+        self.prev_uptime = uptime
+
+    def top(self, count, key, name_filter=None):
+        """ Returns pid, name, cpu percent, io bytes per second, rss and vsize bytes of the
+        count processes with the highest average of key (cpu, io or rss) """
+        values = getattr(self, key)
+        with self.lock:
+            slots = self.slots.items()
+            if name_filter is not None:
+                slots = [(pid, slot) for pid, slot in slots if name_filter.search(self.names[slot])]
+            return [(pid, self.names[slot], self.cpu[slot], self.io[slot], self.rss[slot], self.vsize[slot])
+                    for pid, slot in heapq.nlargest(count, slots, key=lambda item: values[item[1]])]
+
 
 class TopStats(object):
     """Plugin object will be created only once and collects utils
@@ -30,6 +172,9 @@ class TopStats(object):
         self.utilize_type = utilize_type
         self.maximum_grep = maximum_grep
         self.process = process_name
+        self.sample_interval = TOPSTATS_SAMPLE_INTERVAL
+        self.sampler = None
+        self.users = {}
 
     def config(self, cfg):
         """Initializes variables from conf files."""
@@ -40,72 +185,57 @@ class TopStats(object):
                 self.utilize_type = children.values[0]
             if children.key == "process":
                 self.process = children.values[0]
+            if children.key == "sample_interval":
+                self.sample_interval = float(children.values[0])
 
-    def bytesConv(self, data):
-        """
-        Convert the memory to kb based on its unit
-            1 mb = 1024 kilobytes
-            1 gb = 1024 * 1024 kilobytes = 1048576 kb
-            1 tb = 1024 * 1024 * 1024 kilobytes = 1073741824 kb
-        """
-        data = str(data)
-        convVal = {'k' : 1, 'm' : 1024, 'g' : 1048576 , 't' : 1073741824}
-
-        splitVal = re.search('(\d*\.?\d*)',data).group()
-        splitUnit = re.search('([a-z])',data)
-
-        splitUnit = 'k' if not splitUnit else splitUnit.group()
-
-        if splitUnit in convVal:
-            data = float(splitVal) * convVal[splitUnit]
-        return data
+    def get_user(self, pid):
+        try:
+            uid = os.stat(PROC + "/" + str(pid)).st_uid
+        except OSError:
+            return ""
+        if uid not in self.users:
+            try:
+                self.users[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                self.users[uid] = str(uid)
+        return self.users[uid]
 
     def top_command(self):
         """
         Returns dictionary with values of available and top SPU and memory usage summary of teh process.
         """
-        #cmnd = "top -b -o +" + self.usage_parameter +" -n 1 | head -17 | sed -n '8,20p' | awk '{print $1, $2, $9, $10, $12}'"
-        head_value = 7 + int(self.maximum_grep)
+        name_filter = None
         if self.utilize_type == 'process':
-            if self.process != 'None' or self.process != '*':
-                proc = '|'.join(self.process.split(','))
-                cmnd = "top -b -o +%CPU -n 1 | grep -E '" + proc + "' | head -"+ str(head_value) + " | awk '{print $1, $2, $5, $6, $7, $9, $10, $12}'"
-            else:
-                cmnd = "top -b -o +%CPU -n 1 | head -" + str(head_value) + " | sed -n '8,20p' | awk '{print $1, $2, $5, $6, $7, $9, $10, $12}'"
-        elif self.utilize_type == "CPU" or self.utilize_type == "MEM":
-            cmnd = "top -b -o +%" + self.utilize_type + " -n 1 | head -" + str(head_value) + " | sed -n '8,20p' | awk '{print $1, $2, $5, $6, $7, $9, $10, $12}'"
+            if self.process not in ('None', '*'):
+                name_filter = re.compile('|'.join(self.process.split(',')))
+            key = "cpu"
+        elif self.utilize_type in ("CPU", "MEM", "IO"):
+            key = {"CPU": "cpu", "MEM": "rss", "IO": "io"}[self.utilize_type]
             self.process = "*"
-        process = subprocess.Popen(cmnd, shell=True, stdout=subprocess.PIPE)
+        else:
+            return []
+        mem_total = libprocfs.get_meminfo().get("MemTotal", 0)
         result = []
-        process_order = 1
-        while True:
+        top_procs = self.sampler.top(int(self.maximum_grep), key, name_filter)
+        for process_order, (pid, name, cpu, io, rss, vsize) in enumerate(top_procs, 1):
             top_stats_res = {}
-            line = process.stdout.readline()
-            if line != b'':
-                response = line.split(' ')
-                
-                # Memory usage Conversion
-                virt_mem = self.bytesConv(response[2])
-                resi_mem = self.bytesConv(response[3])
-                shrd_mem = self.bytesConv(response[4])
-
-                top_stats_res['order'] = process_order
-                top_stats_res['pid'] = long(response[0])
-                top_stats_res['user'] = response[1]
-                top_stats_res['virtual_memory'] = virt_mem
-                top_stats_res['resident_memory'] = resi_mem
-                top_stats_res['shared_memory'] = shrd_mem
-                top_stats_res['cpu'] = float(response[5])
-                top_stats_res['memory'] = float(response[6])
-                top_stats_res[PROCESSNAME ] = response[7].strip()
-                top_stats_res['process_group'] = self.process
-                top_stats_res['resource_type'] = self.utilize_type
-                
-                #os.write(1, line)
-                process_order   += 1
-                result.append(top_stats_res)
-            else:
-                break
+            # statm and the owner are only looked up for the selected processes
+            statm = read_proc_file(PROC + "/" + str(pid) + "/statm")
+            shrd_mem = int(statm.split()[2]) * PAGE_SIZE if statm else 0
+
+            top_stats_res['order'] = process_order
+            top_stats_res['pid'] = long(pid)
+            top_stats_res['user'] = self.get_user(pid)
+            top_stats_res['virtual_memory'] = vsize / 1024
+            top_stats_res['resident_memory'] = round(rss / 1024, FLOATING_FACTOR)
+            top_stats_res['shared_memory'] = float(shrd_mem) / 1024
+            top_stats_res['cpu'] = round(cpu, 1)
+            top_stats_res['memory'] = round(rss * 100.0 / mem_total, 1) if mem_total else 0.0
+            top_stats_res['io'] = round(io / 1024, FLOATING_FACTOR)
+            top_stats_res[PROCESSNAME] = name
+            top_stats_res['process_group'] = self.process
+            top_stats_res['resource_type'] = self.utilize_type
+            result.append(top_stats_res)
         return result
 
     def add_common_params(self, top_stats_res):
@@ -155,8 +285,16 @@ class TopStats(object):
         and read() is called again with interval obtained from conf by register_config callback.
         """
         collectd.unregister_read(self.read_temp)
+        if self.sampler is None:
+            self.sampler = ProcessSampler(min(self.sample_interval, int(self.interval)), int(self.interval))
+            self.sampler.start()
         collectd.register_read(self.read, interval=int(self.interval))
 
+    def shutdown(self):
+        if self.sampler is not None:
+            self.sampler.killed = True
+            self.sampler.join()
+
 
 def init():
     """When new process is formed, action to SIGCHLD is reset to default behavior."""
@@ -166,3 +304,4 @@ def init():
 OBJ = TopStats()
 collectd.register_config(OBJ.config)
 collectd.register_read(OBJ.read_temp)
+collectd.register_shutdown(OBJ.shutdown)
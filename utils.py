@@ -9,6 +9,7 @@
 
 
 import subprocess
+import time
 import write_json
 import collectd
 import socket
@@ -72,6 +73,15 @@ def get_cmd_output(cmd, shell_value=True, stdout_value=subprocess.PIPE,
     return call.communicate()
 
 
+def read_sysfs(path, default=None):
+    """Returns the stripped content of a sysfs attribute, default if it can not be read."""
+    try:
+        with open(path) as sysfs_file:
+            return sysfs_file.read().strip()
+    except (IOError, OSError):
+        return default
+
+
 def get_rate(key, curr_data, prev_data):
     """Calculate and returns rate. Rate=(current_value-prev_value)/time."""
     rate = NAN
@@ -103,3 +113,53 @@ def get_rate(key, curr_data, prev_data):
 
     rate = (curr_data[key] - prev_data[key]) / (curr_time - prev_time)
     return rate
+
+
+class CircuitBreaker(object):
+    """Decides whether a plugin may try to reach its target on this poll.
+
+    A failure opens the breaker and further attempts are refused until a backoff,
+    doubled on every consecutive failure, has passed on the wall clock. The next
+    attempt is a half-open probe that either closes the breaker again or re-opens
+    it with a longer backoff, so a dead target costs no waiting in the read callback.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "halfOpen"
+
+    def __init__(self, name, base_backoff=BREAKER_BASE_BACKOFF, max_backoff=BREAKER_MAX_BACKOFF):
+        self.name = name
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.retry_at = 0
+
+    def allow(self):
+        """Returns True if the target may be contacted now."""
+        if self.state == CircuitBreaker.CLOSED:
+            return True
+        if time.time() < self.retry_at:
+            return False
+        self.state = CircuitBreaker.HALF_OPEN
+        return True
+
+    def success(self):
+        if self.state != CircuitBreaker.CLOSED:
+            collectd.info("Connection to %s restored after %s failed attempts" % (self.name, self.failures))
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.retry_at = 0
+
+    def failure(self):
+        self.failures += 1
+        backoff = min(self.base_backoff * 2 ** (self.failures - 1), self.max_backoff)
+        self.retry_at = time.time() + backoff
+        self.state = CircuitBreaker.OPEN
+        collectd.error("Connection to %s failed %s times in a row, next attempt in %s sec"
+                       % (self.name, self.failures, backoff))
+
+    def get_metrics(self):
+        """State of the breaker, to be reported along with the plugin's own documents."""
+        return {"connectionState": self.state, "connectFailures": self.failures}